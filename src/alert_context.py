@@ -0,0 +1,176 @@
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ALERT_CONTEXT_TOKEN_BUDGET = int(os.environ.get("ALERT_CONTEXT_TOKEN_BUDGET", "4000"))
+# Rough prompt-size estimate; Gemini averages about four characters per token on English and label text.
+CHARS_PER_TOKEN = 4
+MAX_SAMPLE_VALUES = 5
+MAX_DISTINCT_TRACKED = 1000
+MAX_TEMPLATES = 5
+CONTEXT_ANNOTATIONS = ("summary", "description")
+
+SEVERITY_RANK = {"critical": 0, "page": 0, "error": 1, "high": 1, "warning": 2, "medium": 2, "info": 3, "low": 3}
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _format_number(value: float) -> str:
+    return f"{value:g}"
+
+
+class _Template:
+    """An annotation with its numbers lifted out, tracking each number's range across alerts."""
+
+    def __init__(self, numbers: List[float]):
+        self.count = 0
+        self.ranges = [[n, n] for n in numbers]
+
+    def add(self, numbers: List[float]) -> None:
+        self.count += 1
+        for slot, n in zip(self.ranges, numbers):
+            slot[0] = min(slot[0], n)
+            slot[1] = max(slot[1], n)
+
+    def render(self, pattern: str) -> str:
+        values = iter(self.ranges)
+
+        def _slot(_):
+            low, high = next(values)
+            return _format_number(low) if low == high else f"{{{_format_number(low)}–{_format_number(high)}}}"
+
+        return re.sub(r"\{n\}", _slot, pattern)
+
+
+class _AlertGroup:
+    """Every alert of one rule and severity, collapsed into counts, shared labels, samples and ranges."""
+
+    def __init__(self, alertname: str, severity: str):
+        self.alertname = alertname
+        self.severity = severity
+        self.count = 0
+        self.statuses: Dict[str, int] = {}
+        self.first_start: Optional[str] = None
+        self.last_start: Optional[str] = None
+        self.label_values: Dict[str, Dict[str, None]] = {}
+        self.templates: Dict[str, Dict[str, _Template]] = {key: {} for key in CONTEXT_ANNOTATIONS}
+        self.untemplated: Dict[str, int] = {key: 0 for key in CONTEXT_ANNOTATIONS}
+
+    def add(self, alert: Dict) -> None:
+        self.count += 1
+        status = alert.get("status") or "firing"
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+        starts_at = alert.get("startsAt")
+        if starts_at:
+            self.first_start = min(self.first_start or starts_at, starts_at)
+            self.last_start = max(self.last_start or starts_at, starts_at)
+
+        for key, value in (alert.get("labels") or {}).items():
+            if key in ("alertname", "severity"):
+                continue
+            values = self.label_values.setdefault(key, {})
+            if len(values) < MAX_DISTINCT_TRACKED:
+                values[value] = None
+
+        annotations = alert.get("annotations") or {}
+        for key in CONTEXT_ANNOTATIONS:
+            text = annotations.get(key)
+            if not text:
+                continue
+            numbers = [float(n) for n in _NUMBER.findall(text)]
+            pattern = _NUMBER.sub("{n}", text.replace("{", "(").replace("}", ")"))
+            templates = self.templates[key]
+            if pattern not in templates:
+                if len(templates) >= MAX_TEMPLATES:
+                    self.untemplated[key] += 1
+                    continue
+                templates[pattern] = _Template(numbers)
+            templates[pattern].add(numbers)
+
+    def rank(self) -> Tuple[int, bool]:
+        """Most severe first, then groups that are still firing."""
+        return SEVERITY_RANK.get(self.severity.lower(), 4), self.statuses.get("firing", 0) == 0
+
+    def render(self, detailed: bool = True) -> str:
+        statuses = ", ".join(f"{status} {n}" for status, n in sorted(self.statuses.items()))
+        window = ""
+        if self.first_start:
+            window = f", started {self.first_start}" if self.first_start == self.last_start else f", started {self.first_start} to {self.last_start}"
+        lines = [f"--- {self.alertname} ({self.severity or 'no severity'}) x{self.count}: {statuses}{window} ---"]
+
+        shared = [f"{key}={next(iter(values))}" for key, values in sorted(self.label_values.items()) if len(values) == 1]
+        varying = [(key, values) for key, values in sorted(self.label_values.items()) if len(values) > 1]
+        if shared:
+            lines.append("Labels: " + ", ".join(shared))
+        if varying:
+            parts = []
+            for key, values in varying:
+                distinct = f"{len(values)}+" if len(values) >= MAX_DISTINCT_TRACKED else str(len(values))
+                samples = ", ".join(list(values)[:MAX_SAMPLE_VALUES if detailed else 2])
+                parts.append(f"{key} ({distinct} values: {samples}{', ...' if len(values) > (MAX_SAMPLE_VALUES if detailed else 2) else ''})")
+            lines.append("Varying: " + "; ".join(parts))
+
+        for key in CONTEXT_ANNOTATIONS:
+            templates = sorted(self.templates[key].items(), key=lambda item: -item[1].count)
+            if not detailed:
+                templates = templates[:1]
+            for pattern, template in templates:
+                times = f" [{template.count}x]" if template.count > 1 else ""
+                lines.append(f"{key.capitalize()}: {template.render(pattern)}{times}")
+            if detailed and self.untemplated[key]:
+                lines.append(f"{key.capitalize()}: {self.untemplated[key]} more alerts with other wording")
+        return "\n".join(lines) + "\n"
+
+
+class AlertContextBuilder:
+    """
+    Folds an incident's alerts, page by page, into one group per (alertname,
+    severity) and renders the groups most important first until the token
+    budget runs out. Memory and prompt size depend on the number of rules, not
+    on the number of alerts.
+    """
+
+    def __init__(self):
+        self.groups: Dict[Tuple[str, str], _AlertGroup] = {}
+        self.total = 0
+
+    def add(self, alerts: Iterable[Dict]) -> None:
+        for alert in alerts:
+            labels = alert.get("labels") or {}
+            key = (labels.get("alertname", "unknown"), labels.get("severity", ""))
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = _AlertGroup(*key)
+            group.add(alert)
+            self.total += 1
+
+    def render(self, token_budget: int = ALERT_CONTEXT_TOKEN_BUDGET) -> str:
+        header = f"The following {self.total} related alerts are part of this incident, grouped by alert rule:\n"
+        parts = [header]
+        used = estimate_tokens(header)
+        # Stable sorts: rank, then most recently started, then largest.
+        groups = sorted(self.groups.values(), key=lambda group: group.count, reverse=True)
+        groups.sort(key=lambda group: group.last_start or "", reverse=True)
+        groups.sort(key=lambda group: group.rank())
+
+        for index, group in enumerate(groups):
+            remaining = groups[index + 1:]
+            # Keep room for the line that reports what was left out.
+            reserve = 30 if remaining else 0
+            for detailed in (True, False):
+                text = group.render(detailed)
+                cost = estimate_tokens(text)
+                if used + cost + reserve <= token_budget:
+                    parts.append(text)
+                    used += cost
+                    break
+            else:
+                omitted = groups[index:]
+                parts.append(f"... {len(omitted)} more alert groups ({sum(g.count for g in omitted)} alerts) omitted to fit the prompt.\n")
+                break
+        return "\n".join(parts)
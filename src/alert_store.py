@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+import redis.asyncio as aioredis
+import models
+
+ALERT_TTL_SECONDS = 7200
+ALERT_PAGE_SIZE = int(os.environ.get("ALERT_PAGE_SIZE", "200"))
+INTERNED_CACHE_MAX_ENTRIES = 4096
+
+# Alertmanager sends nanosecond fractions, datetime only parses up to microseconds.
+_FRACTION = re.compile(r"(\.\d{6})\d+")
+
+# Alerts are hashes with short field names so Redis keeps them listpack-encoded.
+# Labels and annotations shared by every alert of a rule in a payload are stored
+# once under a content-addressed key; each alert keeps only its own extras.
+FIELDS = {
+    "status": "st",
+    "startsAt": "sa",
+    "endsAt": "ea",
+    "generatorURL": "gu",
+}
+_SHARED_LABELS, _EXTRA_LABELS = "ls", "lx"
+_SHARED_ANNOTATIONS, _EXTRA_ANNOTATIONS = "as", "ax"
+ALL_FIELDS = ("status", "startsAt", "endsAt", "generatorURL", "labels", "annotations")
+
+
+def alert_key(fingerprint: str) -> str:
+    return f"prometheus:alert:{fingerprint}"
+
+
+def incident_alerts_key(incident_id: str) -> str:
+    """Sorted set of the incident's alert fingerprints, scored by startsAt."""
+    return f"incident:{incident_id}:alerts"
+
+
+def interned_key(digest: str) -> str:
+    return f"prometheus:interned:{digest}"
+
+
+def starts_at_score(starts_at: str) -> float:
+    try:
+        return datetime.fromisoformat(_FRACTION.sub(r"\1", starts_at).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def _compact(mapping: Dict[str, str]) -> str:
+    return json.dumps(mapping, separators=(",", ":"), sort_keys=True)
+
+
+def _intern(mapping: Dict[str, str], interned: Dict[str, str]) -> str:
+    encoded = _compact(mapping)
+    digest = hashlib.sha1(encoded.encode()).hexdigest()[:16]
+    interned[digest] = encoded
+    return digest
+
+
+def _shared_items(mappings: Sequence[Dict[str, str]]) -> Dict[str, str]:
+    shared = dict(mappings[0])
+    for mapping in mappings[1:]:
+        shared = {k: v for k, v in shared.items() if mapping.get(k) == v}
+    return shared
+
+
+def encode_alerts(alerts: Sequence[models.PrometheusAlert]) -> Tuple[Dict[str, Dict[str, str]], Dict[str, str]]:
+    """
+    Splits alerts into (fingerprint -> hash fields, digest -> interned JSON).
+    An alert repeated in the input is encoded once.
+    """
+    unique: Dict[str, models.PrometheusAlert] = {}
+    for alert in alerts:
+        if alert.fingerprint:
+            unique[alert.fingerprint] = alert
+
+    by_rule: Dict[str, List[models.PrometheusAlert]] = {}
+    for alert in unique.values():
+        by_rule.setdefault(alert.labels.get("alertname", ""), []).append(alert)
+
+    encoded: Dict[str, Dict[str, str]] = {}
+    interned: Dict[str, str] = {}
+    for rule_alerts in by_rule.values():
+        shared_labels = _shared_items([alert.labels for alert in rule_alerts])
+        shared_annotations = _shared_items([alert.annotations for alert in rule_alerts])
+        labels_digest = _intern(shared_labels, interned)
+        annotations_digest = _intern(shared_annotations, interned)
+
+        for alert in rule_alerts:
+            fields = {short: getattr(alert, name) for name, short in FIELDS.items() if getattr(alert, name)}
+            fields[_SHARED_LABELS] = labels_digest
+            fields[_SHARED_ANNOTATIONS] = annotations_digest
+            extra_labels = {k: v for k, v in alert.labels.items() if k not in shared_labels}
+            extra_annotations = {k: v for k, v in alert.annotations.items() if k not in shared_annotations}
+            if extra_labels:
+                fields[_EXTRA_LABELS] = _compact(extra_labels)
+            if extra_annotations:
+                fields[_EXTRA_ANNOTATIONS] = _compact(extra_annotations)
+            encoded[alert.fingerprint] = fields
+    return encoded, interned
+
+
+class _InternedCache:
+    """Interned sets are content-addressed and never change, so every process can keep them."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            value = self._entries.get(digest)
+            if value is not None:
+                self._entries.move_to_end(digest)
+            return value
+
+    def set(self, digest: str, value: Dict[str, str]) -> None:
+        with self._lock:
+            self._entries[digest] = value
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_interned_cache = _InternedCache(INTERNED_CACHE_MAX_ENTRIES)
+
+
+async def store_alerts(redis_client: aioredis.Redis, incident_id: str, alerts: Sequence[models.PrometheusAlert]) -> int:
+    """
+    Writes every alert, its interned label and annotation sets and the
+    incident's startsAt index in one MULTI/EXEC round trip. An alert is keyed by
+    fingerprint alone, so one that recurs across incidents is stored once and
+    referenced from each incident's index. Returns how many alerts were stored.
+    """
+    encoded, interned = encode_alerts(alerts)
+    if not encoded:
+        return 0
+
+    pipe = redis_client.pipeline(transaction=True)
+    for digest, value in interned.items():
+        pipe.set(interned_key(digest), value, ex=ALERT_TTL_SECONDS)
+    for fingerprint, fields in encoded.items():
+        pipe.delete(alert_key(fingerprint))
+        pipe.hset(alert_key(fingerprint), mapping=fields)
+        pipe.expire(alert_key(fingerprint), ALERT_TTL_SECONDS)
+    pipe.zadd(incident_alerts_key(incident_id), {fp: starts_at_score(fields["sa"]) for fp, fields in encoded.items()})
+    pipe.expire(incident_alerts_key(incident_id), ALERT_TTL_SECONDS)
+    await pipe.execute()
+    return len(encoded)
+
+
+async def count_alerts(redis_client: aioredis.Redis, incident_id: str) -> int:
+    return await redis_client.zcard(incident_alerts_key(incident_id))
+
+
+async def _load_interned(redis_client: aioredis.Redis, digests: set) -> Dict[str, Dict[str, str]]:
+    found = {}
+    missing = []
+    for digest in digests:
+        value = _interned_cache.get(digest)
+        if value is None:
+            missing.append(digest)
+        else:
+            found[digest] = value
+    if missing:
+        for digest, raw in zip(missing, await redis_client.mget([interned_key(d) for d in missing])):
+            value = json.loads(raw) if raw else {}
+            if raw:
+                _interned_cache.set(digest, value)
+            found[digest] = value
+    return found
+
+
+async def read_alerts(redis_client: aioredis.Redis, fingerprints: Sequence[str], fields: Sequence[str] = ALL_FIELDS) -> List[Dict]:
+    """
+    Reads only the requested fields of each alert, with one HMGET pipeline and at
+    most one MGET for interned sets this process has not seen. Expired alerts are dropped.
+    """
+    hash_fields = [FIELDS[name] for name in fields if name in FIELDS]
+    if "labels" in fields:
+        hash_fields += [_SHARED_LABELS, _EXTRA_LABELS]
+    if "annotations" in fields:
+        hash_fields += [_SHARED_ANNOTATIONS, _EXTRA_ANNOTATIONS]
+
+    pipe = redis_client.pipeline(transaction=False)
+    for fingerprint in fingerprints:
+        pipe.hmget(alert_key(fingerprint), hash_fields)
+    rows = [dict(zip(hash_fields, values)) for values in await pipe.execute()]
+
+    digests = {row[key] for row in rows for key in (_SHARED_LABELS, _SHARED_ANNOTATIONS) if row.get(key)}
+    interned = await _load_interned(redis_client, digests) if digests else {}
+
+    alerts = []
+    for fingerprint, row in zip(fingerprints, rows):
+        if not any(row.values()):
+            continue
+        alert = {"fingerprint": fingerprint}
+        for name in fields:
+            if name in FIELDS:
+                alert[name] = row.get(FIELDS[name])
+        if "labels" in fields:
+            alert["labels"] = {**interned.get(row.get(_SHARED_LABELS), {}), **json.loads(row.get(_EXTRA_LABELS) or "{}")}
+        if "annotations" in fields:
+            alert["annotations"] = {**interned.get(row.get(_SHARED_ANNOTATIONS), {}), **json.loads(row.get(_EXTRA_ANNOTATIONS) or "{}")}
+        alerts.append(alert)
+    return alerts
+
+
+async def iter_alert_pages(redis_client: aioredis.Redis, incident_id: str, page_size: int = ALERT_PAGE_SIZE, newest_first: bool = False, fields: Sequence[str] = ALL_FIELDS) -> AsyncIterator[List[Dict]]:
+    """
+    Yields the incident's alerts ordered by startsAt, `page_size` at a time, so
+    no single reply grows with the group. Alerts whose key expired are dropped.
+    """
+    key = incident_alerts_key(incident_id)
+    start = 0
+    while True:
+        fingerprints = await redis_client.zrange(key, start, start + page_size - 1, desc=newest_first)
+        if not fingerprints:
+            return
+        page = await read_alerts(redis_client, fingerprints, fields)
+        if page:
+            yield page
+        if len(fingerprints) < page_size:
+            return
+        start += page_size
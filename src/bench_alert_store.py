@@ -0,0 +1,129 @@
+"""
+Compares storing and reading an incident's alerts one command at a time as
+pretty-printed JSON with the pipelined, interned hash store, counting Redis
+round trips and the memory the keys take. Needs a local Redis;
+it writes to a scratch database that is flushed between runs.
+
+    python bench_alert_store.py --counts 10 100 500 2000 --db 15
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Callable, List
+import redis.asyncio as aioredis
+import alert_store
+import models
+
+
+class CountingRedis(aioredis.Redis):
+    """Counts one round trip per command sent directly and one per pipeline execute."""
+    round_trips = 0
+
+    async def execute_command(self, *args, **options):
+        CountingRedis.round_trips += 1
+        return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        execute = pipe.execute
+
+        async def counted_execute(raise_on_error=True):
+            CountingRedis.round_trips += 1
+            return await execute(raise_on_error)
+
+        pipe.execute = counted_execute
+        return pipe
+
+
+async def store_per_alert(redis_client: aioredis.Redis, incident_id: str, alerts: List[models.PrometheusAlert]) -> None:
+    """What store_prometheus_alerts did before, kept here as the baseline."""
+    alert_fingerprints = []
+    for alert in alerts:
+        alert_fingerprints.append(alert.fingerprint)
+        await redis_client.set(f"prometheus:alert:{alert.fingerprint}", alert.model_dump_json(indent=2), ex=7200)
+    if alert_fingerprints:
+        await redis_client.sadd(f"payload:{incident_id}", *alert_fingerprints)
+        await redis_client.expire(f"payload:{incident_id}", 7200)
+
+
+async def read_per_alert(redis_client: aioredis.Redis, incident_id: str) -> int:
+    fingerprints = await redis_client.smembers(f"payload:{incident_id}")
+    alerts = await redis_client.mget([f"prometheus:alert:{fp}" for fp in fingerprints])
+    return len([json.loads(alert) for alert in alerts if alert is not None])
+
+
+async def read_paged(redis_client: aioredis.Redis, incident_id: str) -> int:
+    count = 0
+    async for page in alert_store.iter_alert_pages(redis_client, incident_id, fields=("labels", "annotations")):
+        count += len(page)
+    return count
+
+
+def generate_alerts(count: int) -> List[models.PrometheusAlert]:
+    return [
+        models.PrometheusAlert(
+            status="firing",
+            labels={"alertname": f"HighLatency{i % 7}", "instance": f"api-{i}:9100", "job": "api", "severity": "critical"},
+            annotations={"summary": f"p99 latency high on api-{i}", "description": "p99 above 500ms for 5 minutes"},
+            startsAt=f"2024-05-01T12:{i // 60 % 60:02d}:{i % 60:02d}.123456789Z",
+            endsAt="0001-01-01T00:00:00Z",
+            generatorURL=None,
+            fingerprint=f"{i:016x}"
+        )
+        for i in range(count)
+    ]
+
+
+async def memory_kb(redis_client: aioredis.Redis) -> float:
+    total = 0
+    async for key in redis_client.scan_iter(count=1000):
+        total += await redis_client.memory_usage(key) or 0
+    return total / 1024
+
+
+async def measure(redis_client: aioredis.Redis, func: Callable, *args) -> tuple:
+    CountingRedis.round_trips = 0
+    start = time.perf_counter()
+    await func(redis_client, *args)
+    return (time.perf_counter() - start) * 1000, CountingRedis.round_trips
+
+
+async def run(counts: List[int], db: int, host: str, port: int) -> None:
+    redis_client = CountingRedis(host=host, port=port, db=db, decode_responses=True)
+    print(
+        f"{'alerts':>7} | {'store trips':>11} {'store ms':>9} | {'piped trips':>11} {'piped ms':>9} | "
+        f"{'read trips':>10} {'read ms':>8} | {'paged trips':>11} {'paged ms':>9} | {'json KB':>8} {'hash KB':>8}"
+    )
+    try:
+        for count in counts:
+            alerts = generate_alerts(count)
+            await redis_client.flushdb()
+            old_store_ms, old_store_trips = await measure(redis_client, store_per_alert, "bench", alerts)
+            old_read_ms, old_read_trips = await measure(redis_client, read_per_alert, "bench")
+            old_kb = await memory_kb(redis_client)
+            await redis_client.flushdb()
+            new_store_ms, new_store_trips = await measure(redis_client, alert_store.store_alerts, "bench", alerts)
+            new_read_ms, new_read_trips = await measure(redis_client, read_paged, "bench")
+            new_kb = await memory_kb(redis_client)
+            print(
+                f"{count:>7} | {old_store_trips:>11} {old_store_ms:>9.1f} | {new_store_trips:>11} {new_store_ms:>9.1f} | "
+                f"{old_read_trips:>10} {old_read_ms:>8.1f} | {new_read_trips:>11} {new_read_ms:>9.1f} | {old_kb:>8.1f} {new_kb:>8.1f}"
+            )
+        await redis_client.flushdb()
+    finally:
+        await redis_client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", nargs="+", type=int, default=[10, 100, 500, 2000], help="Alerts per incident.")
+    parser.add_argument("--db", type=int, default=15, help="Scratch Redis database, flushed by the benchmark.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    asyncio.run(run(args.counts, args.db, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
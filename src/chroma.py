@@ -1,12 +1,26 @@
 import chromadb
-import os
 import logging
-from chromadb.utils import embedding_functions
-from typing import Any, Union
+import redis
+from typing import Any, List, Union
+from gemini import GeminiEmbeddingFunction
+from lexical_index import get_index
 
 chromadb_client = chromadb.PersistentClient("./chroma_db")
-embedding_func = embedding_functions.GoogleGenerativeAiEmbeddingFunction(
-        api_key=os.environ["GEMINI_API_KEY"], task_type="RETRIEVAL_DOCUMENT")
+embedding_func = GeminiEmbeddingFunction(task_type="retrieval_document")
+redis_client = redis.Redis(host='localhost', port=6379, db=1, decode_responses=True)
+
+
+def collection_generation(collection_name: str) -> int:
+    """Counter bumped on every write to the collection, lets query caches in any process go stale."""
+    return int(redis_client.get(f"chroma:generation:{collection_name}") or 0)
+
+
+def _bump_generation(collection_name: str) -> None:
+    try:
+        redis_client.incr(f"chroma:generation:{collection_name}")
+    except Exception as e:
+        logging.error(f"Failed to bump generation for {collection_name}: {e}")
+
 
 def get_or_create_chroma_db(documents_to_embed: Union[None, Any], collection_name: str, metadata: Union[None, Any] = None, db_ids: Union[None, Any] = None, embed_function = embedding_func):
     collection = chromadb_client.get_or_create_collection(
@@ -23,5 +37,13 @@ def get_or_create_chroma_db(documents_to_embed: Union[None, Any], collection_nam
         metadatas=metadata,
         ids=db_ids
     )
-    
-    return collection
\ No newline at end of file
+    get_index(collection_name).upsert(db_ids, documents_to_embed, metadata)
+    _bump_generation(collection_name)
+
+    return collection
+
+def delete_from_chroma(collection_name: str, db_ids: List[str]):
+    collection = chromadb_client.get_or_create_collection(name=collection_name, embedding_function=embedding_func)
+    collection.delete(ids=db_ids)
+    get_index(collection_name).delete(db_ids)
+    _bump_generation(collection_name)
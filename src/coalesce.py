@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+from uuid import uuid4
+import redis.asyncio as aioredis
+from concurrency import REDIS_MAX_CONNECTIONS
+import correlation
+import models
+
+COALESCE_WINDOW_SECONDS = int(os.environ.get("COALESCE_WINDOW_SECONDS", "30"))
+INCIDENT_TTL_SECONDS = 7200
+
+redis_client = aioredis.Redis(host='localhost', port=6379, db=1, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS)
+
+
+class CoalesceDecision:
+    """What the webhook should do with a payload after coalescing."""
+    NEW = "new"            # first payload for a new incident, post a new Slack thread
+    UPDATE = "update"      # new alerts fired for, or correlated with, an open incident, reuse its thread
+    BUFFERED = "buffered"  # merged into a window that is already pending
+    DUPLICATE = "duplicate"  # nothing new has fired, reuse thread and summary
+
+    def __init__(self, action: str, incident_id: str, thread_ts: Optional[str] = None, summary: Optional[str] = None):
+        self.action = action
+        self.incident_id = incident_id
+        self.thread_ts = thread_ts
+        self.summary = summary
+
+
+def firing_fingerprints(payload: models.PrometheusWebhookPayload) -> List[str]:
+    return sorted({alert.fingerprint for alert in payload.alerts if alert.fingerprint and alert.status == "firing"})
+
+
+def coalesce_key(payload: models.PrometheusWebhookPayload) -> str:
+    """Hash of the groupKey plus the set of firing fingerprints."""
+    digest = hashlib.sha256(payload.groupKey.encode())
+    for fp in firing_fingerprints(payload):
+        digest.update(b"\0" + fp.encode())
+    return digest.hexdigest()
+
+
+def _group_key(payload: models.PrometheusWebhookPayload) -> str:
+    return f"coalesce:group:{hashlib.sha256(payload.groupKey.encode()).hexdigest()}"
+
+
+def _incident_key(incident_id: str) -> str:
+    """Thread and summary of an incident, shared by every alert group correlated into it."""
+    return f"coalesce:incident:{incident_id}"
+
+
+def _incident_groups_key(incident_id: str) -> str:
+    """The alert groups referencing an incident; it stays open until the last one resolves."""
+    return f"coalesce:incident:{incident_id}:groups"
+
+
+async def coalesce_payload(payload: models.PrometheusWebhookPayload, owner: Optional[str] = None) -> CoalesceDecision:
+    """
+    Records the payload against its alert group and decides whether it needs a new
+    incident, should be merged into a pending window, or carries nothing new. A
+    group seen for the first time joins an open incident its alerts correlate
+    with, so its alerts land in that incident's thread instead of a new one.
+
+    `owner` identifies the ingest job across retries. The job that opens a window
+    must post the thread and schedule the flush, then call mark_flush_scheduled;
+    if it fails before that, its retry gets the same decision again instead of
+    DUPLICATE. Opening a window clears the previous window's flush flag, so a
+    payload is never dropped while a window's flush is still unscheduled.
+    """
+    group_key = _group_key(payload)
+    fingerprints = firing_fingerprints(payload)
+    owner = owner or coalesce_key(payload)
+
+    incident_id = await redis_client.hget(group_key, "incident_id")
+    created = False
+    if incident_id is None:
+        correlated = await correlation.find_correlated_incident(redis_client, payload)
+        if await redis_client.hsetnx(group_key, "incident_id", correlated or str(uuid4())):
+            created = correlated is None
+        incident_id = await redis_client.hget(group_key, "incident_id")
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.expire(group_key, INCIDENT_TTL_SECONDS)
+    pipe.sadd(_incident_groups_key(incident_id), group_key)
+    pipe.expire(_incident_groups_key(incident_id), INCIDENT_TTL_SECONDS)
+    await pipe.execute()
+    await correlation.index_incident(redis_client, incident_id, payload)
+
+    seen_key = f"coalesce:seen:{incident_id}"
+    new_fingerprints = await redis_client.sadd(seen_key, *fingerprints) if fingerprints else 0
+    await redis_client.expire(seen_key, INCIDENT_TTL_SECONDS)
+
+    window_key = f"coalesce:window:{incident_id}"
+    thread_ts, summary, flush_scheduled = await redis_client.hmget(_incident_key(incident_id), "thread_ts", "summary", "flush_scheduled")
+    # A retry of the job that opened the window but failed before scheduling its flush.
+    resumed = await redis_client.get(window_key) == owner
+    if not created and not new_fingerprints and not resumed and thread_ts is not None and flush_scheduled:
+        return CoalesceDecision(CoalesceDecision.DUPLICATE, incident_id, thread_ts, summary)
+
+    pending_key = f"coalesce:pending:{incident_id}"
+    await redis_client.rpush(pending_key, payload.model_dump_json())
+    await redis_client.expire(pending_key, INCIDENT_TTL_SECONDS)
+
+    if not resumed:
+        if not await redis_client.set(window_key, owner, nx=True, ex=COALESCE_WINDOW_SECONDS):
+            return CoalesceDecision(CoalesceDecision.BUFFERED, incident_id, thread_ts, summary)
+        # The flag belongs to the previous window. Until this window's flush is scheduled, a retry of
+        # this job, even once the window key expired, must not be dropped as a duplicate.
+        await redis_client.hdel(_incident_key(incident_id), "flush_scheduled")
+
+    action = CoalesceDecision.NEW if thread_ts is None else CoalesceDecision.UPDATE
+    return CoalesceDecision(action, incident_id, thread_ts, summary)
+
+
+async def mark_flush_scheduled(incident_id: str) -> None:
+    """Called once the current window's flush is scheduled; only from then on can payloads be dropped as duplicates."""
+    await _set_incident_fields(incident_id, flush_scheduled="1")
+
+
+async def _set_incident_fields(incident_id: str, **fields: str) -> None:
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(_incident_key(incident_id), mapping=fields)
+    pipe.expire(_incident_key(incident_id), INCIDENT_TTL_SECONDS)
+    await pipe.execute()
+
+
+async def set_incident_thread(incident_id: str, thread_ts: str, channel_id: Optional[str] = None) -> None:
+    # conversations.replies needs the channel id to read the thread back once resolved.
+    fields = {"thread_ts": thread_ts, "channel_id": channel_id} if channel_id else {"thread_ts": thread_ts}
+    await _set_incident_fields(incident_id, **fields)
+
+
+async def set_incident_summary(incident_id: str, summary: str) -> None:
+    await _set_incident_fields(incident_id, summary=summary)
+
+
+async def close_incident(payload: models.PrometheusWebhookPayload) -> Optional[Dict]:
+    """
+    Detaches a resolved alert group from its incident so alerts firing again open
+    a new one. Returns the incident's id, thread_ts and channel_id, with
+    "open_groups" counting the correlated groups still firing, or None if the
+    group had no open incident. Only once the last group resolves is the
+    incident dropped from the correlation index.
+    """
+    group_key = _group_key(payload)
+    incident_id = await redis_client.hget(group_key, "incident_id")
+    if incident_id is None:
+        return None
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(group_key)
+    pipe.srem(_incident_groups_key(incident_id), group_key)
+    pipe.scard(_incident_groups_key(incident_id))
+    pipe.hgetall(_incident_key(incident_id))
+    _, _, open_groups, incident = await pipe.execute()
+
+    if not open_groups:
+        await correlation.forget_incident(redis_client, incident_id)
+    return {**incident, "incident_id": incident_id, "open_groups": open_groups}
+
+
+def merge_payloads(payloads: List[models.PrometheusWebhookPayload]) -> Optional[models.PrometheusWebhookPayload]:
+    """Merges every payload held during a window into one, latest alert per fingerprint wins."""
+    if not payloads:
+        return None
+
+    alerts = {}
+    for payload in payloads:
+        for alert in payload.alerts:
+            alerts[alert.fingerprint or alert.model_dump_json()] = alert
+
+    latest = payloads[-1]
+    merged_alerts = list(alerts.values())
+    return latest.model_copy(update={
+        "alerts": merged_alerts,
+        "truncatedAlerts": max(p.truncatedAlerts for p in payloads),
+        "status": "firing" if any(a.status == "firing" for a in merged_alerts) else latest.status,
+    })
+
+
+async def drain_pending(incident_id: str) -> Optional[models.PrometheusWebhookPayload]:
+    """Atomically takes every payload buffered for the incident and merges them."""
+    pending_key = f"coalesce:pending:{incident_id}"
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.lrange(pending_key, 0, -1)
+    pipe.delete(pending_key)
+    raw_payloads, _ = await pipe.execute()
+
+    payloads = [models.PrometheusWebhookPayload.model_validate(json.loads(raw)) for raw in raw_payloads]
+    return merge_payloads(payloads)
@@ -0,0 +1,186 @@
+import ast
+import bisect
+import hashlib
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from langchain_text_splitters import RecursiveCharacterTextSplitter, Language
+from symbol_index import Definition, complete_ranges
+
+# Runs inside the code indexing process pool: keep imports free of Chroma, Redis and the API clients.
+
+CODE_CHUNK_SIZE = 1500
+CODE_CHUNK_OVERLAP = 150
+
+# Definitions in languages without a parser here: def/class/fn/func/function/... followed by a name.
+_DEFINITION = re.compile(
+    r"^[ \t]*(?:(?:export|public|private|protected|internal|static|async|abstract|final|override|default|pub(?:\([^)]*\))?)[ \t]+)*"
+    r"(?:func[ \t]+(?:\([^)]*\)[ \t]*)?|(?:def|defp|defmodule|class|fn|function|interface|struct|enum|trait|impl|module|object|message|service|sub)[ \t]+)"
+    r"([A-Za-z_$][\w$.:]*)",
+    re.MULTILINE
+)
+
+ChunkedFile = Tuple[str, Optional[str], Optional[List[Dict]], List[Tuple[int, int, str]], Optional[str]]
+
+
+def get_langchain_language_from_extension(extension: str) -> Optional[Language]:
+
+    normalized_extension = extension.lstrip('.').lower()
+
+    extension_to_language_map = {
+        'cpp': 'cpp', 'cc': 'cpp', 'cxx': 'cpp', 'hpp': 'cpp', 'hxx': 'cpp',
+        'go': 'go',
+        'java': 'java',
+        'kt': 'kotlin', 'kts': 'kotlin',
+        'js': 'js', 'jsx': 'js',
+        'ts': 'ts', 'tsx': 'ts',
+        'php': 'php',
+        'proto': 'proto',
+        'py': 'python',
+        'rst': 'rst',
+        'rb': 'ruby',
+        'rs': 'rust',
+        'scala': 'scala', 'sc': 'scala',
+        'swift': 'swift',
+        'md': 'markdown', 'markdown': 'markdown',
+        'tex': 'latex',
+        'html': 'html', 'htm': 'html',
+        'sol': 'sol',
+        'cs': 'csharp',
+        'cbl': 'cobol', 'cob': 'cobol',
+        'c': 'c', 'h': 'c',
+        'lua': 'lua',
+        'pl': 'perl', 'pm': 'perl',
+        'hs': 'haskell', 'lhs': 'haskell',
+        'ex': 'elixir', 'exs': 'elixir',
+        'ps1': 'powershell', 'psm1': 'powershell', 'psd1': 'powershell',
+        'bas': 'visualbasic6', 'vb': 'visualbasic6'
+    }
+
+    language_string = extension_to_language_map.get(normalized_extension)
+
+    if language_string:
+        return language_string
+    else:
+        return None
+
+@lru_cache(maxsize=None)
+def _splitter(language: str) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter.from_language(
+        language=Language(language),
+        chunk_size=CODE_CHUNK_SIZE,
+        chunk_overlap=CODE_CHUNK_OVERLAP,
+        add_start_index=True
+    )
+
+
+def _python_definitions(text: str) -> List[Definition]:
+    definitions = []
+
+    def _visit(node, prefix: str):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                name = f"{prefix}{child.name}"
+                definitions.append((child.lineno, child.end_lineno, name))
+                _visit(child, f"{name}.")
+
+    _visit(ast.parse(text), "")
+    return sorted(definitions)
+
+
+def extract_definitions(text: str, language: str) -> List[Definition]:
+    """
+    (start_line, end_line, name) for every function, class or similar definition,
+    in line order. Python is parsed for exact qualified names and ranges; other
+    languages are matched line by line and have no known end line.
+    """
+    if language == "python":
+        try:
+            return _python_definitions(text)
+        except (SyntaxError, ValueError):
+            pass
+    return [(text.count("\n", 0, match.start()) + 1, None, match.group(1)) for match in _DEFINITION.finditer(text)]
+
+
+def _line_starts(text: str) -> List[int]:
+    starts = [0]
+    pos = text.find("\n")
+    while pos != -1:
+        starts.append(pos + 1)
+        pos = text.find("\n", pos + 1)
+    return starts
+
+
+def chunk_it(text: str, path: str, language: str, definitions: Optional[List[Definition]] = None, snippet: int = 120) -> List[Dict]:
+    """
+    Splits a source file with the language's splitter and tags each chunk with
+    its line range, the symbols defined in it and, when it defines none, the
+    symbol that encloses it.
+    """
+    line_starts = _line_starts(text)
+    if definitions is None:
+        definitions = extract_definitions(text, language)
+    definition_lines = [start for start, _, _ in definitions]
+    chunks = []
+
+    for index, document in enumerate(_splitter(language).create_documents([text])):
+        content = document.page_content
+        start_offset = document.metadata.get("start_index", -1)
+        if start_offset < 0:
+            start_offset = text.find(content)
+        line_start = bisect.bisect_right(line_starts, max(start_offset, 0))
+        line_end = line_start + content.count("\n")
+
+        lo = bisect.bisect_left(definition_lines, line_start)
+        hi = bisect.bisect_right(definition_lines, line_end)
+        defined = [name for _, _, name in definitions[lo:hi]]
+        enclosing = ""
+        for start, end, name in reversed(definitions[:lo]):
+            if end is None or end >= line_start:
+                enclosing = name
+                break
+
+        chunks.append({
+            "text": f"{path}\n{content}",
+            "metadata": {
+                "path": path,
+                "language": language,
+                "chunk_index": index,
+                "line_start": line_start,
+                "line_end": line_end,
+                "symbol": defined[0] if defined else enclosing,
+                "symbols": ",".join(defined[:20]),
+                "preview": content[:snippet],
+                "type": "code"
+            }
+        })
+    return chunks
+
+
+def chunk_files(root: str, files: List[Tuple[str, Optional[str]]]) -> List[ChunkedFile]:
+    """
+    Pool task: reads and hashes each (path, known_hash) file and chunks it only
+    when the hash changed. Returns (path, hash, chunks or None if unchanged,
+    definitions with line ranges, error).
+    """
+    results = []
+    for path, known_hash in files:
+        try:
+            with open(os.path.join(root, path), "rb") as f:
+                raw = f.read()
+            file_hash = hashlib.sha256(raw).hexdigest()
+            if file_hash == known_hash:
+                results.append((path, file_hash, None, [], None))
+                continue
+            if b"\0" in raw[:8192]:
+                results.append((path, file_hash, [], [], None))
+                continue
+            language = get_langchain_language_from_extension(os.path.splitext(path)[1])
+            text = raw.decode("utf-8", errors="replace")
+            definitions = extract_definitions(text, language)
+            chunks = chunk_it(text, path, language, definitions)
+            results.append((path, file_hash, chunks, complete_ranges(definitions, text.count("\n") + 1), None))
+        except Exception as e:
+            results.append((path, None, None, [], str(e)))
+    return results
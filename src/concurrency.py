@@ -0,0 +1,19 @@
+import asyncio
+import os
+
+# Upper bound on in-flight calls per downstream so a burst of alerts queues
+# here instead of exhausting connections or tripping provider rate limits.
+GEMINI_CONCURRENCY = int(os.environ.get("GEMINI_CONCURRENCY", "4"))
+SLACK_CONCURRENCY = int(os.environ.get("SLACK_CONCURRENCY", "2"))
+CHROMA_CONCURRENCY = int(os.environ.get("CHROMA_CONCURRENCY", "8"))
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", "32"))
+
+gemini_limiter = asyncio.Semaphore(GEMINI_CONCURRENCY)
+slack_limiter = asyncio.Semaphore(SLACK_CONCURRENCY)
+chroma_limiter = asyncio.Semaphore(CHROMA_CONCURRENCY)
+
+
+async def run_in_chroma(func, *args, **kwargs):
+    """Runs a blocking chromadb call on a worker thread, bounded by the chroma limiter."""
+    async with chroma_limiter:
+        return await asyncio.to_thread(func, *args, **kwargs)
@@ -0,0 +1,100 @@
+import os
+import time
+from typing import Dict, Optional
+import redis.asyncio as aioredis
+import models
+
+# Only incidents whose alerts were seen this recently can absorb new alert groups.
+CORRELATION_WINDOW_SECONDS = int(os.environ.get("CORRELATION_WINDOW_SECONDS", "600"))
+# A candidate must share labels worth at least this much, e.g. one service or one instance.
+CORRELATION_MIN_SCORE = float(os.environ.get("CORRELATION_MIN_SCORE", "2"))
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition(":")
+        if name:
+            weights[name] = float(weight or 1)
+    return weights
+
+
+# Label name -> weight of sharing a value for it. A job alone is a weak signal, a service or instance is not.
+CORRELATION_LABELS = _parse_weights(os.environ.get("CORRELATION_LABELS", "service:2,instance:2,job:1"))
+
+
+def label_key(name: str, value: str) -> str:
+    """Inverted index entry: incidents that had a firing alert with this label, scored by last seen."""
+    return f"correlate:label:{name}={value}"
+
+
+def correlation_keys(payload: models.PrometheusWebhookPayload) -> Dict[str, float]:
+    keys = {}
+    for alert in payload.alerts:
+        if alert.status != "firing":
+            continue
+        for name, weight in CORRELATION_LABELS.items():
+            value = alert.labels.get(name)
+            if value:
+                keys[label_key(name, value)] = weight
+    return keys
+
+
+async def find_correlated_incident(redis_client: aioredis.Redis, payload: models.PrometheusWebhookPayload, now: Optional[float] = None) -> Optional[str]:
+    """
+    The open incident sharing the most weighted labels with the payload's firing
+    alerts, seen within CORRELATION_WINDOW_SECONDS. One pipelined range read per
+    label value, so the cost depends on the payload and the window, not on history.
+    """
+    keys = correlation_keys(payload)
+    if not keys:
+        return None
+    now = now or time.time()
+
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.zrangebyscore(key, now - CORRELATION_WINDOW_SECONDS, "+inf", withscores=True)
+
+    scores: Dict[str, float] = {}
+    last_seen: Dict[str, float] = {}
+    for weight, entries in zip(keys.values(), await pipe.execute()):
+        for incident_id, seen in entries:
+            scores[incident_id] = scores.get(incident_id, 0.0) + weight
+            last_seen[incident_id] = max(last_seen.get(incident_id, 0.0), seen)
+
+    candidates = [incident_id for incident_id, score in scores.items() if score >= CORRELATION_MIN_SCORE]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda incident_id: (scores[incident_id], last_seen[incident_id]))
+
+
+def _incident_keys_key(incident_id: str) -> str:
+    """Every label key the incident was indexed under, so closing it can remove all of them."""
+    return f"correlate:incident:{incident_id}:keys"
+
+
+async def index_incident(redis_client: aioredis.Redis, incident_id: str, payload: models.PrometheusWebhookPayload, now: Optional[float] = None) -> None:
+    """Records the payload's labels against the incident and trims entries older than the window."""
+    keys = correlation_keys(payload)
+    if not keys:
+        return
+    now = now or time.time()
+
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.zadd(key, {incident_id: now})
+        pipe.zremrangebyscore(key, "-inf", now - CORRELATION_WINDOW_SECONDS)
+        pipe.expire(key, CORRELATION_WINDOW_SECONDS)
+    pipe.sadd(_incident_keys_key(incident_id), *keys)
+    pipe.expire(_incident_keys_key(incident_id), CORRELATION_WINDOW_SECONDS)
+    await pipe.execute()
+
+
+async def forget_incident(redis_client: aioredis.Redis, incident_id: str) -> None:
+    """Stops every label the incident was indexed under from pointing new alert groups at it."""
+    keys = await redis_client.smembers(_incident_keys_key(incident_id))
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.zrem(key, incident_id)
+    pipe.delete(_incident_keys_key(incident_id))
+    await pipe.execute()
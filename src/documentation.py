@@ -1,47 +1,71 @@
+import hashlib
+import json
 import logging
-from typing import Any, Dict, List
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, UploadFile, BackgroundTasks
-import re
+from fastapi import FastAPI, HTTPException, UploadFile, BackgroundTasks, File
 import redis
-from markdown import markdown
-from bs4 import BeautifulSoup, ResultSet
-from pypdf import PdfReader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from chroma import chromadb_client, get_or_create_chroma_db
-from gemini import GeminiEmbeddingFunction
+from chroma import delete_from_chroma, get_or_create_chroma_db
+from markdown_sections import parse_sections
+from pdf_pages import extract_page_range, init_pdf_worker, parse_pdf
+from retrieval import hybrid_query
+from utils import ARCHIVE_EXTENSIONS, UPLOAD_READ_SIZE, ArchiveBudget, ArchiveLimitError, batched, extract_archive, process_map_unordered, safe_archive_path
 
 load_dotenv()
 app = FastAPI()
 redis_client = redis.Redis(host='localhost', port=6379, db=1, decode_responses=True)
 
+DOC_EMBED_BATCH_SIZE = int(os.environ.get("DOC_EMBED_BATCH_SIZE", "100"))
+DOC_INGEST_WORKERS = int(os.environ.get("DOC_INGEST_WORKERS", "4"))
+# Processes per PDF. Up to DOC_INGEST_WORKERS PDFs extract at once, so the default splits the cores between them.
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(max(1, (os.cpu_count() or 1) // DOC_INGEST_WORKERS))))
+# Below this many pages a process pool costs more than it saves.
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "16"))
+PDF_PAGES_PER_TASK = 4
+DOC_UPLOAD_DIR = os.environ.get("DOC_UPLOAD_DIR", tempfile.gettempdir())
+DOC_JOB_TTL_SECONDS = 7 * 86400
+# Longest a single document may hold its index lock, so a crashed run does not block re-uploads forever.
+DOC_LOCK_SECONDS = int(os.environ.get("DOC_LOCK_SECONDS", "3600"))
+
+DOC_TYPES_BY_EXTENSION = {".md": "markdown", ".markdown": "markdown", ".pdf": "pdf"}
+
+_ingest_pool = ThreadPoolExecutor(max_workers=DOC_INGEST_WORKERS, thread_name_prefix="doc-ingest")
+
 def parse_md(file_content: bytes):
-    content_str = file_content.decode()
-    html = markdown(content_str, extensions=['fenced_code', 'tables'])
-    soup: BeautifulSoup = BeautifulSoup(html, 'html.parser')
-    sections = []
-    results: ResultSet[Any] = soup.find_all(re.compile('^h[1-3]$'))
-    for header in results:
-        section_content = []
-        for sub_header in header.find_next_siblings():
-            if sub_header.name and re.match('^h[1-3]$', sub_header.name) and int(sub_header.name[1]) <= int(header.name[1]):
-                break
-
-            if sub_header.name:
-                section_content.append(sub_header.get_text(separator=" ", strip=True))
-        
-        sections.append({
-            'header_level': int(header.name[1]),
-            'header_text': header.get_text(strip=True),
-            'content': '\n'.join(section_content)
-        })
-
-    return sections
-
-
-def parse_pdf(file_content):
-    pages = PdfReader(file_content)
-    return pages
+    """Splits markdown into h1-h3 section records in a single pass over its lines."""
+    return parse_sections(file_content.decode())
+
+
+def iter_pdf_pages(file_content: bytes, start_page: int = 1, end_page: Optional[int] = None, skip_pages: Iterable[int] = ()) -> Iterator[Tuple[int, str]]:
+    """
+    Yields (page_num, text) with each page's text extracted exactly once. Large
+    files are spread over a process pool and pages are yielded as they finish,
+    so they are not in page order.
+    """
+    if start_page < 1 or (end_page is not None and end_page < start_page):
+        raise ValueError(f"Invalid page range {start_page}-{end_page}")
+    reader = parse_pdf(file_content)
+    last_page = min(end_page or len(reader.pages), len(reader.pages))
+    skip = set(skip_pages)
+    page_indexes = [i for i in range(start_page - 1, last_page) if i + 1 not in skip]
+
+    if len(page_indexes) < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS <= 1:
+        for i in page_indexes:
+            yield i + 1, reader.pages[i].extract_text() or ""
+        return
+
+    tasks = batched(page_indexes, PDF_PAGES_PER_TASK)
+    for pages in process_map_unordered(extract_page_range, tasks, PDF_WORKERS, initializer=init_pdf_worker, initargs=(file_content,)):
+        yield from pages
 
 
 def chuck_it_markdown(contents: List[Dict], max_chuck_size: int = 512, chunk_overlap: int = 50, snippet: int = 75):
@@ -55,6 +79,7 @@ def chuck_it_markdown(contents: List[Dict], max_chuck_size: int = 512, chunk_ove
                     'metadata': {
                         'header_level': content['header_level'],
                         'header_text': content['header_text'],
+                        'heading_path': " > ".join(content.get('heading_path', [])),
                         "preview": sub[:snippet],
                         "type": "markdown"
                     },
@@ -65,6 +90,7 @@ def chuck_it_markdown(contents: List[Dict], max_chuck_size: int = 512, chunk_ove
                 'metadata': {
                     'header_level': content['header_level'],
                     'header_text': content['header_text'],
+                    'heading_path': " > ".join(content.get('heading_path', [])),
                     "preview": content["content"][:snippet],
                     "type": "markdown"
                 },
@@ -73,51 +99,31 @@ def chuck_it_markdown(contents: List[Dict], max_chuck_size: int = 512, chunk_ove
 
     return texts
 
-def chuck_it_pdf(content: PdfReader, max_chuck_size = 1024, chunk_overlap = 120, snippet: int = 75):
+def chuck_it_pdf(pages: Iterable[Tuple[int, str]], max_chuck_size = 1024, chunk_overlap = 120, snippet: int = 75) -> Iterator[Dict]:
+    """Splits already-extracted (page_num, text) pages into chunks as they arrive."""
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=max_chuck_size, chunk_overlap=chunk_overlap)
-    texts = []
 
-    for i, page in enumerate(content.pages):
-        if len(page.extract_text()) > max_chuck_size:
-            sub_texts = text_splitter.split_text(page.extract_text())
-            for sub in sub_texts:
-                texts.append(
-                    {
-                        "text": sub,
-                        "metadata" : {
-                            "preview": sub[:snippet],
-                            "page_num": i + 1,
-                            "type": "pdf"
-                        }
-                    })
-        else:
-            texts.append({
+    for page_num, page_text in pages:
+        sub_texts = text_splitter.split_text(page_text) if len(page_text) > max_chuck_size else [page_text]
+        for sub in sub_texts:
+            yield {
+                "text": sub,
                 "metadata": {
-                    "page_num": i + 1,
-                    "preview": page.extract_text()[:snippet],
+                    "preview": sub[:snippet],
+                    "page_num": page_num,
                     "type": "pdf"
-                },
-                "text": page.extract_text()
-            })
-
-    return texts
+                }
+            }
 
 def search_documentation(query_text, n_results: int = 3):
-    query_embedding_func = GeminiEmbeddingFunction(task_type="retrieval_query")
     try:
-        collection = chromadb_client.get_collection("client_documentation", embedding_function=query_embedding_func)
-
-        queries = collection.query(
-            query_texts=[query_text],
-            n_results=n_results
-        )
+        metadatas = hybrid_query("client_documentation", query_text, n_results)
 
         formatted_results = []
-        metadatas = queries.get('metadatas', [[]])[0]
 
         for meta in metadatas:
             if meta.get("type") == "markdown":
-                header = meta.get("header_text", "No header text")
+                header = meta.get("heading_path") or meta.get("header_text", "No header text")
                 snippet = meta.get("preview", "There is no text")
                 formatted_results.append(f"From header {header}, here is a snippet: \"{snippet}\"")
             elif meta.get("type") == "pdf":
@@ -130,41 +136,272 @@ def search_documentation(query_text, n_results: int = 3):
         logging.error(f"Failed to query ChromaDB collection 'client_documentation': {e}")
         return []
 
-def run_workflow(filename, filecontent, doc_type):
-    chunks = None
-    if doc_type == "markdown":
-        try:
-            parsed = parse_md(file_content=filecontent)
-            chunks = chuck_it_markdown(parsed)
-        except Exception as e:
-            logging.error(f"something went wrong with {filename}, its content type is {doc_type}, error: {e}")
-
-    elif doc_type == "pdf":
-        try:
-            parsed = parse_pdf(file_content=filecontent)
-            chunks = chuck_it_pdf(parsed)
-        except Exception as e:
-            logging.error(f"something went wrong with {filename}, its content type is {doc_type}, error: {e}")
-    
-    if chunks:
-        documents_to_embed = [chunk['text'] for chunk in chunks]
-        metadatas_to_store = [chunk['metadata'] for chunk in chunks]
-        ids_for_db = [f"{filename}-{i}" for i in range(len(chunks))]
+def document_key(path: str, source: Optional[str] = None) -> Optional[str]:
+    """
+    Identifies a document by its source-qualified path, e.g. "runbooks.zip/db/README.md",
+    so documents sharing a basename keep separate manifests and chunks. None if
+    the path would escape its source.
+    """
+    normalized = safe_archive_path(path) if path else None
+    if not normalized:
+        return None
+    return f"{source.strip('/')}/{normalized}" if source and source.strip("/") else normalized
+
+
+def _pdf_progress_key(document: str) -> str:
+    return f"doc:pdf_progress:{document}"
 
-        try:
+
+def _manifest_key(document: str) -> str:
+    return f"doc:manifest:{document}"
+
+
+def chunk_id(document: str, chunk: Dict) -> str:
+    """Content-addressed id: an unchanged chunk keeps its id across re-uploads."""
+    digest = hashlib.sha256(chunk['text'].encode())
+    digest.update(json.dumps(chunk['metadata'], sort_keys=True).encode())
+    return f"{document}-{digest.hexdigest()[:32]}"
+
+
+def load_manifest(document: str) -> Tuple[Optional[str], set]:
+    """Returns the file hash of the last complete index and the chunk ids stored for it."""
+    pipe = redis_client.pipeline()
+    pipe.hget(_manifest_key(document), "file_hash")
+    pipe.smembers(f"{_manifest_key(document)}:chunks")
+    file_hash, chunk_ids = pipe.execute()
+    return file_hash, chunk_ids
+
+
+def save_manifest(document: str, file_hash: Optional[str], chunk_ids: set) -> None:
+    pipe = redis_client.pipeline()
+    pipe.delete(f"{_manifest_key(document)}:chunks")
+    if chunk_ids:
+        pipe.sadd(f"{_manifest_key(document)}:chunks", *chunk_ids)
+    if file_hash:
+        pipe.hset(_manifest_key(document), "file_hash", file_hash)
+    else:
+        # A partial index must not let the next upload of this file be skipped.
+        pipe.hdel(_manifest_key(document), "file_hash")
+    pipe.execute()
+
+
+def index_document(document: str, file_hash: str, chunks: Iterable[Dict], complete: bool = True, on_batch=None) -> Dict[str, int]:
+    """
+    Embeds only chunks whose content-hash id is not in the document's manifest,
+    in DOC_EMBED_BATCH_SIZE batches. When `complete`, chunks from the previous
+    version that no longer exist are deleted and the manifest is replaced.
+    """
+    _, known_ids = load_manifest(document)
+    seen = set()
+    embedded = 0
+
+    for batch in batched(chunks, DOC_EMBED_BATCH_SIZE):
+        fresh = {}
+        for chunk in batch:
+            cid = chunk_id(document, chunk)
+            if cid not in seen and cid not in known_ids:
+                chunk['metadata']['source'] = document
+                fresh[cid] = chunk
+            seen.add(cid)
+
+        if fresh:
             get_or_create_chroma_db(
-                documents_to_embed=documents_to_embed,
+                documents_to_embed=[chunk['text'] for chunk in fresh.values()],
                 collection_name="client_documentation",
-                metadata=metadatas_to_store,
-                db_ids=ids_for_db
+                metadata=[chunk['metadata'] for chunk in fresh.values()],
+                db_ids=list(fresh)
             )
-            logging.info(f"Successfully stored {len(chunks)} chunks for {filename}.")
-        except Exception as e:
-            logging.error(f"Failed to store chunks for {filename} in ChromaDB: {e}")
+            embedded += len(fresh)
+        if on_batch:
+            on_batch(batch)
+
+    stale = known_ids - seen if complete else set()
+    if stale:
+        delete_from_chroma("client_documentation", list(stale))
+    save_manifest(document, file_hash if complete else None, seen if complete else known_ids | seen)
+    return {"chunks": len(seen), "embedded": embedded, "deleted": len(stale)}
+
+
+def run_pdf_workflow(document: str, filecontent: bytes, file_hash: str, start_page: int = 1, end_page: Optional[int] = None, resume: bool = False) -> Dict[str, int]:
+    """
+    Streams a PDF into the collection while later pages are still being
+    extracted. Finished pages are recorded in Redis, so with `resume` a failed
+    run skips them and continues where it stopped.
+    """
+    progress_key = _pdf_progress_key(document)
+    done_pages = redis_client.smembers(progress_key) if resume else set()
+    if not resume:
+        redis_client.delete(progress_key)
+
+    def _mark_pages(batch: List[Dict]):
+        # A page only counts once all of its chunks are stored; it may span two batches.
+        finished = {chunk['metadata']['page_num'] for chunk in batch} - {batch[-1]['metadata']['page_num']}
+        if finished:
+            redis_client.sadd(progress_key, *finished)
+
+    pages = iter_pdf_pages(filecontent, start_page, end_page, skip_pages=(int(p) for p in done_pages))
+    complete = start_page == 1 and end_page is None and not done_pages
+    result = index_document(document, file_hash, chuck_it_pdf(pages), complete=complete, on_batch=_mark_pages)
+
+    redis_client.delete(progress_key)
+    return result
+
+
+def index_file(document, filecontent, doc_type, start_page: int = 1, end_page: Optional[int] = None, resume: bool = False) -> Dict[str, int]:
+    """
+    Indexes one document, named by its document_key, and returns its chunk
+    counts. Raises on failure. Runs for the same document are serialized, so
+    neither deletes the other's chunks as stale.
+    """
+    file_hash = hashlib.sha256(filecontent).hexdigest()
+    with redis_client.lock(f"doc:lock:{document}", timeout=DOC_LOCK_SECONDS):
+        previous_hash, known_ids = load_manifest(document)
+        if previous_hash == file_hash and not resume:
+            logging.info(f"{document} is unchanged since it was last indexed, skipping.")
+            return {"chunks": len(known_ids), "embedded": 0, "deleted": 0, "skipped": 1}
+
+        if doc_type == "pdf":
+            return run_pdf_workflow(document, filecontent, file_hash, start_page, end_page, resume)
+        if doc_type == "markdown":
+            parsed = parse_md(file_content=filecontent)
+            return index_document(document, file_hash, chuck_it_markdown(parsed))
+        raise ValueError(f"Unsupported document type {doc_type}")
+
+
+def run_workflow(document, filecontent, doc_type, start_page: int = 1, end_page: Optional[int] = None, resume: bool = False):
+    try:
+        result = index_file(document, filecontent, doc_type, start_page, end_page, resume)
+        logging.info(f"Indexed {document}: {result['chunks']} chunks, {result['embedded']} embedded, {result['deleted']} stale deleted.")
+    except Exception as e:
+        logging.error(f"something went wrong with {document}, its content type is {doc_type}, error: {e}")
+
+# -------------------------------------Batch uploads-----------------------------------------------------------
+
+def _job_key(job_id: str) -> str:
+    return f"doc:job:{job_id}"
+
+
+def _doc_type(name: str) -> Optional[str]:
+    return DOC_TYPES_BY_EXTENSION.get(os.path.splitext(name)[1].lower())
+
+
+def _extract_archive(archive_path: str, job_dir: str, budget: ArchiveBudget) -> List[Tuple[str, str, str]]:
+    """Writes supported documents from a zip or tar to disk, returns (name, path, doc_type)."""
+    extracted = extract_archive(
+        archive_path,
+        destination=lambda name: os.path.join(job_dir, f"{uuid4().hex}-{os.path.basename(name)}"),
+        wanted=lambda name, size: _doc_type(name) is not None,
+        budget=budget,
+    )
+    return [(name, path, _doc_type(name)) for name, path in extracted]
+
+
+def _set_file_record(pipe, key: str, name: str, record: Dict) -> None:
+    pipe.hset(f"{key}:files", name, json.dumps(record))
+    # The files hash only exists once written to, so its TTL goes with every write.
+    pipe.expire(f"{key}:files", DOC_JOB_TTL_SECONDS)
+
+
+def _index_job_file(job_id: str, name: str, path: str, doc_type: str) -> None:
+    key = _job_key(job_id)
+    started = time.monotonic()
+    record = {"status": "running", "doc_type": doc_type}
+    pipe = redis_client.pipeline()
+    _set_file_record(pipe, key, name, record)
+    pipe.execute()
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        record.update(index_file(name, content, doc_type))
+        record["status"] = "done"
+    except Exception as e:
+        logging.error(f"Batch job {job_id} failed on {name}: {e}")
+        record.update({"status": "failed", "error": str(e)})
+    finally:
+        record["seconds"] = round(time.monotonic() - started, 3)
+        os.remove(path)
+
+    pipe = redis_client.pipeline()
+    _set_file_record(pipe, key, name, record)
+    pipe.hincrby(key, "failed" if record["status"] == "failed" else "done", 1)
+    pipe.hincrby(key, "chunks", record.get("chunks", 0))
+    pipe.hincrby(key, "embedded", record.get("embedded", 0))
+    pipe.execute()
+
+    counts = redis_client.hmget(key, "total", "done", "failed")
+    total, done, failed = (int(c or 0) for c in counts)
+    if done + failed >= total:
+        redis_client.hset(key, mapping={"status": "completed_with_errors" if failed else "completed", "finished_at": time.time()})
+
+
+def run_upload_job(job_id: str, job_dir: str, uploads: List[Tuple[str, str, Optional[str]]]) -> None:
+    """Expands archives and fans every document out to the ingest pool."""
+    key = _job_key(job_id)
+    documents = []
+    budget = ArchiveBudget()
+    for name, path, doc_type in uploads:
+        if name.lower().endswith(ARCHIVE_EXTENSIONS):
+            try:
+                # Members are keyed under the archive, so the same path in two archives is two documents.
+                documents.extend((f"{name}/{member}", member_path, member_type) for member, member_path, member_type in _extract_archive(path, job_dir, budget))
+            except ArchiveLimitError as e:
+                # Nothing of an oversized upload is indexed; its extracted files go with the job directory.
+                logging.error(f"Batch job {job_id} rejected: {e}")
+                redis_client.hset(key, mapping={"status": "failed", "error": str(e), "finished_at": time.time()})
+                shutil.rmtree(job_dir, ignore_errors=True)
+                return
+            except (zipfile.BadZipFile, tarfile.TarError) as e:
+                pipe = redis_client.pipeline()
+                _set_file_record(pipe, key, name, {"status": "failed", "error": f"Unreadable archive: {e}"})
+                pipe.hincrby(key, "failed", 1)
+                pipe.execute()
+            finally:
+                if os.path.exists(path):
+                    os.remove(path)
+        elif doc_type:
+            documents.append((name, path, doc_type))
+
+    redis_client.hset(key, mapping={"status": "running", "total": len(documents) + int(redis_client.hget(key, "failed") or 0)})
+    if not documents:
+        redis_client.hset(key, "status", "completed_with_errors" if redis_client.hget(key, "failed") else "completed")
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return
+
+    futures = [_ingest_pool.submit(_index_job_file, job_id, name, path, doc_type) for name, path, doc_type in documents]
+    # The job directory goes away once the last file is indexed.
+    remaining = [len(futures)]
+
+    def _cleanup(_):
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    for future in futures:
+        future.add_done_callback(_cleanup)
+
+
+def get_job_status(job_id: str) -> Optional[Dict]:
+    pipe = redis_client.pipeline()
+    pipe.hgetall(_job_key(job_id))
+    pipe.hgetall(f"{_job_key(job_id)}:files")
+    job, files = pipe.execute()
+    if not job:
+        return None
+    job["files"] = {name: json.loads(record) for name, record in files.items()}
+    return job
 
 
 @app.post("/upload_doc")
-async def upload_document(file: UploadFile, background: BackgroundTasks):
+async def upload_document(file: UploadFile, background: BackgroundTasks, start_page: int = 1, end_page: Optional[int] = None, resume: bool = False, source: Optional[str] = None):
+    """`source` (e.g. a team or wiki space) qualifies the file's path, so same-named documents from different sources stay apart."""
+
+    document = document_key(file.filename or "", source)
+    if document is None:
+        raise HTTPException(status_code=422, detail="Invalid file name")
+    if start_page < 1:
+        raise HTTPException(status_code=422, detail="start_page must be 1 or greater")
+    if end_page is not None and end_page < start_page:
+        raise HTTPException(status_code=422, detail="end_page must not be before start_page")
 
     mime_type = file.content_type
                 
@@ -177,13 +414,55 @@ async def upload_document(file: UploadFile, background: BackgroundTasks):
     else:
         raise HTTPException(status_code=404, detail="File not supported, must be a md or pdf file")
     
-    background.add_task(run_workflow, file.filename, content, type)
+    background.add_task(run_workflow, document, content, type, start_page, end_page, resume)
 
-    
-    
-        
 
+@app.post("/upload_docs")
+async def upload_documents(background: BackgroundTasks, files: List[UploadFile] = File(...), source: Optional[str] = None):
+    """
+    Accepts many markdown/PDF files and zip or tar archives of them. Files are
+    streamed to disk and indexed by a worker pool; poll /upload_docs/{job_id}.
+    Documents are keyed by `source`, the uploaded path and, for archives, the
+    member path.
+    """
+    job_id = str(uuid4())
+    job_dir = tempfile.mkdtemp(prefix=f"doc-job-{job_id}-", dir=DOC_UPLOAD_DIR)
+    uploads = []
+    rejected = []
 
-    
+    for upload in files:
+        name = document_key(upload.filename or "", source)
+        basename = os.path.basename(name or "")
+        is_archive = basename.lower().endswith(ARCHIVE_EXTENSIONS)
+        doc_type = _doc_type(basename) or {"text/markdown": "markdown", "application/pdf": "pdf"}.get(upload.content_type)
+        if not basename or not (is_archive or doc_type):
+            rejected.append(upload.filename)
+            continue
+        if any(name == existing for existing, _, _ in uploads):
+            # Same document key twice in one job: both would index, and race, under one manifest.
+            rejected.append(upload.filename)
+            continue
+
+        path = os.path.join(job_dir, f"upload-{len(uploads)}-{basename}")
+        with open(path, "wb") as out:
+            while chunk := await upload.read(UPLOAD_READ_SIZE):
+                out.write(chunk)
+        uploads.append((name, path, doc_type))
+
+    if not uploads:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=404, detail="No supported files, must be md, pdf, zip or tar")
+
+    key = _job_key(job_id)
+    redis_client.hset(key, mapping={"status": "queued", "created_at": time.time(), "total": 0, "done": 0, "failed": 0})
+    redis_client.expire(key, DOC_JOB_TTL_SECONDS)
+    background.add_task(run_upload_job, job_id, job_dir, uploads)
+    return {"job_id": job_id, "files": len(uploads), "rejected": rejected}
 
 
+@app.get("/upload_docs/{job_id}")
+async def upload_job_status(job_id: str):
+    job = get_job_status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job
@@ -0,0 +1,132 @@
+import array
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List
+import redis
+
+EMBEDDING_CACHE_BACKEND = os.environ.get("EMBEDDING_CACHE_BACKEND", "sqlite")
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite")
+EMBEDDING_CACHE_TTL_SECONDS = int(os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", str(30 * 86400)))
+# The SQLite store drops its oldest entries above this many.
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+
+
+def cache_key(model: str, task_type: str, text: str) -> str:
+    return f"{model}:{task_type.lower()}:{hashlib.sha256(text.encode()).hexdigest()}"
+
+
+def _pack(vector: List[float]) -> bytes:
+    return array.array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    vector = array.array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class SqliteEmbeddingStore:
+    """
+    Local on-disk store, vectors are kept as packed float32. The file is opened
+    on first use, entries expire after `ttl` seconds and the oldest are evicted
+    above `max_entries`.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, ttl: int = EMBEDDING_CACHE_TTL_SECONDS, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Called with the lock held.
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(embeddings)")}
+            if "stored_at" not in columns:
+                # Caches written before entries expired count as stored now.
+                conn.execute(f"ALTER TABLE embeddings ADD COLUMN stored_at REAL NOT NULL DEFAULT {time.time()}")
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_stored_at ON embeddings (stored_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(keys)
+        found = {}
+        if not keys:
+            return found
+        oldest = time.time() - self.ttl
+        with self._lock:
+            conn = self._connection()
+            # Stay under SQLite's default bound-parameter limit.
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE stored_at >= ? AND key IN ({','.join('?' * len(batch))})", [oldest, *batch]
+                ).fetchall()
+                found.update({key: _unpack(blob) for key, blob in rows})
+        return found
+
+    def set_many(self, vectors: Dict[str, List[float]]) -> None:
+        if not vectors:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, stored_at) VALUES (?, ?, ?)",
+                [(key, _pack(vector), now) for key, vector in vectors.items()]
+            )
+            conn.execute("DELETE FROM embeddings WHERE stored_at < ?", (now - self.ttl,))
+            overflow = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY stored_at LIMIT ?)", (overflow,)
+                )
+            conn.commit()
+
+
+class RedisEmbeddingStore:
+    """Shared store for several hosts, entries expire after EMBEDDING_CACHE_TTL_SECONDS."""
+
+    def __init__(self):
+        self._client = redis.Redis(host='localhost', port=6379, db=1)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        blobs = self._client.mget([f"embedding:{key}" for key in keys])
+        return {key: _unpack(blob) for key, blob in zip(keys, blobs) if blob is not None}
+
+    def set_many(self, vectors: Dict[str, List[float]]) -> None:
+        pipe = self._client.pipeline(transaction=False)
+        for key, vector in vectors.items():
+            pipe.set(f"embedding:{key}", _pack(vector), ex=EMBEDDING_CACHE_TTL_SECONDS)
+        pipe.execute()
+
+
+class NullEmbeddingStore:
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        return {}
+
+    def set_many(self, vectors: Dict[str, List[float]]) -> None:
+        pass
+
+
+def build_store():
+    if EMBEDDING_CACHE_BACKEND == "redis":
+        return RedisEmbeddingStore()
+    if EMBEDDING_CACHE_BACKEND == "none":
+        return NullEmbeddingStore()
+    return SqliteEmbeddingStore()
+
+
+embedding_store = build_store()
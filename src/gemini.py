@@ -1,17 +1,110 @@
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from chromadb import EmbeddingFunction
+import asyncio
+import logging
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from concurrency import gemini_limiter
+from embedding_cache import cache_key, embedding_store
 gemini = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+async_gemini = gemini.aio
+
+# batchEmbedContents accepts at most 100 inputs per request.
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "100"))
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))
+# Retries after the first attempt, so 0 still embeds once.
+EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", "5"))
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+_embed_pool = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="gemini-embed")
+
+
+def _embed_config(task_type: str) -> types.EmbedContentConfig:
+    # The API takes the TaskType enum name, e.g. RETRIEVAL_DOCUMENT.
+    return types.EmbedContentConfig(task_type=task_type.upper())
+
+
+def _missing(keys: List[str], texts: List[str], vectors: Dict[str, List[float]]) -> Dict[str, str]:
+    """Texts whose key missed the cache, once per key."""
+    missing: Dict[str, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in vectors:
+            missing.setdefault(key, text)
+    return missing
 
 
 class GeminiEmbeddingFunction(EmbeddingFunction):
-    def __init__(self, task_type="retrieval_document"):
+    """
+    Embeds through a content-hash cache keyed by (model, task_type, sha256(text)).
+    Only texts that miss the cache reach the API, deduplicated and split into
+    batches of EMBED_BATCH_SIZE that run concurrently with retry and backoff.
+    """
+    def __init__(self, task_type="retrieval_document", store=embedding_store):
         self.task_type = task_type
         self.model = 'models/text-embedding-004'
+        self.store = store
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            try:
+                response = gemini.models.embed_content(
+                    model=self.model,
+                    contents=texts,
+                    config=_embed_config(self.task_type)
+                )
+                return [embedding.values for embedding in response.embeddings]
+            except errors.APIError as e:
+                if e.code not in RETRYABLE_CODES or attempt == EMBED_MAX_RETRIES:
+                    raise
+                delay = (2 ** attempt) + random.random()
+                logging.warning(f"Embedding batch of {len(texts)} failed with {e.code}, retrying in {delay:.1f}s")
+                time.sleep(delay)
 
     def __call__(self, input):
-        out = genai.embed_content(model=self.model,
-                                  content=input,
-                                  task_type=self.task_type)
-        return out.embedding
\ No newline at end of file
+        texts = [input] if isinstance(input, str) else list(input)
+        keys = [cache_key(self.model, self.task_type, text) for text in texts]
+        vectors: Dict[str, List[float]] = self.store.get_many(set(keys))
+        missing = _missing(keys, texts, vectors)
+
+        if missing:
+            missing_keys = list(missing)
+            batches = [missing_keys[i:i + EMBED_BATCH_SIZE] for i in range(0, len(missing_keys), EMBED_BATCH_SIZE)]
+            results = _embed_pool.map(lambda batch: self._embed_batch([missing[k] for k in batch]), batches)
+            fresh = {}
+            for batch, embedded in zip(batches, results):
+                fresh.update(zip(batch, embedded))
+            self.store.set_many(fresh)
+            vectors.update(fresh)
+
+        return [vectors[key] for key in keys]
+
+
+async def embed_texts_async(texts: List[str], task_type: str = "retrieval_document", model: str = 'models/text-embedding-004', store=embedding_store) -> List[List[float]]:
+    """
+    Embeds texts with the async client through the same cache as
+    GeminiEmbeddingFunction; misses are sent in batches bounded by the gemini limiter.
+    """
+    keys = [cache_key(model, task_type, text) for text in texts]
+    vectors: Dict[str, List[float]] = await asyncio.to_thread(store.get_many, set(keys))
+    missing = _missing(keys, texts, vectors)
+
+    missing_keys = list(missing)
+    fresh = {}
+    for i in range(0, len(missing_keys), EMBED_BATCH_SIZE):
+        batch = missing_keys[i:i + EMBED_BATCH_SIZE]
+        async with gemini_limiter:
+            response = await async_gemini.models.embed_content(
+                model=model,
+                contents=[missing[key] for key in batch],
+                config=_embed_config(task_type)
+            )
+        fresh.update(zip(batch, (embedding.values for embedding in response.embeddings)))
+    if fresh:
+        await asyncio.to_thread(store.set_many, fresh)
+        vectors.update(fresh)
+
+    return [vectors[key] for key in keys]
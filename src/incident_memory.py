@@ -0,0 +1,122 @@
+import functools
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+import redis.asyncio as aioredis
+from chroma import chromadb_client
+from concurrency import REDIS_MAX_CONNECTIONS, run_in_chroma
+from gemini import embed_texts_async
+import models
+
+COLLECTION_NAME = "incidents"
+# Cosine distance under which a resolved incident counts as the same problem, i.e. similarity >= 0.9.
+INCIDENT_MEMORY_MAX_DISTANCE = float(os.environ.get("INCIDENT_MEMORY_MAX_DISTANCE", "0.1"))
+MAX_RESOLUTION_CHARS = 4000
+# A resolution that arrives before its incident is stored waits here until remember_incident merges it.
+PENDING_RESOLUTION_PREFIX = "incident:memory:pending_resolution"
+PENDING_RESOLUTION_TTL_SECONDS = int(os.environ.get("PENDING_RESOLUTION_TTL_SECONDS", "86400"))
+
+redis_client = aioredis.Redis(host='localhost', port=6379, db=1, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS)
+
+
+@functools.lru_cache(maxsize=None)
+def _collection():
+    return chromadb_client.get_or_create_collection(name=COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+
+
+async def embed_summary(summary: str) -> Optional[List[float]]:
+    try:
+        return (await embed_texts_async([summary], task_type="semantic_similarity"))[0]
+    except Exception as e:
+        logging.error(f"Failed to embed incident summary: {e}")
+        return None
+
+
+def _resolved(metadata: Dict, resolution: str) -> Dict:
+    return {**metadata, "resolved": True, "resolution": resolution[:MAX_RESOLUTION_CHARS], "updated_at": time.time()}
+
+
+async def remember_incident(incident_id: str, summary: str, payload: models.PrometheusWebhookPayload, embedding: Optional[List[float]]) -> None:
+    """
+    Stores the incident's summary embedding and alert labels; it becomes reusable
+    once resolved. A resolution recorded before this ran, or by an earlier
+    attempt, is kept.
+    """
+    if embedding is None:
+        return
+    metadata = {
+        "labels": json.dumps(payload.commonLabels, sort_keys=True),
+        "alertname": payload.commonLabels.get("alertname", ""),
+        "service": payload.commonLabels.get("service", ""),
+        "resolved": False,
+        "updated_at": time.time(),
+    }
+    pending_key = f"{PENDING_RESOLUTION_PREFIX}:{incident_id}"
+    try:
+        resolution = await redis_client.get(pending_key)
+        if resolution is None:
+            existing = await run_in_chroma(_collection().get, ids=[incident_id], include=["metadatas"])
+            if existing.get("ids"):
+                resolution = (existing["metadatas"][0] or {}).get("resolution")
+        if resolution:
+            metadata = _resolved(metadata, resolution)
+        await run_in_chroma(_collection().upsert, ids=[incident_id], embeddings=[embedding], documents=[summary], metadatas=[metadata])
+        await redis_client.delete(pending_key)
+    except Exception as e:
+        logging.error(f"Failed to store incident {incident_id} in memory: {e}")
+
+
+async def _update_resolution(incident_id: str, resolution: str) -> bool:
+    existing = await run_in_chroma(_collection().get, ids=[incident_id], include=["metadatas"])
+    if not existing.get("ids"):
+        return False
+    metadata = _resolved(dict(existing["metadatas"][0] or {}), resolution)
+    await run_in_chroma(_collection().update, ids=[incident_id], metadatas=[metadata])
+    return True
+
+
+async def record_resolution(incident_id: str, resolution: str) -> bool:
+    """
+    Attaches the resolution thread content to a remembered incident. If the
+    incident is not stored yet, the resolution is held under its id for
+    remember_incident to merge. Returns False if there was nothing to record.
+    """
+    if not resolution:
+        return False
+    if await _update_resolution(incident_id, resolution):
+        return True
+
+    logging.info(f"Incident {incident_id} has no stored summary yet, holding its resolution")
+    await redis_client.set(f"{PENDING_RESOLUTION_PREFIX}:{incident_id}", resolution[:MAX_RESOLUTION_CHARS], ex=PENDING_RESOLUTION_TTL_SECONDS)
+    # remember_incident may have read the pending key just before it was set.
+    await _update_resolution(incident_id, resolution)
+    return True
+
+
+async def find_similar_incident(embedding: Optional[List[float]]) -> Optional[Dict]:
+    """The nearest resolved incident within INCIDENT_MEMORY_MAX_DISTANCE, or None."""
+    if embedding is None:
+        return None
+    try:
+        result = await run_in_chroma(
+            _collection().query, query_embeddings=[embedding], n_results=1,
+            where={"resolved": True}, include=["documents", "metadatas", "distances"]
+        )
+    except Exception as e:
+        logging.error(f"Incident memory lookup failed: {e}")
+        return None
+
+    ids = result.get("ids", [[]])[0]
+    distances = result.get("distances", [[]])[0]
+    if not ids or distances[0] > INCIDENT_MEMORY_MAX_DISTANCE:
+        return None
+    metadata = result["metadatas"][0][0] or {}
+    return {
+        "incident_id": ids[0],
+        "summary": result["documents"][0][0],
+        "resolution": metadata.get("resolution", ""),
+        "labels": json.loads(metadata.get("labels") or "{}"),
+        "similarity": 1 - distances[0],
+    }
@@ -0,0 +1,139 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LEXICAL_INDEX_DIR = os.environ.get("LEXICAL_INDEX_DIR", "./chroma_db/bm25")
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Terms in more than this share of documents add almost nothing to BM25 but cost a
+# scan of their whole posting list, so they are not scored.
+COMMON_TERM_RATIO = 0.1
+
+# Identifiers such as node_cpu_seconds_total, api-gateway-7f9c:9100 or ERR_CONN_RESET
+# are kept whole, and their parts are indexed as well.
+_TOKEN = re.compile(r"[a-z0-9_](?:[a-z0-9_.:/\-]*[a-z0-9_])?")
+_PARTS = re.compile(r"[.:/\-]+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        parts = [part for part in _PARTS.split(token) if part]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """SQLite-backed inverted index kept next to one Chroma collection."""
+
+    def __init__(self, collection_name: str, directory: str = LEXICAL_INDEX_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.collection_name = collection_name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, f"{collection_name}.sqlite"), check_same_thread=False)
+        with self._lock:
+            self._conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, length INTEGER NOT NULL, metadata TEXT);
+                CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, doc_id));
+                CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+            """)
+            self._conn.commit()
+
+    def _delete_locked(self, ids: Sequence[str]) -> None:
+        for i in range(0, len(ids), 500):
+            batch = list(ids[i:i + 500])
+            marks = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM postings WHERE doc_id IN ({marks})", batch)
+            self._conn.execute(f"DELETE FROM docs WHERE id IN ({marks})", batch)
+
+    def upsert(self, ids: Sequence[str], documents: Sequence[str], metadatas: Optional[Sequence[Optional[Dict]]] = None) -> None:
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            self._delete_locked(ids)
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                counts = Counter(tokenize(document or ""))
+                self._conn.execute(
+                    "INSERT INTO docs (id, length, metadata) VALUES (?, ?, ?)",
+                    (doc_id, sum(counts.values()), json.dumps(metadata) if metadata is not None else None)
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in counts.items()]
+                )
+            self._conn.commit()
+
+    def delete(self, ids: Sequence[str]) -> None:
+        with self._lock:
+            self._delete_locked(ids)
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self, query: str, n_results: int = 10) -> Tuple[List[Tuple[str, float]], float]:
+        """
+        Returns the top (doc_id, score) pairs and a confidence in [0, 1]: the best
+        score divided by the score of an average-length document containing every
+        query term once.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return [], 0.0
+
+        with self._lock:
+            n_docs, total_length = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+            if not n_docs:
+                return [], 0.0
+            marks = ",".join("?" * len(terms))
+            dfs = dict(self._conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({marks}) GROUP BY term", terms
+            ).fetchall())
+            scored = [term for term, df in dfs.items() if df <= max(1, COMMON_TERM_RATIO * n_docs)] or list(dfs)
+            rows = []
+            if scored:
+                scored_marks = ",".join("?" * len(scored))
+                rows = self._conn.execute(
+                    f"SELECT p.term, p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id WHERE p.term IN ({scored_marks})",
+                    scored
+                ).fetchall()
+
+        avg_length = total_length / n_docs
+        idf = {term: math.log(1 + (n_docs - df + 0.5) / (df + 0.5)) for term, df in dfs.items()}
+        scores: Dict[str, float] = {}
+        for term, doc_id, tf, length in rows:
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf[term] * tf * (BM25_K1 + 1) / norm
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+        # Terms missing from the index still count against confidence.
+        full_match = sum(idf.get(term, math.log(1 + (n_docs + 0.5) / 0.5)) for term in terms)
+        confidence = min(1.0, ranked[0][1] / full_match) if ranked else 0.0
+        return ranked, confidence
+
+    def metadatas(self, ids: Sequence[str]) -> Dict[str, Optional[Dict]]:
+        if not ids:
+            return {}
+        with self._lock:
+            marks = ",".join("?" * len(ids))
+            rows = self._conn.execute(f"SELECT id, metadata FROM docs WHERE id IN ({marks})", list(ids)).fetchall()
+        return {doc_id: json.loads(metadata) if metadata else None for doc_id, metadata in rows}
+
+
+_indexes: Dict[str, BM25Index] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(collection_name: str) -> BM25Index:
+    with _indexes_lock:
+        if collection_name not in _indexes:
+            _indexes[collection_name] = BM25Index(collection_name)
+        return _indexes[collection_name]
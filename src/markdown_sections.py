@@ -0,0 +1,112 @@
+import functools
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple
+from markdown_it import MarkdownIt
+from markdown_it.token import Token as MdToken
+
+# Sections start at h1-h3, deeper headings are kept as content like any other block.
+MAX_SECTION_LEVEL = 3
+
+_SPACES = re.compile(r"\s+")
+_TAG = re.compile(r"<[^>]*>")
+# Inline tokens whose content is visible text; images contribute their alt text.
+_TEXT_TOKENS = ("text", "code_inline", "image")
+# Block tokens that carry their own text instead of inline children.
+_LITERAL_BLOCKS = ("fence", "code_block")
+
+Token = Tuple[str, int, str]
+
+
+@functools.lru_cache(maxsize=None)
+def _parser() -> MarkdownIt:
+    return MarkdownIt("commonmark").enable(["table", "strikethrough"])
+
+
+def _plain(text: str) -> str:
+    return _SPACES.sub(" ", text).strip()
+
+
+def _inline_text(token: MdToken) -> str:
+    parts = []
+    for child in token.children or ():
+        if child.type in _TEXT_TOKENS:
+            parts.append(child.content)
+        elif child.type in ("softbreak", "hardbreak"):
+            parts.append(" ")
+    return "".join(parts)
+
+
+def iter_tokens(tokens: Iterable[MdToken]) -> Iterator[Token]:
+    """
+    Folds markdown-it block tokens into ("heading", level, text) and ("block", 0,
+    text) tokens in a single pass. Each top-level block (paragraph, list, table,
+    quote, code, HTML) becomes one text, like one sibling element after the heading.
+    Code keeps its content verbatim so '#' lines inside it are never headings.
+    """
+    parts: List[str] = []
+    heading = 0
+
+    for token in tokens:
+        if token.type == "heading_open" and token.level == 0:
+            heading = int(token.tag[1])
+            continue
+        if token.type == "inline":
+            parts.append(_inline_text(token))
+        elif token.type in _LITERAL_BLOCKS:
+            parts.append(token.content.strip("\n"))
+        elif token.type == "html_block":
+            parts.append(_TAG.sub(" ", token.content))
+
+        # A top-level block ends with its closing token, or is a single token.
+        if token.level == 0 and token.nesting <= 0:
+            if heading:
+                yield "heading", heading, _plain(" ".join(parts))
+            elif token.type in _LITERAL_BLOCKS:
+                yield "block", 0, "\n".join(parts).strip()
+            else:
+                text = _plain(" ".join(parts))
+                if text:
+                    yield "block", 0, text
+            parts, heading = [], 0
+
+
+def iter_sections(content: str) -> Iterator[Tuple[int, Dict]]:
+    """
+    Builds section records from the token stream with a stack of open sections,
+    so each token is visited once per open ancestor (at most three). Yields
+    (position, record) as each section closes; position is the heading's order
+    in the document.
+    """
+    stack: List[Tuple[int, Dict, List[str]]] = []
+    position = 0
+
+    def _close(entry):
+        pos, record, parts = entry
+        record['content'] = '\n'.join(parts)
+        return pos, record
+
+    for kind, level, text in iter_tokens(_parser().parse(content)):
+        if kind == "heading" and level <= MAX_SECTION_LEVEL:
+            while stack and stack[-1][1]['header_level'] >= level:
+                yield _close(stack.pop())
+            for _, _, parts in stack:
+                parts.append(text)
+            record = {
+                'header_level': level,
+                'header_text': text,
+                'content': '',
+                'heading_path': [entry[1]['header_text'] for entry in stack] + [text]
+            }
+            stack.append((position, record, []))
+            position += 1
+        elif text:
+            for _, _, parts in stack:
+                parts.append(text)
+
+    while stack:
+        yield _close(stack.pop())
+
+
+def parse_sections(content: str) -> List[Dict]:
+    """Sections in document order, matching the records parse_md has always returned plus heading_path."""
+    return [record for _, record in sorted(iter_sections(content), key=lambda item: item[0])]
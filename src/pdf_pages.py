@@ -0,0 +1,22 @@
+import io
+from typing import List, Optional, Tuple
+from pypdf import PdfReader
+
+# Runs inside the PDF extraction process pool: keep imports free of Chroma, Redis and the API clients.
+
+
+def parse_pdf(file_content: bytes) -> PdfReader:
+    return PdfReader(io.BytesIO(file_content))
+
+
+_worker_reader: Optional[PdfReader] = None
+
+
+def init_pdf_worker(file_content: bytes):
+    """Parses the PDF once per pool process instead of once per task."""
+    global _worker_reader
+    _worker_reader = parse_pdf(file_content)
+
+
+def extract_page_range(page_indexes: List[int]) -> List[Tuple[int, str]]:
+    return [(i + 1, _worker_reader.pages[i].extract_text() or "") for i in page_indexes]
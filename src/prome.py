@@ -1,144 +1,313 @@
+import asyncio
+import functools
 import json
 import logging
-from typing import Optional
+import os
+from typing import Callable, Optional, Tuple
 from uuid import uuid4
 from dotenv import load_dotenv
-from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import ValidationError
-import redis
+import redis.asyncio as aioredis
+import alert_store
+from alert_context import AlertContextBuilder
+import coalesce
+import incident_memory
+import summary_cache
+import work_queue
+from concurrency import REDIS_MAX_CONNECTIONS, gemini_limiter, run_in_chroma
 from documentation import search_documentation
-from gemini import GeminiEmbeddingFunction, gemini
+from source_code import lookup_source_locations, search_codebase
+from gemini import async_gemini
 import models
 from utils import build_initial_message
-from slack import search_slack_history, slack_client
+from slack import fetch_thread_resolution, search_slack_history, slack_app, slack_message_stage
+from slack_bolt.adapter.fastapi import SlackRequestHandler
+from slack_dispatcher import dispatcher, section_block
+from slack_stream import StreamingMessage
 
 load_dotenv()
 app = FastAPI()
-redis_client = redis.Redis(host='localhost', port=6379, db=1, decode_responses=True)
-
-
-def store_prometheus_alerts(incident_id: str, payload: models.PrometheusWebhookPayload) -> None:
-    """Saves incoming Prometheus alerts to Redis."""
-    alert_fingerprints = []
-    for alert in payload.alerts:
-        alert_fingerprints.append(alert.fingerprint)
-        redis_client.set(
-            f"prometheus:alert:{alert.fingerprint}",
-            alert.model_dump_json(indent=2),
-            ex=7200
-        )
+slack_handler = SlackRequestHandler(slack_app)
+redis_client = aioredis.Redis(host='localhost', port=6379, db=1, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS)
+
+SUMMARY_MODEL = 'gemini-2.0-flash-001'
+# Stream the summary into the thread as it is generated instead of posting it once complete.
+SUMMARY_STREAMING = os.environ.get("SUMMARY_STREAMING", "true").lower() == "true"
 
-    if alert_fingerprints:
-        redis_client.sadd(f"payload:{incident_id}", *alert_fingerprints)
-        redis_client.expire(f"payload:{incident_id}", 7200)
 
-def find_related_information(query: str) -> dict:
-    """Searches documentation and Slack for context related to a query."""
-    doc_results = search_documentation(query_text=query)
-    slack_results = search_slack_history(query_text=query)
+async def store_prometheus_alerts(incident_id: str, payload: models.PrometheusWebhookPayload) -> None:
+    """Saves incoming Prometheus alerts and the incident's startsAt index to Redis in one round trip."""
+    await alert_store.store_alerts(redis_client, incident_id, payload.alerts)
+
+async def find_related_information(query: str, trace_text: str = "") -> dict:
+    """
+    Searches documentation, Slack and indexed source code for context related to
+    a query. Stack frames in the alerts or the query are resolved exactly through
+    the symbol table first; semantic code search only runs when none resolve.
+    """
+    code_results = await asyncio.to_thread(lookup_source_locations, f"{trace_text}\n{query}")
+    searches = [
+        run_in_chroma(search_documentation, query_text=query),
+        run_in_chroma(search_slack_history, query_text=query)
+    ]
+    if not code_results:
+        searches.append(run_in_chroma(search_codebase, search_query=query))
+    doc_results, slack_results, *semantic_code = await asyncio.gather(*searches)
+    if semantic_code:
+        code_results = semantic_code[0]
     return {
         "documentation": doc_results,
-        "slack_history": slack_results
+        "slack_history": slack_results,
+        "source_code": code_results
     }
 
-def post_slack_update(channel: str, thread_ts: str, text: str):
-    """Posts a message to a specific Slack thread."""
+async def post_slack_update(channel: str, thread_ts: str, text: str):
+    """Posts a message to a specific Slack thread, merged with other pending posts to it."""
     try:
-        slack_client.chat_postMessage(
-            channel=channel,
-            text=text,
-            thread_ts=thread_ts
-        )
+        await dispatcher.post(channel, text=text, thread_ts=thread_ts)
     except Exception as e:
         logging.error(f"Failed to post update to Slack: {e}")
 
-def run_incident_workflow(incident_id: str, payload: models.PrometheusWebhookPayload, thread_ts: str):
+async def _summary_stream(thread_ts: str, job_id: Optional[str]) -> StreamingMessage:
+    """The streamed summary reply; a retried investigation gets the message its earlier attempt posted."""
+    ts, channel_id = await redis_client.hmget(f"incident:summary_message:{job_id}", "ts", "channel") if job_id else (None, None)
+    return StreamingMessage("#test-on-call", thread_ts, prefix="🔍 *AI Summary:* ", ts=ts, channel_id=channel_id)
+
+async def _finish_stream(stream: StreamingMessage, job_id: Optional[str], text: str, prefix: Optional[str] = None) -> None:
+    await stream.finish(text, prefix=prefix)
+    if job_id and stream.ts:
+        key = f"incident:summary_message:{job_id}"
+        await redis_client.hset(key, mapping={"ts": stream.ts, "channel": stream.channel_id})
+        await redis_client.expire(key, coalesce.INCIDENT_TTL_SECONDS)
+
+async def run_incident_workflow(incident_id: str, payload: models.PrometheusWebhookPayload, thread_ts: str, job_id: Optional[str] = None) -> Optional[dict]:
     """
-    Orchestrates the entire incident response workflow.
+    Stores the alerts, summarizes them and posts the summary to the thread.
+    Returns the summary data so later stages can search on the summary and its embedding.
+    `job_id` identifies the investigation across retries, so a retry edits its
+    earlier summary message instead of posting another one.
     """
 
-    store_prometheus_alerts(incident_id, payload)
+    await store_prometheus_alerts(incident_id, payload)
+
+    failure_text = "⚠️ I was unable to generate an AI summary for this alert."
+    stream = await _summary_stream(thread_ts, job_id) if SUMMARY_STREAMING else None
+    try:
+        summary_data = await summary_on_alerts(incident_id, on_text=stream.append if stream else None)
+    except Exception:
+        if stream:
+            # finish() waits for a first post still queued or in flight, so no partial summary keeps its cursor.
+            await _finish_stream(stream, job_id, failure_text, prefix="")
+        raise
 
-    summary_data = summarize_alerts(incident_id)
     if not summary_data or not summary_data.get("llm_response"):
         logging.error("Failed to generate AI summary. Aborting workflow.")
-        post_slack_update(
+        if stream:
+            await _finish_stream(stream, job_id, failure_text, prefix="")
+        else:
+            await post_slack_update(channel="#test-on-call", thread_ts=thread_ts, text=failure_text)
+        return None
+
+    ai_summary = summary_data["llm_response"]
+    await coalesce.set_incident_summary(incident_id, ai_summary)
+    if stream:
+        # A cache hit never streamed, finish() posts it in one message.
+        await _finish_stream(stream, job_id, ai_summary)
+    else:
+        await post_slack_update(
             channel="#test-on-call",
             thread_ts=thread_ts,
-            text="⚠️ I was unable to generate an AI summary for this alert."
+            text=f"🔍 *AI Summary:* {ai_summary}"
         )
-        return
+    return summary_data
 
-    ai_summary = summary_data["llm_response"]
-    post_slack_update(
-        channel="#test-on-call",
-        thread_ts=thread_ts,
-        text=f"🔍 *AI Summary:* {ai_summary}"
-    )
-
-    # 3. Find and post related information
-    related_info = find_related_information(ai_summary)
+async def post_related_information(ai_summary: str, thread_ts: str, trace_text: str = ""):
+    """Finds documentation, past conversations and source code for the summary and posts them."""
+    related_info = await find_related_information(ai_summary, trace_text)
     doc_results = related_info["documentation"]
     slack_results = related_info["slack_history"]
+    code_results = related_info["source_code"]
 
+    sections = []
     if doc_results:
-        post_slack_update(
-            channel="#test-on-call",
-            thread_ts=thread_ts,
-            text=f"📚 *Related Documentation:*\n{doc_results}"
-        )
-
+        sections.append(f"📚 *Related Documentation:*\n{doc_results}")
     if slack_results:
-        post_slack_update(
-            channel="#test-on-call",
-            thread_ts=thread_ts,
-            text=f"💬 *Related Conversations:*\n{slack_results}"
-        )
+        sections.append(f"💬 *Related Conversations:*\n{slack_results}")
+    if code_results:
+        sections.append(f"🧩 *Related Source Code:*\n{code_results}")
+    if not sections:
+        return
+
+    blocks = []
+    for section in sections:
+        if blocks:
+            blocks.append({"type": "divider"})
+        blocks.append(section_block(section))
+    try:
+        await dispatcher.post("#test-on-call", text="\n\n".join(sections), blocks=blocks, thread_ts=thread_ts)
+    except Exception as e:
+        logging.error(f"Failed to post related information to Slack: {e}")
+
+async def post_past_resolution(past: dict, thread_ts: str):
+    """Posts how a near-identical past incident was resolved, in place of the related-information search."""
+    sections = [
+        f"🧠 *Seen before:* {past['similarity']:.0%} similar to incident `{past['incident_id']}`\n{past['summary']}",
+        f"✅ *How it was resolved:*\n{past['resolution']}",
+    ]
+    blocks = [section_block(sections[0]), {"type": "divider"}, section_block(sections[1])]
+    try:
+        await dispatcher.post("#test-on-call", text="\n\n".join(sections), blocks=blocks, thread_ts=thread_ts)
+    except Exception as e:
+        logging.error(f"Failed to post past resolution to Slack: {e}")
+
+# -------------------------------------Worker stages-----------------------------------------------------------
 
-def summary_on_alerts(payload_id: Optional[str]):
-    
-    alerts_fingerprints = redis_client.smembers(f"payload:{payload_id}")
-    if not alerts_fingerprints:
+async def post_initial_message(payload: models.PrometheusWebhookPayload) -> Tuple[str, str]:
+    """Posts the thread's root message and returns its ts and the channel id it landed in."""
+    # The thread is keyed on this message's ts, so it is never merged.
+    response = await dispatcher.post("#test-on-call", blocks=build_initial_message(payload), merge=False)
+    return response["message"]["ts"], response["channel"]
+
+def resolution_notice(payload: models.PrometheusWebhookPayload, open_groups: int) -> str:
+    alertname = payload.commonLabels.get("alertname", "Alert group")
+    if open_groups:
+        return f"✅ *Resolved:* {alertname}. {open_groups} correlated alert group{'s' if open_groups != 1 else ''} still firing."
+    return f"✅ *Resolved:* {alertname}. All alerts in this incident have resolved."
+
+async def ingest_stage(fields: dict):
+    """Coalesces a webhook payload and opens or reuses the incident's Slack thread."""
+    payload = models.PrometheusWebhookPayload.model_validate_json(fields["payload"])
+
+    if payload.status == "resolved":
+        incident = await coalesce.close_incident(payload)
+        if incident and incident.get("thread_ts"):
+            # The incident was already investigated in its thread, so the resolution goes there instead of a new one.
+            await post_slack_update(channel="#test-on-call", thread_ts=incident["thread_ts"], text=resolution_notice(payload, incident["open_groups"]))
+            # Correlated groups still firing keep the incident open, its thread is not a resolution yet.
+            if not incident["open_groups"] and incident.get("channel_id"):
+                await work_queue.enqueue(redis_client, "resolve", {
+                    "incident_id": incident["incident_id"], "thread_ts": incident["thread_ts"], "channel_id": incident["channel_id"]
+                })
+            return
+        thread_ts, _ = await post_initial_message(payload)
+        await work_queue.enqueue(redis_client, "investigate", {
+            "incident_id": str(uuid4()), "job_id": str(uuid4()), "thread_ts": thread_ts, "payload": payload.model_dump_json()
+        })
+        return
+
+    decision = await coalesce.coalesce_payload(payload, owner=fields.get("job_id"))
+    if decision.action in (coalesce.CoalesceDecision.DUPLICATE, coalesce.CoalesceDecision.BUFFERED):
         return
 
-    alert_keys = [f"prometheus:alert:{fp}" for fp in alerts_fingerprints]
-    alerts = redis_client.mget(alert_keys)
+    thread_ts = decision.thread_ts
+    if decision.action == coalesce.CoalesceDecision.NEW:
+        thread_ts, channel_id = await post_initial_message(payload)
+        await coalesce.set_incident_thread(decision.incident_id, thread_ts, channel_id)
 
-    llm_context = "The following related alerts are firing:\n\n"
-    alert_cnt = 0
+    await work_queue.schedule(redis_client, "flush", {
+        "incident_id": decision.incident_id, "thread_ts": thread_ts
+    }, delay=coalesce.COALESCE_WINDOW_SECONDS)
+    await coalesce.mark_flush_scheduled(decision.incident_id)
 
-    for alert in alerts:
-        if alert is None:
-            continue
+async def flush_stage(fields: dict):
+    """Runs once the coalescing window closes, merging every payload it held."""
+    merged = await coalesce.drain_pending(fields["incident_id"])
+    if merged is None:
+        return
+    await work_queue.enqueue(redis_client, "investigate", {
+        "incident_id": fields["incident_id"], "job_id": str(uuid4()), "thread_ts": fields["thread_ts"], "payload": merged.model_dump_json()
+    })
 
-        alert_data = json.loads(alert)
-        alert_cnt += 1
+async def investigate_stage(fields: dict):
+    payload = models.PrometheusWebhookPayload.model_validate_json(fields["payload"])
+    summary_data = await run_incident_workflow(fields["incident_id"], payload, fields["thread_ts"], fields.get("job_id"))
+    if not summary_data:
+        return
+    ai_summary = summary_data["llm_response"]
 
-        summary = alert_data.get("annotations", {}).get("summary", "N/A")
-        description = alert_data.get("annotations", {}).get("description", "N/A")
-        alertname = alert_data.get("labels", {}).get("alertname", "N/A")
-        server = alert_data.get("labels", {}).get("instance", "N/A")
-        
-        llm_context += f"--- Alert {alert_cnt} ---\n"
-        llm_context += f"Name: {alertname}\n"
-        llm_context += f"Summary: {summary}\n"
-        llm_context += f"Description: {description}\n\n"
-        llm_context += f"Instance: {server}\n\n"
+    if payload.status == "firing":
+        # Looked up before this incident is stored, and only resolved incidents match, so it never finds itself.
+        past = await incident_memory.find_similar_incident(summary_data["embedding"])
+        await incident_memory.remember_incident(fields["incident_id"], ai_summary, payload, summary_data["embedding"])
+        if past:
+            await post_past_resolution(past, fields["thread_ts"])
+            return
 
-    llm_response = summarize_alerts(llm_context)
-    get_embeddings = GeminiEmbeddingFunction(llm_response)
-    return {"llm_context": llm_context, "llm_response": llm_response, "embeddings": get_embeddings}
+    await work_queue.enqueue(redis_client, "related", {
+        "incident_id": fields["incident_id"], "thread_ts": fields["thread_ts"], "ai_summary": ai_summary,
+        "annotations": "\n".join(value for alert in payload.alerts for value in alert.annotations.values())
+    })
+
+async def related_stage(fields: dict):
+    await post_related_information(fields["ai_summary"], fields["thread_ts"], fields.get("annotations", ""))
+
+async def resolve_stage(fields: dict):
+    """Saves the human replies in a resolved incident's thread as its resolution in incident memory."""
+    resolution = await asyncio.to_thread(fetch_thread_resolution, fields["channel_id"], fields["thread_ts"])
+    if await incident_memory.record_resolution(fields["incident_id"], resolution):
+        logging.info(f"Stored resolution for incident {fields['incident_id']}")
+
+STAGE_HANDLERS = {
+    "ingest": ingest_stage,
+    "flush": flush_stage,
+    "investigate": investigate_stage,
+    "related": related_stage,
+    "resolve": resolve_stage,
+    "slack_message": slack_message_stage,
+}
+
+async def summary_on_alerts(payload_id: Optional[str], on_text: Optional[Callable[[str], None]] = None):
+
+    builder = AlertContextBuilder()
+    async for page in alert_store.iter_alert_pages(redis_client, payload_id, fields=("status", "startsAt", "labels", "annotations")):
+        builder.add(page)
+
+    if not builder.total:
+        return
 
+    llm_context = builder.render()
+    generate = functools.partial(summarize_alerts_stream, on_text=on_text) if on_text else summarize_alerts
+    llm_response, embedding = await summary_cache.cached_summary(llm_context, generate, embed=incident_memory.embed_summary)
+    return {"llm_context": llm_context, "llm_response": llm_response, "embedding": embedding}
 
-def summarize_alerts(context):
+
+async def summarize_alerts(context):
     if not context:
         raise ValueError("There should be some context available")
-    
-    model_response = gemini.models.generate_content(model='gemini-2.0-flash-001', contents=context)
+
+    async with gemini_limiter:
+        model_response = await async_gemini.models.generate_content(model=SUMMARY_MODEL, contents=context)
     return model_response.text
 
+
+async def summarize_alerts_stream(context, on_text: Callable[[str], None]) -> str:
+    """Like summarize_alerts, but hands each streamed piece of text to `on_text` as it arrives."""
+    if not context:
+        raise ValueError("There should be some context available")
+
+    parts = []
+    async with gemini_limiter:
+        async for chunk in await async_gemini.models.generate_content_stream(model=SUMMARY_MODEL, contents=context):
+            if chunk.text:
+                parts.append(chunk.text)
+                on_text(chunk.text)
+    return "".join(parts)
+
+@app.post('/slack/events')
+async def slack_events(request: Request):
+    return await slack_handler.handle(request)
+
+@app.get('/metrics/summary_cache')
+async def summary_cache_metrics():
+    return await summary_cache.cache_stats()
+
+@app.get('/metrics/slack_dispatcher')
+async def slack_dispatcher_metrics():
+    return dispatcher.stats
+
 @app.post('/webhook/prome')
-async def promethues_webhook(request: Request, background_tasks: BackgroundTasks):
+async def promethues_webhook(request: Request):
     try:
         payload_json = await request.json()
         payload = models.PrometheusWebhookPayload.model_validate(payload_json)
@@ -150,19 +319,12 @@ async def promethues_webhook(request: Request, background_tasks: BackgroundTasks
             status_code=422,
             detail={"error": "Pydantic validation failed", "details": e.errors()}
         )
-    initial_message = build_initial_message(payload)    
-    try:
-        response = slack_client.chat_postMessage(
-            channel="#test-on-call", 
-            blocks=initial_message
-        )
-        thread_ts = response["message"]["ts"]
-
-        background_tasks.add_task(run_incident_workflow, str(uuid4()), payload, thread_ts)
 
+    try:
+        # job_id survives retries, so coalescing can tell a retried ingest from a resent payload.
+        entry_id = await work_queue.enqueue(redis_client, "ingest", {"job_id": str(uuid4()), "payload": payload.model_dump_json()})
     except Exception as e:
-        logging.error(f"Failed to post to Slack or start background task: {e}")
-        return {"status": "received_but_failed_downstream", "code": 200}
-    
-    return {"status": "received", "code": 200}
+        logging.error(f"Failed to enqueue Prometheus payload: {e}")
+        raise HTTPException(status_code=503, detail="Incident queue unavailable")
 
+    return {"status": "queued", "entry_id": entry_id, "code": 200}
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict
+
+# Slack Web API tiers, in requests per minute per workspace.
+# https://api.slack.com/apis/rate-limits
+SLACK_TIER_RATES = {1: 1, 2: 20, 3: 50, 4: 100}
+
+SLACK_METHOD_TIERS = {
+    "conversations.history": 3,
+    "conversations.replies": 3,
+    "conversations.info": 3,
+    "chat.update": 3,
+    "chat.delete": 3,
+    "users.info": 4,
+}
+
+# Fraction of the published rate to run at, leaving headroom for other callers on the token.
+SLACK_RATE_HEADROOM = float(os.environ.get("SLACK_RATE_HEADROOM", "0.9"))
+
+
+class TokenBucket:
+    """Thread-safe token bucket, refills `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Takes one token, returns how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+            return max(wait, self._paused_until - now)
+
+    def acquire(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Holds every caller back, used when Slack answers with a Retry-After anyway."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = min(self._tokens, 0)
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def slack_bucket(method: str) -> TokenBucket:
+    """Shared bucket for a Slack API method, sized from its rate-limit tier."""
+    with _buckets_lock:
+        if method not in _buckets:
+            per_minute = SLACK_TIER_RATES[SLACK_METHOD_TIERS.get(method, 3)] * SLACK_RATE_HEADROOM
+            rate = per_minute / 60
+            # Slack tolerates short bursts, allow a few seconds' worth of calls at once.
+            _buckets[method] = TokenBucket(rate=rate, capacity=max(1.0, rate * 5))
+        return _buckets[method]
@@ -0,0 +1,156 @@
+import array
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from chroma import chromadb_client, collection_generation
+from gemini import GeminiEmbeddingFunction
+from lexical_index import get_index
+
+RRF_K = 60
+# Above this BM25 confidence the lexical hits are returned as-is and no query embedding is made.
+LEXICAL_CONFIDENCE = float(os.environ.get("LEXICAL_CONFIDENCE", "0.9"))
+# Each retriever contributes this many candidates per requested result to the fusion.
+CANDIDATE_MULTIPLIER = 4
+QUERY_CACHE_TTL_SECONDS = int(os.environ.get("QUERY_CACHE_TTL_SECONDS", "600"))
+QUERY_CACHE_MAX_ENTRIES = 1024
+
+
+class TTLCache:
+    """Small thread-safe LRU whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_query_embedder = GeminiEmbeddingFunction(task_type="retrieval_query")
+_query_vectors = TTLCache(QUERY_CACHE_TTL_SECONDS, QUERY_CACHE_MAX_ENTRIES)
+_results = TTLCache(QUERY_CACHE_TTL_SECONDS, QUERY_CACHE_MAX_ENTRIES)
+_collections: Dict[str, Any] = {}
+_locks_guard = threading.Lock()
+_embed_locks: Dict[str, threading.Lock] = {}
+
+
+def embed_query(query_text: str) -> List[float]:
+    """
+    Embeds a query once and shares the vector across every collection searched
+    for it. Concurrent callers with the same text wait for the first one.
+    """
+    vector = _query_vectors.get(query_text)
+    if vector is not None:
+        return vector
+
+    with _locks_guard:
+        lock = _embed_locks.setdefault(query_text, threading.Lock())
+    with lock:
+        vector = _query_vectors.get(query_text)
+        if vector is None:
+            vector = _query_embedder([query_text])[0]
+            _query_vectors.set(query_text, vector)
+    with _locks_guard:
+        _embed_locks.pop(query_text, None)
+    return vector
+
+
+def get_collection(collection_name: str):
+    """Collection handles are reused across queries instead of looked up each time."""
+    collection = _collections.get(collection_name)
+    if collection is None:
+        collection = chromadb_client.get_collection(collection_name)
+        _collections[collection_name] = collection
+    return collection
+
+
+def _vector_hash(vector: List[float]) -> str:
+    return hashlib.sha256(array.array("f", vector).tobytes()).hexdigest()
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def rebuild_lexical_index(collection_name: str, page_size: int = 1000) -> int:
+    """Backfills the BM25 index from documents already stored in the collection."""
+    collection = get_collection(collection_name)
+    index = get_index(collection_name)
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        index.upsert(page["ids"], page["documents"], page["metadatas"])
+        offset += len(page["ids"])
+    logging.info(f"Rebuilt lexical index for {collection_name} with {offset} documents")
+    return offset
+
+
+def hybrid_query(collection_name: str, query_text: str, n_results: int = 3) -> List[Dict]:
+    """
+    Runs BM25 and vector retrieval over one collection and fuses them with
+    reciprocal rank fusion. Returns the metadatas of the top results.
+
+    Fused results are cached per (collection, query vector, n_results) until the
+    collection's generation changes or QUERY_CACHE_TTL_SECONDS pass.
+    """
+    index = get_index(collection_name)
+    if index.count() == 0:
+        rebuild_lexical_index(collection_name)
+
+    candidates = n_results * CANDIDATE_MULTIPLIER
+    lexical, confidence = index.search(query_text, candidates)
+    lexical_ids = [doc_id for doc_id, _ in lexical]
+
+    if confidence >= LEXICAL_CONFIDENCE and len(lexical_ids) >= n_results:
+        top = lexical_ids[:n_results]
+        metadatas = index.metadatas(top)
+        return [metadatas[doc_id] for doc_id in top if metadatas.get(doc_id) is not None]
+
+    vector = embed_query(query_text)
+    cache_key = (collection_name, collection_generation(collection_name), _vector_hash(vector), n_results)
+    cached = _results.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = get_collection(collection_name).query(query_embeddings=[vector], n_results=candidates)
+    vector_ids = result.get("ids", [[]])[0]
+    vector_metadatas = dict(zip(vector_ids, result.get("metadatas", [[]])[0]))
+
+    top = reciprocal_rank_fusion([lexical_ids, vector_ids])[:n_results]
+    lexical_metadatas = index.metadatas([doc_id for doc_id in top if doc_id not in vector_metadatas])
+
+    results = []
+    for doc_id in top:
+        metadata: Optional[Dict] = vector_metadatas.get(doc_id) or lexical_metadatas.get(doc_id)
+        if metadata is not None:
+            results.append(metadata)
+    _results.set(cache_key, results)
+    return results
@@ -0,0 +1,144 @@
+import copy
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+import yaml
+
+SERVICE_CATALOG_PATH = os.environ.get(
+    "SERVICE_CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "services.yaml")
+)
+# How often a lookup may stat the file to notice edits made by other processes or by hand.
+SERVICE_CATALOG_CHECK_SECONDS = float(os.environ.get("SERVICE_CATALOG_CHECK_SECONDS", "2"))
+
+LINK_KINDS = ("runbooks", "dashboards")
+
+
+class ServiceCatalog:
+    """
+    services.yaml held in memory as a dict keyed by service name. Lookups are a
+    dict hit; at most every SERVICE_CATALOG_CHECK_SECONDS a lookup also stats
+    the file and reloads it if its mtime or size changed. Every write goes
+    through update_service, which holds an flock across processes, re-reads
+    the file and replaces it atomically.
+    """
+
+    def __init__(self, path: str = SERVICE_CATALOG_PATH):
+        self.path = path
+        self._services: Dict[str, Dict] = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _read(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path) as f:
+                data = yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            return {}
+        services = data.get("services") if isinstance(data, dict) else None
+        return {name: config for name, config in (services or {}).items() if isinstance(config, dict)}
+
+    def reload(self) -> None:
+        signature = self._stat_signature()
+        try:
+            services = self._read()
+        except yaml.YAMLError as e:
+            # Keep serving the last good catalog while the file is mid-edit or broken.
+            logging.error(f"Error parsing service catalog '{self.path}': {e}")
+            return
+        with self._lock:
+            self._services = services
+            self._signature = signature
+            self._checked_at = time.monotonic()
+
+    def _refresh_if_stale(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < SERVICE_CATALOG_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        if self._stat_signature() != self._signature:
+            self.reload()
+
+    def get(self, service_name: Optional[str]) -> Optional[Dict]:
+        if not service_name:
+            return None
+        self._refresh_if_stale()
+        return self._services.get(service_name)
+
+    def services(self) -> Dict[str, Dict]:
+        self._refresh_if_stale()
+        return dict(self._services)
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, services: Dict[str, Dict]) -> None:
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(prefix=".services-", suffix=".yaml", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                yaml.dump({"services": services}, f, default_flow_style=False, sort_keys=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def update_service(self, service_name: str, runbooks: Optional[List[Dict]] = None, dashboards: Optional[List[Dict]] = None) -> bool:
+        """
+        Adds runbook and dashboard links a service does not have yet, creating the
+        service if needed. Returns True when the file was written.
+        """
+        with self._file_lock():
+            # Another worker may have written since this process last loaded the file.
+            services = self._read()
+            existed = service_name in services
+            config = copy.deepcopy(services.get(service_name) or {})
+            updated = not existed
+
+            for kind, new_links in zip(LINK_KINDS, (runbooks, dashboards)):
+                links = config.get(kind)
+                if not isinstance(links, list):
+                    links = config[kind] = []
+                    updated = True
+                known = {(link.get("name"), link.get("url")) for link in links if isinstance(link, dict)}
+                for link in new_links or []:
+                    if (link.get("name"), link.get("url")) not in known:
+                        links.append(link)
+                        known.add((link.get("name"), link.get("url")))
+                        updated = True
+                        logging.info(f"Added {kind[:-1]} {link.get('name')} to service '{service_name}'")
+
+            if updated:
+                services[service_name] = config
+                self._write(services)
+            with self._lock:
+                self._services = services
+                self._signature = self._stat_signature()
+                self._checked_at = time.monotonic()
+        return updated
+
+
+catalog = ServiceCatalog()
@@ -1,14 +1,23 @@
 import time
 import os
 import logging
-from typing import Dict, List
+import hashlib
+from contextlib import closing
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional
+import redis
 from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
 from slack_bolt import App
 from slack_sdk.errors import SlackApiError
 from dotenv import load_dotenv
-from slack_sdk.http_retry.builtin_handlers import RateLimitErrorRetryHandler
-from chroma import chromadb_client, get_or_create_chroma_db, embedding_func
-from gemini import GeminiEmbeddingFunction
+from slack_sdk.http_retry.builtin_async_handlers import AsyncRateLimitErrorRetryHandler
+from chroma import delete_from_chroma, get_or_create_chroma_db, embedding_func
+from concurrency import run_in_chroma
+import work_queue
+from rate_limit import slack_bucket
+from retrieval import hybrid_query
+from utils import batched, prefetch
 load_dotenv()
 
 SECRET_TOKEN = os.environ["SECRET_TOKEN"]
@@ -17,107 +26,357 @@ SIGN_IN_SECRET = os.environ["SIGN_IN_SECRET"]
 
 
 slack_app = App(token=SLACK_TOKEN, signing_secret=SIGN_IN_SECRET)
-retry_handler = RateLimitErrorRetryHandler(max_retry_count=3)
-slack_client = WebClient(token=SLACK_TOKEN, retry_handlers=[retry_handler])
+# Rate limits are paced up front by the per-method buckets in call_slack.
+slack_client = WebClient(token=SLACK_TOKEN)
+async_slack_client = AsyncWebClient(token=SLACK_TOKEN, retry_handlers=[AsyncRateLimitErrorRetryHandler(max_retry_count=3)])
+
+redis_client = redis.Redis(host='localhost', port=6379, db=1, decode_responses=True)
+
+# Threads started before the channel watermark can still get replies, so every
+# sync re-reads this much history to compare each thread's latest_reply.
+SYNC_THREAD_LOOKBACK_SECONDS = int(os.environ.get("SLACK_SYNC_THREAD_LOOKBACK_SECONDS", str(7 * 86400)))
+
+SLACK_REPLY_WORKERS = int(os.environ.get("SLACK_REPLY_WORKERS", "8"))
+SLACK_MAX_RATE_LIMIT_RETRIES = 3
+SLACK_SYNC_BATCH_SIZE = int(os.environ.get("SLACK_SYNC_BATCH_SIZE", "200"))
+SLACK_SYNC_PREFETCH_BATCHES = 2
+# Comma separated channel ids to ingest live events from, empty means every channel the app is in.
+SLACK_INGEST_CHANNELS = {c for c in os.environ.get("SLACK_INGEST_CHANNELS", "").split(",") if c}
+LIVE_EVENT_LOCK_SECONDS = 60
+# Out-of-order events for a ts arrive within seconds of each other, a day of history is plenty.
+LIVE_EVENT_ORDER_TTL_SECONDS = 86400
 
 logging.basicConfig(level=logging.INFO)
 
 def format_document_text(message_data: Dict) -> str:
     """Creates a single string from a message object for embedding."""
     parent_text = message_data.get("text", "")
-    replies = "\n".join(message_data.get("replies", []))
+    replies = message_data.get("replies", "")
+    if not isinstance(replies, str):
+        replies = "\n".join(replies)
 
     full_text = f"From user {message_data.get('user')}: {parent_text}"
     if replies:
         full_text += f"\n---REPLIES---\n{replies}"
     return full_text
 
-def fetch_and_process_channel_messages(channel_id: str) -> List[Dict]:
+def _sync_key(channel_id: str, name: str) -> str:
+    return f"slack:sync:{channel_id}:{name}"
+
+
+def call_slack(method: str, **kwargs):
     """
-    Fetches all messages from a channel, processes threads, and formats the output.
-    The RetryHandler on the slack_client will automatically handle rate limits.
+    Calls a Slack Web API method after taking a token from the method's shared
+    bucket. If Slack still answers 429, the whole bucket pauses for Retry-After.
     """
-    data: List[Dict] = []
-    processed_thread_ts = set()
+    bucket = slack_bucket(method)
+    for attempt in range(SLACK_MAX_RATE_LIMIT_RETRIES + 1):
+        bucket.acquire()
+        try:
+            return getattr(slack_client, method.replace(".", "_"))(**kwargs)
+        except SlackApiError as e:
+            if e.response.status_code != 429 or attempt == SLACK_MAX_RATE_LIMIT_RETRIES:
+                raise
+            retry_after = int(e.response.headers.get("Retry-After", "1"))
+            logging.warning(f"Rate limited on {method}, pausing {retry_after}s")
+            bucket.pause(retry_after)
+
+
+def iter_history_messages(channel_id: str, oldest: Optional[str] = None) -> Iterator[Dict]:
+    """Streams raw channel history, one page request at a time."""
     cursor = None
+    while True:
+        history = call_slack("conversations.history", channel=channel_id, cursor=cursor, oldest=oldest)
+        yield from history.data.get("messages", [])
+
+        if not history.data.get("has_more"):
+            return
+        cursor = history.data["response_metadata"]["next_cursor"]
+
+
+def is_bot_message(message: Dict, bot_user_id: Optional[str] = None) -> bool:
+    """Messages posted by a bot, including this app's own summaries and related-information posts."""
+    return bool(message.get("bot_id")) or message.get("subtype") == "bot_message" or (bot_user_id is not None and message.get("user") == bot_user_id)
+
 
+def fetch_thread(channel_id: str, thread_ts: str) -> Optional[Dict]:
+    """The thread's parent and its human replies, None when nobody but bots posted in it."""
+    thread_replies = call_slack("conversations.replies", channel=channel_id, ts=thread_ts)
+
+    thread_messages = thread_replies.data.get("messages", [])
+    if not thread_messages:
+        return None
+    parent_message = thread_messages[0]
+    reply_texts = [reply.get("text", "") for reply in thread_messages[1:] if not is_bot_message(reply)]
+    if not reply_texts and is_bot_message(parent_message):
+        return None
+    return {
+        "user": parent_message.get("user"),
+        "text": parent_message.get("text"),
+        "ts": parent_message.get("ts"),
+        "replies": "\n".join(reply_texts),
+        "latest_reply": thread_messages[-1].get("ts")
+    }
+
+
+def fetch_thread_resolution(channel_id: str, thread_ts: str) -> str:
+    """Text of the human replies in a thread, skipping the parent message and anything a bot posted."""
+    texts = []
+    cursor = None
     while True:
+        thread_replies = call_slack("conversations.replies", channel=channel_id, ts=thread_ts, cursor=cursor)
+        # The parent message is repeated at the top of every page.
+        for reply in thread_replies.data.get("messages", []):
+            if reply.get("ts") != thread_ts and reply.get("text") and not is_bot_message(reply):
+                texts.append(reply["text"])
+
+        if not thread_replies.data.get("has_more"):
+            return "\n".join(texts)
+        cursor = thread_replies.data["response_metadata"]["next_cursor"]
+
+
+def _thread_results(futures: Iterable[Future]) -> Iterator[Dict]:
+    for future in futures:
         try:
-            history = slack_client.conversations_history(channel=channel_id, cursor=cursor)
-            messages = history.data.get("messages", [])
+            thread = future.result()
+        except SlackApiError as e:
+            logging.error(f"Slack API Error fetching thread replies: {e.response['error']}")
+            continue
+        if thread:
+            yield thread
+
+
+def iter_channel_messages(channel_id: str, oldest: Optional[str] = None, thread_watermarks: Optional[Dict[str, str]] = None) -> Iterator[Dict]:
+    """
+    Streams formatted messages from a channel. Thread replies are fetched on a
+    worker pool while history keeps paginating, so both run at the rate ceiling.
+    With `oldest`, only messages after it are returned, plus threads whose
+    latest_reply moved past the value in `thread_watermarks`.
+    """
+    processed_thread_ts = set()
+    thread_watermarks = thread_watermarks or {}
+    max_pending = SLACK_REPLY_WORKERS * 4
 
-            for message in messages:
+    history_oldest = None
+    if oldest:
+        history_oldest = str(max(0.0, float(oldest) - SYNC_THREAD_LOOKBACK_SECONDS))
+
+    with ThreadPoolExecutor(max_workers=SLACK_REPLY_WORKERS, thread_name_prefix="slack-replies") as pool:
+        pending = set()
+        try:
+            for message in iter_history_messages(channel_id, history_oldest):
                 thread_ts = message.get("thread_ts")
+                is_new = not oldest or float(message.get("ts", "0")) > float(oldest)
+
                 if thread_ts and thread_ts not in processed_thread_ts:
                     processed_thread_ts.add(thread_ts)
 
-                    thread_replies = slack_client.conversations_replies(
-                        channel=channel_id,
-                        ts=thread_ts
-                    )
-
-                    thread_messages = thread_replies.data.get("messages", [])
-                    if not thread_messages:
+                    latest_reply = message.get("latest_reply", thread_ts)
+                    if not is_new and thread_watermarks.get(thread_ts) == latest_reply:
                         continue
-                    parent_message = thread_messages[0]
-                    reply_texts = [reply.get("text", "") for reply in thread_messages[1:]]
-                    data.append({
-                        "user": parent_message.get("user"),
-                        "text": parent_message.get("text"),
-                        "ts": parent_message.get("ts"),
-                        "replies": "\n".join(reply_texts)
-                    })
-                elif not thread_ts:
-                    data.append({
+
+                    pending.add(pool.submit(fetch_thread, channel_id, thread_ts))
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        yield from _thread_results(done)
+
+                elif not thread_ts and is_new and not is_bot_message(message):
+                    yield {
                         "user": message.get("user"),
                         "text": message.get("text"),
                         "ts": message.get("ts"),
                         "replies": ""
-                    })
-
-            if not history.data.get("has_more"):
-                break
-            cursor = history.data["response_metadata"]["next_cursor"]
+                    }
 
         except SlackApiError as e:
+            # Re-raised so the caller never moves its watermark past messages that were not fetched.
             logging.error(f"Slack API Error (non-rate-limit): {e.response['error']}")
-            break
+            raise
         except KeyError as e:
-            print(f"KeyError processing message: {e}")
-            continue
-    return data
+            logging.error(f"KeyError processing channel history: {e}")
+            raise
+
+        yield from _thread_results(pending)
 
 
-def sync_slack_history_to_chroma(channel_id: str, collection_name: str = "slack_messages"):
-    """Orchestrates fetching messages and storing them in ChromaDB."""
-    messages = fetch_and_process_channel_messages(channel_id)
+def fetch_and_process_channel_messages(channel_id: str, oldest: Optional[str] = None, thread_watermarks: Optional[Dict[str, str]] = None) -> List[Dict]:
+    """Fetches messages from a channel, processes threads, and formats the output."""
+    return list(iter_channel_messages(channel_id, oldest, thread_watermarks))
 
-    if not messages:
+
+def _store_batch(channel_id: str, collection_name: str, messages: List[Dict]) -> int:
+    """Formats, embeds and upserts one batch, then records its hashes and thread watermarks."""
+    documents = {msg["ts"]: format_document_text(msg) for msg in messages}
+    doc_hashes = {ts: hashlib.sha256(doc.encode()).hexdigest() for ts, doc in documents.items()}
+    known_hashes = dict(zip(doc_hashes, redis_client.hmget(_sync_key(channel_id, "docs"), list(doc_hashes))))
+    changed = [msg for msg in messages if known_hashes[msg["ts"]] != doc_hashes[msg["ts"]]]
+
+    if changed:
+        documents_to_embed = [documents[msg["ts"]] for msg in changed]
+        ids_to_use = [msg["ts"] for msg in changed]
+        metadatas = [{k: v for k, v in msg.items() if k != "latest_reply"} for msg in changed]
+        get_or_create_chroma_db(documents_to_embed, collection_name, metadatas, ids_to_use)
+
+    pipe = redis_client.pipeline()
+    if changed:
+        pipe.hset(_sync_key(channel_id, "docs"), mapping={msg["ts"]: doc_hashes[msg["ts"]] for msg in changed})
+    latest_replies = {msg["ts"]: msg["latest_reply"] for msg in messages if msg.get("latest_reply")}
+    if latest_replies:
+        pipe.hset(_sync_key(channel_id, "threads"), mapping=latest_replies)
+    pipe.execute()
+    return len(changed)
+
+
+def sync_slack_history_to_chroma(channel_id: str, collection_name: str = "slack_messages", full: bool = False):
+    """
+    Orchestrates fetching messages and storing them in ChromaDB. Unless `full`
+    is set, only messages and threads that changed since the last sync are fetched,
+    and only documents whose text changed are upserted.
+
+    Messages flow through in batches of SLACK_SYNC_BATCH_SIZE, so memory stays flat
+    and a crash loses at most the batch in flight: stored documents are skipped by
+    hash on the next run, and the channel watermark only moves once all are stored.
+    """
+    oldest = None if full else redis_client.get(_sync_key(channel_id, "oldest"))
+    thread_watermarks = {} if full else redis_client.hgetall(_sync_key(channel_id, "threads"))
+    messages = iter_channel_messages(channel_id, oldest, thread_watermarks)
+
+    fetched = upserted = 0
+    newest = oldest
+    try:
+        # If a batch fails to store, the prefetch thread stops first, then closing `messages` shuts down its reply pool.
+        with closing(messages), closing(prefetch(batched(messages, SLACK_SYNC_BATCH_SIZE), maxsize=SLACK_SYNC_PREFETCH_BATCHES)) as batches:
+            for batch in batches:
+                upserted += _store_batch(channel_id, collection_name, batch)
+                fetched += len(batch)
+                batch_newest = max((msg["ts"] for msg in batch), key=float)
+                if not newest or float(batch_newest) > float(newest):
+                    newest = batch_newest
+                logging.info(f"Synced {fetched} messages from {channel_id}, {upserted} upserted into {collection_name}")
+    except Exception:
+        # History is paged newest first, older messages may not have been fetched yet.
+        logging.error(f"Sync of {channel_id} aborted after {fetched} messages, watermark left at {oldest}")
+        raise
+
+    if not fetched:
         logging.info("No new messages to add.")
         return
 
-    documents_to_embed = [format_document_text(msg) for msg in messages]
-    ids_to_use = [msg["ts"] for msg in messages]
+    if newest != oldest:
+        redis_client.set(_sync_key(channel_id, "oldest"), newest)
 
-    print(f"Adding {len(documents_to_embed)} documents to ChromaDB collection: {collection_name}")
-    get_or_create_chroma_db(documents_to_embed, collection_name, messages, ids_to_use)
 
+# -------------------------------------Live events-----------------------------------------------------------
 
-def search_slack_history(query_text: str, n_results: int = 3):
-    query_embedding_func = GeminiEmbeddingFunction(task_type="retrieval_query")
+@slack_app.event("message")
+def handle_message_events(event, context, logger):
+    """
+    Queues every human message create, edit or delete so it reaches Chroma within
+    seconds. Bot posts, this app's own included, are never indexed.
+    """
+    channel_id = event.get("channel")
+    if SLACK_INGEST_CHANNELS and channel_id not in SLACK_INGEST_CHANNELS:
+        return
+
+    subtype = event.get("subtype")
+    if subtype == "message_deleted":
+        message = event.get("previous_message", {})
+        fields = {"action": "delete", "ts": event.get("deleted_ts", "")}
+    elif subtype == "message_changed":
+        message = event.get("message", {})
+        fields = {"action": "upsert"}
+    elif subtype in (None, "thread_broadcast", "file_share"):
+        message = event
+        fields = {"action": "upsert"}
+    else:
+        return
+    if is_bot_message(message, context.get("bot_user_id")):
+        return
+
+    thread_ts = message.get("thread_ts")
+    if thread_ts:
+        # Replies live inside their parent's document, so the whole thread is rebuilt.
+        if fields["action"] == "delete" and thread_ts == fields["ts"]:
+            fields["ts"] = thread_ts
+        else:
+            fields = {"action": "thread", "ts": thread_ts}
+    elif fields["action"] == "upsert":
+        fields.update({
+            "ts": message.get("ts", ""),
+            "user": message.get("user") or "",
+            "text": message.get("text") or ""
+        })
+
+    fields["channel"] = channel_id
+    # Events for one ts can be applied out of order by concurrent workers; the newest wins.
+    fields["event_ts"] = event.get("event_ts") or event.get("ts") or ""
     try:
-        slack_collection = chromadb_client.get_collection(
-            name="slack_messages",
-            embedding_function=query_embedding_func 
-        )
+        work_queue.enqueue_sync(redis_client, "slack_message", fields)
+    except Exception as e:
+        logger.error(f"Failed to queue Slack {subtype or 'message'} event: {e}")
+
+
+def _store_live_document(channel_id: str, collection_name: str, message: Dict) -> None:
+    document = format_document_text(message)
+    metadata = {k: v for k, v in message.items() if k != "latest_reply"}
+    get_or_create_chroma_db([document], collection_name, [metadata], [message["ts"]])
+
+    pipe = redis_client.pipeline()
+    pipe.hset(_sync_key(channel_id, "docs"), message["ts"], hashlib.sha256(document.encode()).hexdigest())
+    if message.get("latest_reply"):
+        pipe.hset(_sync_key(channel_id, "threads"), message["ts"], message["latest_reply"])
+    pipe.execute()
 
-        results = slack_collection.query(
-            query_texts=[query_text],
-            n_results=n_results
-        )
+
+def _delete_live_document(channel_id: str, collection_name: str, ts: str) -> None:
+    delete_from_chroma(collection_name, [ts])
+    pipe = redis_client.pipeline()
+    pipe.hdel(_sync_key(channel_id, "docs"), ts)
+    pipe.hdel(_sync_key(channel_id, "threads"), ts)
+    pipe.execute()
+
+
+def _apply_live_event(fields: Dict[str, str], collection_name: str) -> None:
+    """
+    Applies one event while holding a lock on its ts, skipping it if a newer
+    event for the same ts was already applied. The last applied event_ts is
+    kept after a delete too, so a stale upsert cannot bring the message back.
+    """
+    channel_id, ts = fields["channel"], fields["ts"]
+    event_ts = fields.get("event_ts")
+    applied_key = _sync_key(channel_id, f"event:{ts}")
+
+    with redis_client.lock(_sync_key(channel_id, f"lock:{ts}"), timeout=LIVE_EVENT_LOCK_SECONDS, blocking_timeout=LIVE_EVENT_LOCK_SECONDS):
+        applied = redis_client.get(applied_key)
+        if event_ts and applied and float(applied) >= float(event_ts):
+            logging.info(f"Skipping Slack {fields['action']} for {ts}, a newer event was already applied")
+            return
+
+        if fields["action"] == "delete":
+            _delete_live_document(channel_id, collection_name, ts)
+        elif fields["action"] == "thread":
+            message = fetch_thread(channel_id, ts)
+            if message is None:
+                _delete_live_document(channel_id, collection_name, ts)
+            else:
+                _store_live_document(channel_id, collection_name, message)
+        else:
+            _store_live_document(channel_id, collection_name, {"user": fields["user"], "text": fields["text"], "ts": ts, "replies": ""})
+
+        if event_ts:
+            redis_client.set(applied_key, event_ts, ex=LIVE_EVENT_ORDER_TTL_SECONDS)
+
+
+async def slack_message_stage(fields: Dict[str, str], collection_name: str = "slack_messages"):
+    """Worker stage that applies one queued Slack event to the collection."""
+    await run_in_chroma(_apply_live_event, fields, collection_name)
+
+
+def search_slack_history(query_text: str, n_results: int = 3):
+    try:
+        metadatas = hybrid_query("slack_messages", query_text, n_results)
 
         formatted_results = []
-        metadatas = results.get('metadatas', [[]])[0]
 
         for meta in metadatas:
 
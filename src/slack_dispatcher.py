@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+import redis.asyncio as aioredis
+from concurrency import REDIS_MAX_CONNECTIONS, slack_limiter
+from rate_limit import slack_bucket
+from slack import async_slack_client
+
+# chat.postMessage allows about one message per second per channel.
+SLACK_CHANNEL_POST_INTERVAL = float(os.environ.get("SLACK_CHANNEL_POST_INTERVAL", "1.0"))
+MAX_BLOCKS_PER_MESSAGE = 50
+MAX_SECTION_CHARS = 3000
+
+redis_client = aioredis.Redis(host='localhost', port=6379, db=1, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS)
+
+# Reserves the channel's next post slot for every dispatcher process at once and returns how many
+# milliseconds the caller must wait for it. Uses the Redis clock, so hosts need not agree on the time.
+_RESERVE_SLOT_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local slot = math.max(now_ms, tonumber(redis.call('GET', KEYS[1]) or '0'))
+local interval = tonumber(ARGV[1])
+redis.call('SET', KEYS[1], slot + interval, 'PX', slot + interval - now_ms + 1000)
+return slot - now_ms
+"""
+
+
+def section_block(text: str) -> Dict:
+    if len(text) > MAX_SECTION_CHARS:
+        text = text[:MAX_SECTION_CHARS - 1] + "…"
+    return {"type": "section", "text": {"type": "mrkdwn", "text": text}}
+
+
+class _Outgoing:
+    """One pending Slack call; further posts to the same thread are folded into it until it is sent."""
+
+    def __init__(self, kind: str, channel: str, thread_ts: Optional[str] = None, ts: Optional[str] = None, mergeable: bool = True):
+        self.kind = kind
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.ts = ts
+        self.mergeable = mergeable
+        self.parts: List[tuple] = []
+        self.futures: List[asyncio.Future] = []
+
+    def block_count(self) -> int:
+        return sum(len(blocks) if blocks else 1 for _, blocks in self.parts) + len(self.parts) - 1
+
+    def render(self) -> Dict:
+        if len(self.parts) == 1:
+            text, blocks = self.parts[0]
+            return {key: value for key, value in (("text", text), ("blocks", blocks)) if value}
+        blocks = []
+        for text, part_blocks in self.parts:
+            if blocks:
+                blocks.append({"type": "divider"})
+            blocks.extend(part_blocks or [section_block(text or "")])
+        return {"text": "\n\n".join(text for text, _ in self.parts if text), "blocks": blocks}
+
+
+class SlackDispatcher:
+    """
+    Sends every outbound Slack message through a queue per channel. Posts are
+    paced to SLACK_CHANNEL_POST_INTERVAL per channel, and posts for the same
+    thread that are still waiting are merged into one Block Kit message. Edits
+    of the same message that are still waiting collapse into the latest one.
+
+    With `redis_client`, post slots are reserved in Redis, so every worker
+    process together stays within the channel's rate. Without it, or while
+    Redis is unreachable, pacing only covers this process.
+
+    Queues are keyed on the channel id. A channel first addressed by name is
+    queued under the name until a post response reveals its id; from then on
+    the name maps to the id, so posts by name and edits by id share one queue.
+    """
+
+    def __init__(self, client=async_slack_client, redis_client: Optional[aioredis.Redis] = None):
+        self.client = client
+        self.redis_client = redis_client
+        self._queues: Dict[str, List[_Outgoing]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._last_post: Dict[str, float] = {}
+        self._channel_ids: Dict[str, str] = {}
+        self.stats = {"requested": 0, "sent": 0, "merged": 0, "failed": 0}
+
+    def _channel_key(self, channel: str) -> str:
+        return self._channel_ids.get(channel, channel)
+
+    def _ensure_worker(self, channel: str) -> None:
+        worker = self._workers.get(channel)
+        if worker is None or worker.done():
+            self._workers[channel] = asyncio.create_task(self._drain(channel))
+
+    def _submit(self, item: _Outgoing, text: Optional[str], blocks: Optional[List[Dict]]) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        item.parts.append((text, blocks))
+        item.futures.append(future)
+        self.stats["requested"] += 1
+        self._ensure_worker(item.channel)
+        return future
+
+    async def post(self, channel: str, text: Optional[str] = None, blocks: Optional[List[Dict]] = None, thread_ts: Optional[str] = None, merge: bool = True) -> Dict:
+        """chat.postMessage through the channel queue. Merged callers all get the one response."""
+        channel = self._channel_key(channel)
+        queue = self._queues.setdefault(channel, [])
+        if merge and thread_ts:
+            size = len(blocks) if blocks else 1
+            for item in queue:
+                if item.kind == "post" and item.mergeable and item.thread_ts == thread_ts and item.block_count() + size + 1 <= MAX_BLOCKS_PER_MESSAGE:
+                    self.stats["merged"] += 1
+                    return await self._submit(item, text, blocks)
+
+        item = _Outgoing("post", channel, thread_ts=thread_ts, mergeable=merge)
+        queue.append(item)
+        return await self._submit(item, text, blocks)
+
+    async def update(self, channel: str, ts: str, text: Optional[str] = None, blocks: Optional[List[Dict]] = None) -> Dict:
+        """chat.update through the channel queue; `channel` must be the channel id."""
+        channel = self._channel_key(channel)
+        queue = self._queues.setdefault(channel, [])
+        for item in queue:
+            if item.kind == "update" and item.ts == ts:
+                # Only the latest content of a message matters.
+                item.parts.clear()
+                self.stats["merged"] += 1
+                return await self._submit(item, text, blocks)
+
+        item = _Outgoing("update", channel, ts=ts)
+        queue.append(item)
+        return await self._submit(item, text, blocks)
+
+    def _learn_channel_id(self, channel: str, channel_id: str) -> None:
+        """Moves what is still queued under a channel name onto the id's queue."""
+        self._channel_ids[channel] = channel_id
+        self._last_post[channel_id] = max(self._last_post.get(channel_id, 0.0), self._last_post.pop(channel, 0.0))
+        queue = self._queues.pop(channel, [])
+        for item in queue:
+            item.channel = channel_id
+        if queue:
+            self._queues.setdefault(channel_id, []).extend(queue)
+            self._ensure_worker(channel_id)
+
+    async def _post_wait(self, channel: str) -> float:
+        """Seconds until this process may post to the channel, reserving that slot."""
+        if self.redis_client is not None:
+            try:
+                wait_ms = await self.redis_client.eval(
+                    _RESERVE_SLOT_SCRIPT, 1, f"slack:post_slot:{channel}", int(SLACK_CHANNEL_POST_INTERVAL * 1000)
+                )
+                return int(wait_ms) / 1000
+            except Exception as e:
+                logging.warning(f"Shared Slack pacing for {channel} unavailable, pacing locally: {e}")
+        return self._last_post.get(channel, 0.0) + SLACK_CHANNEL_POST_INTERVAL - time.monotonic()
+
+    def _fail_queued(self, channel: str, error: BaseException) -> None:
+        for item in self._queues.pop(channel, []):
+            for future in item.futures:
+                if future.done():
+                    continue
+                if isinstance(error, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(error)
+
+    async def _drain(self, channel: str) -> None:
+        queue = self._queues[channel]
+        try:
+            while queue:
+                item = queue[0]
+                if item.kind == "post":
+                    wait = await self._post_wait(channel)
+                    if wait > 0:
+                        # The item stays queued while waiting, so more posts can still merge into it.
+                        await asyncio.sleep(wait)
+                else:
+                    await slack_bucket("chat.update").acquire_async()
+                queue.pop(0)
+
+                response = None
+                try:
+                    async with slack_limiter:
+                        if item.kind == "post":
+                            kwargs = {"thread_ts": item.thread_ts} if item.thread_ts else {}
+                            response = await self.client.chat_postMessage(channel=channel, **item.render(), **kwargs)
+                        else:
+                            response = await self.client.chat_update(channel=channel, ts=item.ts, **item.render())
+                    self.stats["sent"] += 1
+                    for future in item.futures:
+                        if not future.done():
+                            future.set_result(response)
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logging.error(f"Slack {item.kind} to {channel} failed: {e}")
+                    for future in item.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                finally:
+                    if item.kind == "post":
+                        self._last_post[channel] = time.monotonic()
+
+                channel_id = response.get("channel") if response is not None else None
+                if channel_id and channel_id != channel:
+                    # The rest of this queue continues on the id's worker.
+                    self._learn_channel_id(channel, channel_id)
+                    return
+        except BaseException as e:
+            # Pacing failed outside a Slack call; every caller still waiting gets the error instead of hanging.
+            logging.error(f"Slack dispatcher for {channel} stopped: {e!r}")
+            self._fail_queued(channel, e)
+            if not isinstance(e, Exception):
+                raise
+
+
+dispatcher = SlackDispatcher(redis_client=redis_client)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+from slack_dispatcher import dispatcher
+
+# Slack asks for no more than about one edit per second on a message.
+SLACK_STREAM_UPDATE_SECONDS = float(os.environ.get("SLACK_STREAM_UPDATE_SECONDS", "1.0"))
+STREAM_CURSOR = " ▍"
+
+
+class StreamingMessage:
+    """
+    A thread reply that is posted as soon as the first text arrives and then
+    edited in place with chat_update while more streams in. Edits run on a
+    background task, at most one per SLACK_STREAM_UPDATE_SECONDS, always with
+    the latest text, so a slow Slack call never holds up the stream. Given the
+    `ts` and `channel_id` of a message posted earlier, it edits that one instead.
+    """
+
+    def __init__(self, channel: str, thread_ts: str, prefix: str = "", ts: Optional[str] = None, channel_id: Optional[str] = None):
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.prefix = prefix
+        self.ts = ts if channel_id else None
+        self.channel_id = channel_id if ts else None
+        self._text = ""
+        self._sent: Optional[str] = None
+        self._last_sent = 0.0
+        self._flusher: Optional[asyncio.Task] = None
+        self._finished = False
+
+    def append(self, delta: str) -> None:
+        self._text += delta
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    def _render(self, final: bool) -> str:
+        return f"{self.prefix}{self._text}{'' if final else STREAM_CURSOR}"
+
+    async def _send(self, text: str) -> None:
+        if self.ts is None:
+            # Its ts is needed for the edits, so the first post is never merged with others.
+            response = await dispatcher.post(self.channel, text=text, thread_ts=self.thread_ts, merge=False)
+            # chat.update needs the channel id, not the #name the message was posted to.
+            self.ts = response["ts"]
+            self.channel_id = response["channel"]
+        else:
+            await dispatcher.update(self.channel_id, self.ts, text=text)
+        self._sent = text
+        self._last_sent = time.monotonic()
+
+    async def _wait_for_turn(self) -> None:
+        if self.ts is not None:
+            wait = self._last_sent + SLACK_STREAM_UPDATE_SECONDS - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._wait_for_turn()
+            text = self._render(final=False)
+            if self._finished or text == self._sent:
+                return
+            try:
+                await self._send(text)
+            except Exception as e:
+                logging.error(f"Failed to stream update to Slack: {e}")
+                return
+
+    async def finish(self, text: Optional[str] = None, prefix: Optional[str] = None) -> None:
+        """Waits for any edit in flight, then writes the final text without the cursor."""
+        self._finished = True
+        if text is not None:
+            self._text = text
+        if prefix is not None:
+            self.prefix = prefix
+        if self._flusher is not None:
+            await self._flusher
+        final = self._render(final=True)
+        if final == self._sent:
+            return
+        await self._wait_for_turn()
+        try:
+            await self._send(final)
+        except Exception as e:
+            logging.error(f"Failed to post final streamed message to Slack: {e}")
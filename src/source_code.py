@@ -1,92 +1,340 @@
+import logging
 import os
-from typing import Optional
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+from uuid import uuid4
+import redis
 from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, UploadFile, status
-from gemini import GeminiEmbeddingFunction
-from chroma import get_or_create_chroma_db
-from langchain_text_splitters import RecursiveCharacterTextSplitter, Language
+from chroma import delete_from_chroma, get_or_create_chroma_db
+from retrieval import hybrid_query
+from code_chunking import ChunkedFile, chunk_files, get_langchain_language_from_extension
+from symbol_index import get_symbol_index, parse_stack_frames
+from utils import ARCHIVE_EXTENSIONS, UPLOAD_READ_SIZE, batched, extract_archive, process_map_unordered
 app = FastAPI()
+redis_client = redis.Redis(host='localhost', port=6379, db=1, decode_responses=True)
+
+CODE_COLLECTION = "source_code"
+CODE_WORKERS = int(os.environ.get("CODE_WORKERS", str(os.cpu_count() or 1)))
+CODE_FILES_PER_TASK = 64
+CODE_EMBED_BATCH_SIZE = int(os.environ.get("CODE_EMBED_BATCH_SIZE", "500"))
+# Larger files are almost always generated, vendored or minified.
+CODE_MAX_FILE_BYTES = int(os.environ.get("CODE_MAX_FILE_BYTES", str(512 * 1024)))
+CODE_UPLOAD_DIR = os.environ.get("CODE_UPLOAD_DIR", tempfile.gettempdir())
+CODE_JOB_TTL_SECONDS = 7 * 86400
+
+SKIP_DIRS = {
+    ".git", ".hg", ".svn", "node_modules", "vendor", "third_party", "dist", "build", "target",
+    "__pycache__", ".venv", "venv", ".tox", ".mypy_cache", ".pytest_cache", ".idea", ".gradle",
+}
+
+# Clone sources an unauthenticated caller may name: remote https or ssh only, never file:// or a host path.
+GIT_ALLOWED_SCHEMES = ("https", "ssh")
+_SCP_LIKE_URL = re.compile(r"^[\w.-]+@[\w.-]+:(?!/)[\w./~-]+$")
+
 
 
 def search_codebase(search_query, results = 3):
-    pass
-
-def get_langchain_language_from_extension(extension: str) -> Optional[Language]:
-
-    normalized_extension = extension.lstrip('.').lower()
-
-    extension_to_language_map = {
-        'cpp': 'cpp', 'cc': 'cpp', 'cxx': 'cpp', 'hpp': 'cpp', 'hxx': 'cpp',
-        'go': 'go',
-        'java': 'java',
-        'kt': 'kotlin', 'kts': 'kotlin',
-        'js': 'js', 'jsx': 'js',
-        'ts': 'ts', 'tsx': 'ts',
-        'php': 'php',
-        'proto': 'proto',
-        'py': 'python',
-        'rst': 'rst',
-        'rb': 'ruby',
-        'rs': 'rust',
-        'scala': 'scala', 'sc': 'scala',
-        'swift': 'swift',
-        'md': 'markdown', 'markdown': 'markdown',
-        'tex': 'latex',
-        'html': 'html', 'htm': 'html',
-        'sol': 'sol',
-        'cs': 'csharp',
-        'cbl': 'cobol', 'cob': 'cobol',
-        'c': 'c', 'h': 'c',
-        'lua': 'lua',
-        'pl': 'perl', 'pm': 'perl',
-        'hs': 'haskell', 'lhs': 'haskell',
-        'ex': 'elixir', 'exs': 'elixir',
-        'ps1': 'powershell', 'psm1': 'powershell', 'psd1': 'powershell',
-        'bas': 'visualbasic6', 'vb': 'visualbasic6'
-    }
-
-    language_string = extension_to_language_map.get(normalized_extension)
-
-    if language_string:
-        return language_string
-    else:
-        return None
-
-def chunk_it(file, file_name, extention):
-    ext = get_langchain_language_from_extension(extension=extention)
-    if ext is None:
-        raise ValueError()
-    chunk = RecursiveCharacterTextSplitter.from_language(language=Language(ext))
-    ids = [f"{file_name}_chunk_{i}" for i in range(len(file))]
-    metadatas = [
-        {"source_file": file_name, "chunk_index": i, "language": extention}
-        for i in range(len(chunk))
-    ]
-    get_or_create_chroma_db(chunk, "code collection", metadata=metadatas, db_ids=ids)
-
-
-@app.post()
-async def upload_code(codebase: UploadFile, backgroundtask: BackgroundTasks):
+    try:
+        metadatas = hybrid_query(CODE_COLLECTION, search_query, results)
 
-    if not codebase.filename:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+        formatted_results = []
+        for meta in metadatas:
+            location = f"{meta.get('repo')}/{meta.get('path')}:{meta.get('line_start')}-{meta.get('line_end')}"
+            symbol = f" in `{meta['symbol']}`" if meta.get("symbol") else ""
+            snippet = meta.get("preview", "There is no code")
+            formatted_results.append(f"From {location}{symbol}, here is a snippet: \"{snippet}\"")
 
+        return formatted_results
+    except Exception as e:
+        logging.error(f"Failed to query ChromaDB collection '{CODE_COLLECTION}': {e}")
+        return []
+
+def lookup_source_locations(text: str, limit: int = 5) -> List[str]:
+    """
+    Exact lookup of the stack frames and file:line references in `text` against
+    the symbol table built during ingestion. No embedding call is made.
+    """
+    frames = parse_stack_frames(text)
+    if not frames:
+        return []
     try:
-        code_bytes = await codebase.read()
-        decode = code_bytes.decode()
-    except UnicodeDecodeError:
-        raise HTTPException(
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        resolved = get_symbol_index().lookup_frames(frames, limit=limit)
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        logging.error(f"Symbol lookup failed: {e}")
+        return []
+
+    formatted_results = []
+    for frame, hit in resolved:
+        symbol = f" `{hit.qualname}`" if hit.qualname else ""
+        line = f" (frame line {frame.line})" if frame.line else ""
+        formatted_results.append(f"{hit.repo}/{hit.path}:{hit.line_start}-{hit.line_end}{symbol}{line}")
+    return formatted_results
+
+# -------------------------------------Indexing-----------------------------------------------------------
+
+def _manifest_key(repo: str) -> str:
+    return f"code:manifest:{repo}"
+
+
+def _chunk_id(repo: str, path: str, index: int) -> str:
+    return f"{repo}:{path}:{index}"
+
+
+def _chunk_ids(repo: str, path: str, start: int, stop: int) -> List[str]:
+    return [_chunk_id(repo, path, i) for i in range(start, stop)]
+
+
+def load_code_manifest(repo: str) -> Dict[str, Tuple[str, int]]:
+    """path -> (file_hash, chunk_count) for every file indexed from the repo."""
+    manifest = {}
+    for path, value in redis_client.hgetall(_manifest_key(repo)).items():
+        file_hash, _, count = value.rpartition(":")
+        manifest[path] = (file_hash, int(count))
+    return manifest
+
+
+def walk_source_files(root: str) -> Iterator[str]:
+    """Repo-relative paths of files with a known language, skipping vendored and build directories."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS and not d.startswith(".")]
+        for filename in filenames:
+            if get_langchain_language_from_extension(os.path.splitext(filename)[1]) is None:
+                continue
+            full_path = os.path.join(dirpath, filename)
+            try:
+                if os.path.islink(full_path) or os.path.getsize(full_path) > CODE_MAX_FILE_BYTES:
+                    continue
+            except OSError:
+                continue
+            yield os.path.relpath(full_path, root).replace(os.sep, "/")
+
+
+def _iter_chunked_files(root: str, files: Iterator[Tuple[str, Optional[str]]]) -> Iterator[ChunkedFile]:
+    tasks = batched(files, CODE_FILES_PER_TASK)
+    if CODE_WORKERS <= 1:
+        for task in tasks:
+            yield from chunk_files(root, task)
+        return
+
+    # Bounded, so chunked files never pile up ahead of the embedder.
+    for results in process_map_unordered(partial(chunk_files, root), tasks, CODE_WORKERS):
+        yield from results
+
+
+def index_repository(repo: str, root: str, paths: Optional[List[str]] = None, prune: bool = True, on_progress=None) -> Dict[str, int]:
+    """
+    Indexes every source file under `root` (or just `paths`) into the code
+    collection. Files whose content hash matches the repo manifest are not
+    read past hashing; changed files are chunked on a process pool and embedded
+    in CODE_EMBED_BATCH_SIZE batches. With `prune`, files that disappeared
+    from the tree are removed from the collection.
+    """
+    manifest = load_code_manifest(repo)
+    walked = list(paths) if paths is not None else list(walk_source_files(root))
+    stats = {"files": len(walked), "skipped": 0, "indexed": 0, "failed": 0, "chunks": 0, "deleted": 0}
+
+    pending_chunks: List[Dict] = []
+    pending_files: List[Tuple[str, str, int]] = []
+    pending_symbols: List[Tuple[str, str, List[Tuple[int, int, str]]]] = []
+    symbols = get_symbol_index()
+    # Repos indexed before the symbol table existed are re-chunked once to fill it;
+    # unchanged chunks come back from the embedding cache.
+    known_hashes = {path: file_hash for path, (file_hash, _) in manifest.items()} if symbols.file_count(repo) or not manifest else {}
+
+    def _flush():
+        if pending_chunks:
+            get_or_create_chroma_db(
+                documents_to_embed=[chunk["text"] for chunk in pending_chunks],
+                collection_name=CODE_COLLECTION,
+                metadata=[chunk["metadata"] for chunk in pending_chunks],
+                db_ids=[_chunk_id(repo, chunk["metadata"]["path"], chunk["metadata"]["chunk_index"]) for chunk in pending_chunks]
+            )
+        stale = []
+        pipe = redis_client.pipeline()
+        for path, file_hash, count in pending_files:
+            _, old_count = manifest.get(path, ("", 0))
+            stale.extend(_chunk_ids(repo, path, count, old_count))
+            pipe.hset(_manifest_key(repo), path, f"{file_hash}:{count}")
+        if stale:
+            delete_from_chroma(CODE_COLLECTION, stale)
+        symbols.replace_files(repo, pending_symbols)
+        # The manifest is written only after the file's chunks are stored, so a crash re-indexes it.
+        pipe.execute()
+        stats["chunks"] += len(pending_chunks)
+        stats["deleted"] += len(stale)
+        pending_chunks.clear()
+        pending_files.clear()
+        pending_symbols.clear()
+        if on_progress:
+            on_progress(stats)
+
+    files = ((path, known_hashes.get(path)) for path in walked)
+    for path, file_hash, chunks, definitions, error in _iter_chunked_files(root, files):
+        if error:
+            logging.error(f"Failed to index {repo}/{path}: {error}")
+            stats["failed"] += 1
+            continue
+        if chunks is None:
+            stats["skipped"] += 1
+            continue
+        for chunk in chunks:
+            chunk["metadata"]["repo"] = repo
+            chunk["metadata"]["source"] = f"{repo}/{path}"
+        pending_chunks.extend(chunks)
+        pending_files.append((path, file_hash, len(chunks)))
+        pending_symbols.append((path, get_langchain_language_from_extension(os.path.splitext(path)[1]), definitions))
+        stats["indexed"] += 1
+        if len(pending_chunks) >= CODE_EMBED_BATCH_SIZE:
+            _flush()
+    _flush()
+
+    if prune and paths is None:
+        removed = set(manifest) - set(walked)
+        for batch in batched(sorted(removed), CODE_EMBED_BATCH_SIZE):
+            ids = [cid for path in batch for cid in _chunk_ids(repo, path, 0, manifest[path][1])]
+            if ids:
+                delete_from_chroma(CODE_COLLECTION, ids)
+            symbols.delete_files(repo, batch)
+            redis_client.hdel(_manifest_key(repo), *batch)
+            stats["deleted"] += len(ids)
+
+    return stats
+
+# -------------------------------------Ingest jobs-----------------------------------------------------------
+
+def _job_key(job_id: str) -> str:
+    return f"code:job:{job_id}"
+
+
+def _extract_archive(archive_path: str, root: str) -> None:
+    """Unpacks a zip or tar of a repository, keeping only source files that stay inside `root`."""
+    extract_archive(
+        archive_path,
+        destination=lambda name: os.path.join(root, name),
+        wanted=lambda name, size: size <= CODE_MAX_FILE_BYTES and get_langchain_language_from_extension(os.path.splitext(name)[1]) is not None,
+    )
+
+
+def _archive_root(root: str) -> str:
+    """Archives of a repo usually wrap it in one top-level directory; index from inside it."""
+    entries = os.listdir(root)
+    if len(entries) == 1 and os.path.isdir(os.path.join(root, entries[0])):
+        return os.path.join(root, entries[0])
+    return root
+
+
+def is_allowed_git_url(url: str) -> bool:
+    if _SCP_LIKE_URL.match(url):
+        return True
+    parsed = urlparse(url)
+    return parsed.scheme in GIT_ALLOWED_SCHEMES and bool(parsed.hostname) and not url.startswith("-")
+
+
+def run_code_job(job_id: str, repo: str, job_dir: str, source: Dict) -> None:
+    """Materializes the upload or git checkout under `job_dir`, indexes it and records progress."""
+    key = _job_key(job_id)
+    started = time.monotonic()
+    redis_client.hset(key, "status", "running")
+    try:
+        root = os.path.join(job_dir, "tree")
+        os.makedirs(root, exist_ok=True)
+        paths = None
+        if source["kind"] == "git":
+            command = ["git", "clone", "--depth", "1", "--quiet"]
+            if source.get("ref"):
+                command += ["--branch", source["ref"]]
+            # Also keeps redirects and submodules from reaching file:// or ext:: transports.
+            env = {**os.environ, "GIT_ALLOW_PROTOCOL": ":".join(GIT_ALLOWED_SCHEMES), "GIT_TERMINAL_PROMPT": "0"}
+            subprocess.run(command + ["--", source["url"], root], check=True, capture_output=True, timeout=1800, env=env)
+        elif source["kind"] == "archive":
+            _extract_archive(source["path"], root)
+            os.remove(source["path"])
+            root = _archive_root(root)
+        else:
+            os.replace(source["path"], os.path.join(root, source["name"]))
+            paths = [source["name"]]
+
+        stats = index_repository(
+            repo, root, paths=paths, prune=paths is None,
+            on_progress=lambda progress: redis_client.hset(key, mapping=progress)
+        )
+        redis_client.hset(key, mapping={**stats, "status": "completed", "seconds": round(time.monotonic() - started, 3)})
+        logging.info(f"Indexed {repo}: {stats}")
+    except subprocess.CalledProcessError as e:
+        logging.error(f"git clone of {source.get('url')} failed: {e.stderr}")
+        redis_client.hset(key, mapping={"status": "failed", "error": (e.stderr or b"").decode(errors="replace")[-500:]})
+    except Exception as e:
+        logging.error(f"Code index job {job_id} for {repo} failed: {e}")
+        redis_client.hset(key, mapping={"status": "failed", "error": str(e)})
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def _start_job(backgroundtask: BackgroundTasks, repo: str, job_dir: str, source: Dict) -> Dict:
+    job_id = str(uuid4())
+    key = _job_key(job_id)
+    redis_client.hset(key, mapping={"status": "queued", "repo": repo, "created_at": time.time()})
+    redis_client.expire(key, CODE_JOB_TTL_SECONDS)
+    backgroundtask.add_task(run_code_job, job_id, repo, job_dir, source)
+    return {"job_id": job_id, "repo": repo}
+
+
+@app.post("/upload_code")
+async def upload_code(codebase: UploadFile, backgroundtask: BackgroundTasks, repo: Optional[str] = None):
+    """
+    Indexes a single source file, or a whole repository uploaded as a zip or
+    tar archive. Archives replace the repo's previous contents in the index.
+    """
+    if not codebase.filename:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
 
     file_name = os.path.basename(codebase.filename)
-    _, extention = os.path.splitext(codebase.filename)
+    is_archive = file_name.lower().endswith(ARCHIVE_EXTENSIONS)
+    _, extention = os.path.splitext(file_name)
 
-    if extention == "":
+    if not is_archive and get_langchain_language_from_extension(extention) is None:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
-    
-    backgroundtask.add_task(chunk_it, decode, file_name, extention)
 
+    job_dir = tempfile.mkdtemp(prefix="code-job-", dir=CODE_UPLOAD_DIR)
+    path = os.path.join(job_dir, f"upload-{file_name}")
+    try:
+        with open(path, "wb") as out:
+            while chunk := await codebase.read(UPLOAD_READ_SIZE):
+                out.write(chunk)
+    except Exception:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if is_archive:
+        repo = repo or re.sub(r"(\.tar)?\.[a-z0-9]+$", "", file_name, flags=re.IGNORECASE)
+        return _start_job(backgroundtask, repo, job_dir, {"kind": "archive", "path": path})
+    return _start_job(backgroundtask, repo or "uploads", job_dir, {"kind": "file", "path": path, "name": file_name})
+
+
+@app.post("/index_repo")
+async def index_repo(request: Request, backgroundtask: BackgroundTasks):
+    """Shallow-clones a git repository and indexes it. Body: {"url": ..., "ref": optional, "repo": optional}."""
+    body = await request.json()
+    url, ref = body.get("url"), body.get("ref")
+    if not isinstance(url, str) or not is_allowed_git_url(url):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="url must be an https:// or ssh:// git remote")
+    if ref is not None and (not isinstance(ref, str) or ref.startswith("-")):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid ref")
 
+    repo = body.get("repo") or re.sub(r"\.git$", "", url.rstrip("/").rsplit("/", 1)[-1])
+    job_dir = tempfile.mkdtemp(prefix="code-job-", dir=CODE_UPLOAD_DIR)
+    return _start_job(backgroundtask, repo, job_dir, {"kind": "git", "url": url, "ref": ref})
 
 
+@app.get("/upload_code/{job_id}")
+async def code_job_status(job_id: str):
+    job = redis_client.hgetall(_job_key(job_id))
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown job id")
+    return job
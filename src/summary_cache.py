@@ -0,0 +1,208 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+import redis.asyncio as aioredis
+from chroma import chromadb_client
+from concurrency import REDIS_MAX_CONNECTIONS, run_in_chroma
+from gemini import embed_texts_async
+
+SUMMARY_CACHE_TTL_SECONDS = int(os.environ.get("SUMMARY_CACHE_TTL_SECONDS", "86400"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get("SUMMARY_CACHE_MAX_ENTRIES", "5000"))
+# Near-duplicate lookups cost one embedding call, so they are opt-in.
+SUMMARY_CACHE_SEMANTIC = os.environ.get("SUMMARY_CACHE_SEMANTIC", "false").lower() == "true"
+SUMMARY_CACHE_MAX_DISTANCE = float(os.environ.get("SUMMARY_CACHE_MAX_DISTANCE", "0.05"))
+
+ENTRY_PREFIX = "summary:cache:entry"
+# The summary's own embedding, kept with its entry so a hit does not embed the same text again.
+EMBEDDING_PREFIX = "summary:cache:embedding"
+LRU_KEY = "summary:cache:lru"
+STATS_KEY = "summary:cache:stats"
+COLLECTION_NAME = "summary_cache"
+
+SummaryEmbedder = Callable[[str], Awaitable[Optional[List[float]]]]
+
+redis_client = aioredis.Redis(host='localhost', port=6379, db=1, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS)
+
+# Each alert group in the context starts with a "--- ... ---" header line.
+_ALERT_HEADER = re.compile(r"^(?=--- )", re.MULTILINE)
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?")
+# A number standing on its own, not part of an identifier such as web-01, 10.0.0.5:9100 or v2.
+_MEASUREMENT = re.compile(r"(?<![\w.:/-])\d+(?:\.\d+)?(?![\w.:/-]*\w)")
+_VALUE_COUNT = re.compile(r"\(\d+\+? values:")
+_REPEAT_COUNT = re.compile(r"\[\d+x\]$")
+_WHITESPACE = re.compile(r"\s+")
+# Lines that carry label values, which identify hosts, pods and services and are kept verbatim.
+_LABEL_LINES = ("Labels:", "Varying:")
+
+
+def _magnitude(match: re.Match) -> str:
+    """Keeps the order of magnitude, so 95% and 97% share a key but 5% and 95% do not."""
+    return f"<n{len(match.group().split('.')[0])}>"
+
+
+def _canonical_line(line: str) -> str:
+    line = _TIMESTAMP.sub("<ts>", line)
+    if line.startswith(_LABEL_LINES):
+        line = _VALUE_COUNT.sub("(<n> values:", line)
+    elif line.startswith(("--- ", "... ", "The following ")):
+        # Alert counts and status tallies.
+        line = _NUMBER.sub("<n>", line)
+    else:
+        # Summary and description text: measurements change between firings, identifiers do not.
+        line = _MEASUREMENT.sub(_magnitude, _REPEAT_COUNT.sub("[<n>x]", line.rstrip()))
+    return _WHITESPACE.sub(" ", line).strip()
+
+
+def canonicalize_context(context: str) -> str:
+    """
+    Normalizes an llm_context so recurring alerts map to the same key: group
+    order is dropped, timestamps, counts and measurements are masked and
+    whitespace collapsed. Label values such as instance, job, service and pod
+    stay verbatim, so a summary naming one host is never served for another.
+    """
+    blocks = []
+    for block in _ALERT_HEADER.split(context):
+        block = "\n".join(line for line in map(_canonical_line, block.splitlines()) if line)
+        if block:
+            blocks.append(block)
+    return "\n".join(sorted(blocks))
+
+
+def context_hash(canonical: str) -> str:
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+async def _record(stat: str) -> None:
+    await redis_client.hincrby(STATS_KEY, stat, 1)
+
+
+async def cache_stats() -> dict:
+    """Hit and miss counters since the stats key was last cleared."""
+    stats = {k: int(v) for k, v in (await redis_client.hgetall(STATS_KEY)).items()}
+    hits = stats.get("exact_hits", 0) + stats.get("semantic_hits", 0)
+    lookups = hits + stats.get("misses", 0)
+    stats["hit_ratio"] = hits / lookups if lookups else 0.0
+    stats["entries"] = await redis_client.zcard(LRU_KEY)
+    return stats
+
+
+@functools.lru_cache(maxsize=None)
+def _collection():
+    return chromadb_client.get_or_create_collection(name=COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+
+
+async def _touch(key: str) -> Optional[str]:
+    summary = await redis_client.get(f"{ENTRY_PREFIX}:{key}")
+    if summary is not None:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.expire(f"{ENTRY_PREFIX}:{key}", SUMMARY_CACHE_TTL_SECONDS)
+        pipe.expire(f"{EMBEDDING_PREFIX}:{key}", SUMMARY_CACHE_TTL_SECONDS)
+        await pipe.execute()
+    return summary
+
+
+async def _nearest(embedding) -> Optional[Tuple[str, str]]:
+    result = await run_in_chroma(_collection().query, query_embeddings=[embedding], n_results=1)
+    ids = result.get("ids", [[]])[0]
+    distances = result.get("distances", [[]])[0]
+    if not ids or distances[0] > SUMMARY_CACHE_MAX_DISTANCE:
+        return None
+
+    summary = await _touch(ids[0])
+    if summary is None:
+        # The Redis entry expired, the vector is stale.
+        await run_in_chroma(_collection().delete, ids=[ids[0]])
+        return None
+    return ids[0], summary
+
+
+async def _evict() -> None:
+    """Drops least recently used entries above SUMMARY_CACHE_MAX_ENTRIES."""
+    overflow = await redis_client.zcard(LRU_KEY) - SUMMARY_CACHE_MAX_ENTRIES
+    if overflow <= 0:
+        return
+    stale = await redis_client.zpopmin(LRU_KEY, overflow)
+    keys = [key for key, _ in stale]
+    await redis_client.delete(*[f"{prefix}:{key}" for key in keys for prefix in (ENTRY_PREFIX, EMBEDDING_PREFIX)])
+    if SUMMARY_CACHE_SEMANTIC:
+        await run_in_chroma(_collection().delete, ids=keys)
+
+
+async def _store(key: str, summary: str, embedding=None, summary_embedding=None) -> None:
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(f"{ENTRY_PREFIX}:{key}", summary, ex=SUMMARY_CACHE_TTL_SECONDS)
+    if summary_embedding is not None:
+        pipe.set(f"{EMBEDDING_PREFIX}:{key}", json.dumps(summary_embedding), ex=SUMMARY_CACHE_TTL_SECONDS)
+    pipe.zadd(LRU_KEY, {key: time.time()})
+    await pipe.execute()
+    if embedding is not None:
+        await run_in_chroma(_collection().upsert, ids=[key], embeddings=[embedding], documents=[summary])
+    await _evict()
+
+
+async def _summary_embedding(key: str, summary: str, embed: Optional[SummaryEmbedder]) -> Optional[List[float]]:
+    """The embedding stored with a cache hit; an entry stored without one gets it now."""
+    if embed is None:
+        return None
+    try:
+        stored = await redis_client.get(f"{EMBEDDING_PREFIX}:{key}")
+        if stored is not None:
+            return json.loads(stored)
+    except Exception as e:
+        logging.error(f"Summary cache embedding lookup failed: {e}")
+
+    vector = await embed(summary)
+    if vector is not None:
+        try:
+            await redis_client.set(f"{EMBEDDING_PREFIX}:{key}", json.dumps(vector), ex=SUMMARY_CACHE_TTL_SECONDS)
+        except Exception as e:
+            logging.error(f"Summary cache embedding store failed: {e}")
+    return vector
+
+
+async def cached_summary(context: str, generate: Callable[[str], Awaitable[str]], embed: Optional[SummaryEmbedder] = None) -> Tuple[str, Optional[List[float]]]:
+    """
+    Returns (summary, summary embedding) for the alert context, calling `generate`
+    only when neither the exact layer nor (if enabled) the near-duplicate layer
+    has one. `embed` embeds a fresh summary; its vector is cached with the entry,
+    so a hit never embeds the same summary again. Without `embed` the second
+    item is None.
+    """
+    canonical = canonicalize_context(context)
+    key = context_hash(canonical)
+
+    try:
+        summary = await _touch(key)
+        if summary is not None:
+            await _record("exact_hits")
+            return summary, await _summary_embedding(key, summary, embed)
+    except Exception as e:
+        logging.error(f"Summary cache lookup failed: {e}")
+
+    embedding = None
+    if SUMMARY_CACHE_SEMANTIC:
+        try:
+            embedding = (await embed_texts_async([canonical], task_type="semantic_similarity"))[0]
+            nearest = await _nearest(embedding)
+            if nearest is not None:
+                await _record("semantic_hits")
+                return nearest[1], await _summary_embedding(*nearest, embed)
+        except Exception as e:
+            logging.error(f"Summary cache semantic lookup failed: {e}")
+
+    summary = await generate(context)
+    summary_embedding = await embed(summary) if embed and summary else None
+    try:
+        await _record("misses")
+        if summary:
+            await _store(key, summary, embedding, summary_embedding)
+    except Exception as e:
+        logging.error(f"Summary cache store failed: {e}")
+    return summary, summary_embedding
@@ -0,0 +1,197 @@
+import os
+import re
+import sqlite3
+import threading
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+SYMBOL_INDEX_PATH = os.environ.get("SYMBOL_INDEX_PATH", "./chroma_db/symbols.sqlite")
+MAX_FRAMES = 20
+
+Definition = Tuple[int, Optional[int], str]
+
+# File "/app/api/handlers.py", line 42, in create_order
+_PYTHON_FRAME = re.compile(r'File "([^"]+)", line (\d+)(?:, in ([\w<>.]+))?')
+# at com.shop.api.OrderService.create(OrderService.java:42)
+_JVM_FRAME = re.compile(r"at ([\w$.<>]+)\(([\w$\-]+\.\w+):(\d+)\)")
+# at createOrder (/app/src/orders.js:42:13)
+_JS_FRAME = re.compile(r"at ([\w$.<>\[\] ]+?) \((?:file://)?([^\s():]+):(\d+)(?::\d+)?\)")
+# Bare file names only count as source with one of these, so host:port such as db.internal:5432 is not a frame.
+SOURCE_EXTENSIONS = (
+    "py", "java", "kt", "kts", "scala", "groovy", "js", "jsx", "mjs", "cjs", "ts", "tsx", "go", "rs", "rb",
+    "php", "c", "h", "cc", "cpp", "cxx", "hpp", "cs", "swift", "m", "mm", "ex", "exs", "erl", "clj", "lua", "pl", "sh",
+)
+# /app/server.go:42, src/main.rs:42:5, app/models/order.rb:42:in `save', main.py:42
+_PATH_LINE = re.compile(
+    r"(?<![\w.\-/])/?((?:[\w.\-]+/)+[\w\-]+\.[A-Za-z]{1,6}|[\w\-]+\.(?:" + "|".join(SOURCE_EXTENSIONS) + r"))"
+    r":(\d+)(?::\d+)?(?::in `([\w?!]+)')?(?!\w)"
+)
+_SYMBOL_PARTS = re.compile(r"\.|::|#")
+
+
+class StackFrame(NamedTuple):
+    path: Optional[str]
+    line: Optional[int]
+    function: Optional[str]
+
+
+class SymbolHit(NamedTuple):
+    repo: str
+    path: str
+    qualname: str
+    line_start: int
+    line_end: int
+    language: str
+
+
+def parse_stack_frames(text: str) -> List[StackFrame]:
+    """Stack frames and file:line references found in free text, in order of appearance, deduplicated."""
+    found = []
+    spans = []
+    for pattern, fields in (
+        (_PYTHON_FRAME, lambda m: (m.group(1), m.group(2), m.group(3))),
+        (_JVM_FRAME, lambda m: (m.group(2), m.group(3), m.group(1))),
+        (_JS_FRAME, lambda m: (m.group(2), m.group(3), m.group(1))),
+        (_PATH_LINE, lambda m: (m.group(1), m.group(2), m.group(3))),
+    ):
+        for match in pattern.finditer(text):
+            # A later, looser pattern must not re-read a frame an earlier one matched.
+            if any(start <= match.start() < end for start, end in spans):
+                continue
+            spans.append(match.span())
+            path, line, function = fields(match)
+            found.append((match.start(), StackFrame(path, int(line) if line else None, function)))
+
+    frames = list(dict.fromkeys(frame for _, frame in sorted(found)))
+    return frames[:MAX_FRAMES]
+
+
+def complete_ranges(definitions: Sequence[Definition], total_lines: int) -> List[Tuple[int, int, str]]:
+    """Gives definitions without a known end line one that runs up to the next definition."""
+    completed = []
+    for i, (start, end, name) in enumerate(definitions):
+        if end is None:
+            following = next((s for s, _, _ in definitions[i + 1:] if s > start), total_lines + 1)
+            end = max(start, following - 1)
+        completed.append((start, end, name))
+    return completed
+
+
+def _short_name(qualname: str) -> str:
+    return _SYMBOL_PARTS.split(qualname)[-1]
+
+
+def _paths_match(indexed: str, referenced: str) -> bool:
+    """Either path may be the longer one: traces carry deploy prefixes, JVM traces carry bare file names."""
+    referenced = referenced.replace("\\", "/")
+    return indexed == referenced or referenced.endswith("/" + indexed) or indexed.endswith("/" + referenced)
+
+
+class SymbolIndex:
+    """SQLite table of every definition seen during code ingestion, keyed for exact name and file lookups."""
+
+    def __init__(self, path: str = SYMBOL_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS files (repo TEXT NOT NULL, path TEXT NOT NULL, basename TEXT NOT NULL, language TEXT, PRIMARY KEY (repo, path));
+                CREATE INDEX IF NOT EXISTS files_basename ON files (basename);
+                CREATE TABLE IF NOT EXISTS symbols (repo TEXT NOT NULL, path TEXT NOT NULL, name TEXT NOT NULL, qualname TEXT NOT NULL, line_start INTEGER NOT NULL, line_end INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS symbols_file ON symbols (repo, path, line_start);
+                CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name);
+            """)
+            self._conn.commit()
+
+    def _delete_locked(self, repo: str, paths: Sequence[str]) -> None:
+        rows = [(repo, path) for path in paths]
+        self._conn.executemany("DELETE FROM symbols WHERE repo = ? AND path = ?", rows)
+        self._conn.executemany("DELETE FROM files WHERE repo = ? AND path = ?", rows)
+
+    def replace_files(self, repo: str, files: Iterable[Tuple[str, str, Sequence[Tuple[int, int, str]]]]) -> None:
+        """Replaces the symbols of each (path, language, [(line_start, line_end, qualname)]) file."""
+        files = list(files)
+        with self._lock:
+            self._delete_locked(repo, [path for path, _, _ in files])
+            self._conn.executemany(
+                "INSERT INTO files (repo, path, basename, language) VALUES (?, ?, ?, ?)",
+                [(repo, path, path.rsplit("/", 1)[-1], language) for path, language, _ in files]
+            )
+            self._conn.executemany(
+                "INSERT INTO symbols (repo, path, name, qualname, line_start, line_end) VALUES (?, ?, ?, ?, ?, ?)",
+                [(repo, path, _short_name(qualname), qualname, start, end) for path, _, definitions in files for start, end, qualname in definitions]
+            )
+            self._conn.commit()
+
+    def delete_files(self, repo: str, paths: Sequence[str]) -> None:
+        with self._lock:
+            self._delete_locked(repo, paths)
+            self._conn.commit()
+
+    def file_count(self, repo: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files WHERE repo = ?", (repo,)).fetchone()[0]
+
+    def find_location(self, path: str, line: Optional[int] = None) -> List[SymbolHit]:
+        """Files matching a referenced path, narrowed to the innermost symbol containing `line` when given."""
+        basename = path.replace("\\", "/").rsplit("/", 1)[-1]
+        with self._lock:
+            files = self._conn.execute("SELECT repo, path, language FROM files WHERE basename = ?", (basename,)).fetchall()
+            hits = []
+            for repo, indexed_path, language in files:
+                if not _paths_match(indexed_path, path):
+                    continue
+                symbol = None
+                if line is not None:
+                    symbol = self._conn.execute(
+                        "SELECT qualname, line_start, line_end FROM symbols WHERE repo = ? AND path = ? AND line_start <= ? AND line_end >= ? "
+                        "ORDER BY line_start DESC LIMIT 1",
+                        (repo, indexed_path, line, line)
+                    ).fetchone()
+                qualname, start, end = symbol or ("", line or 1, line or 1)
+                hits.append(SymbolHit(repo, indexed_path, qualname, start, end, language))
+        return hits
+
+    def find_symbol(self, name: str, limit: int = 5) -> List[SymbolHit]:
+        """Definitions of `name`; a qualified name such as OrderService.create prefers definitions it ends with."""
+        short = _short_name(name)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.repo, s.path, s.qualname, s.line_start, s.line_end, f.language FROM symbols s "
+                "JOIN files f ON f.repo = s.repo AND f.path = s.path WHERE s.name = ? LIMIT 200",
+                (short,)
+            ).fetchall()
+        hits = [SymbolHit(*row) for row in rows]
+        if short != name:
+            qualified = [hit for hit in hits if name.endswith(hit.qualname) or hit.qualname.endswith(name)]
+            hits = qualified or hits
+        return hits[:limit]
+
+    def lookup_frames(self, frames: Sequence[StackFrame], limit: int = 5) -> List[Tuple[StackFrame, SymbolHit]]:
+        """Resolves frames to definitions, by path and line first and by function name when the file is unknown."""
+        resolved = []
+        seen = set()
+        for frame in frames:
+            hits = self.find_location(frame.path, frame.line) if frame.path else []
+            if not hits and frame.function:
+                hits = self.find_symbol(frame.function, limit=1)
+            for hit in hits[:1]:
+                if (hit.repo, hit.path, hit.line_start) not in seen:
+                    seen.add((hit.repo, hit.path, hit.line_start))
+                    resolved.append((frame, hit))
+            if len(resolved) >= limit:
+                break
+        return resolved
+
+
+_index: Optional[SymbolIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_symbol_index() -> SymbolIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SymbolIndex()
+        return _index
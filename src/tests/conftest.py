@@ -0,0 +1,40 @@
+import functools
+import importlib
+import os
+import sys
+
+import pytest
+
+# The service modules import each other as top-level modules from src/.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read at import time by gemini.py and slack.py; the tests never call those services.
+for name in ("GEMINI_API_KEY", "SECRET_TOKEN", "SLACK_TOKEN", "SIGN_IN_SECRET"):
+    os.environ.setdefault(name, "test")
+
+
+@pytest.fixture
+def fake_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def fake_sync_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def import_offline(monkeypatch):
+    """Imports a module that loads slack.py, whose App would otherwise call auth.test at import."""
+    slack_bolt = pytest.importorskip("slack_bolt")
+    monkeypatch.setattr(slack_bolt, "App", functools.partial(slack_bolt.App, token_verification_enabled=False))
+
+    def _import(name):
+        if not hasattr(sys.modules.get("slack"), "slack_app"):
+            # Drop a stand-in some other test left behind.
+            sys.modules.pop("slack", None)
+        return importlib.import_module(name)
+
+    return _import
@@ -0,0 +1,28 @@
+import models
+
+
+def make_alert(fingerprint, status="firing", labels=None, annotations=None, starts_at="2024-05-01T10:00:00Z"):
+    return models.PrometheusAlert(
+        status=status,
+        labels=labels if labels is not None else {"alertname": "HighCPU", "instance": "web-01:9100"},
+        annotations=annotations if annotations is not None else {"summary": "CPU above 90%"},
+        startsAt=starts_at,
+        endsAt="0001-01-01T00:00:00Z",
+        generatorURL=None,
+        fingerprint=fingerprint,
+    )
+
+
+def make_payload(alerts, group_key="{}:{alertname=\"HighCPU\"}", status="firing"):
+    return models.PrometheusWebhookPayload(
+        version="4",
+        groupKey=group_key,
+        truncatedAlerts=0,
+        status=status,
+        receiver="on-call",
+        groupLabels={"alertname": "HighCPU"},
+        commonLabels={"alertname": "HighCPU"},
+        commonAnnotations={},
+        externalURL="http://alertmanager:9093",
+        alerts=alerts,
+    )
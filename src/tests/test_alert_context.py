@@ -0,0 +1,41 @@
+from alert_context import AlertContextBuilder, estimate_tokens
+
+
+def _alert(alertname, severity="warning", status="firing", instance="web-01", summary="CPU above 90%", starts_at="2024-05-01T10:00:00Z"):
+    return {
+        "status": status,
+        "startsAt": starts_at,
+        "labels": {"alertname": alertname, "severity": severity, "instance": instance, "job": "node"},
+        "annotations": {"summary": summary},
+    }
+
+
+def test_groups_alerts_by_rule_and_summarizes_numbers():
+    builder = AlertContextBuilder()
+    builder.add([_alert("HighCPU", instance=f"web-{i}", summary=f"CPU above {90 + i}%") for i in range(3)])
+    text = builder.render()
+
+    assert "The following 3 related alerts" in text
+    assert "--- HighCPU (warning) x3: firing 3, started 2024-05-01T10:00:00Z ---" in text
+    assert "Labels: job=node" in text
+    assert "instance (3 values: web-0, web-1, web-2)" in text
+    assert "Summary: CPU above {90–92}% [3x]" in text
+
+
+def test_most_severe_firing_groups_come_first():
+    builder = AlertContextBuilder()
+    builder.add([_alert("DiskFull", severity="info"), _alert("Down", severity="critical", status="resolved"), _alert("Latency", severity="critical")])
+    text = builder.render()
+
+    assert text.index("Latency") < text.index("Down") < text.index("DiskFull")
+
+
+def test_render_stays_within_budget_and_reports_omissions():
+    builder = AlertContextBuilder()
+    for rule in range(50):
+        builder.add([_alert(f"Rule{rule}", instance=f"web-{i}", summary=f"Rule {rule} fired on host {i}") for i in range(20)])
+    text = builder.render(token_budget=500)
+
+    assert estimate_tokens(text) <= 500
+    assert "more alert groups" in text
+    assert "omitted to fit the prompt" in text
@@ -0,0 +1,118 @@
+import asyncio
+
+import alert_store
+from factories import make_alert
+
+
+def _alerts():
+    return [
+        make_alert("a", labels={"alertname": "HighCPU", "job": "node", "instance": "web-01:9100"},
+                   annotations={"summary": "CPU above 90%", "runbook": "cpu.md"}, starts_at="2024-05-01T10:00:02Z"),
+        make_alert("b", labels={"alertname": "HighCPU", "job": "node", "instance": "web-02:9100"},
+                   annotations={"summary": "CPU above 95%", "runbook": "cpu.md"}, starts_at="2024-05-01T10:00:01Z"),
+        make_alert("c", status="resolved", labels={"alertname": "DiskFull", "job": "node"}, annotations={}),
+    ]
+
+
+def test_encode_alerts_interns_what_a_rule_shares():
+    encoded, interned = alert_store.encode_alerts(_alerts() + [make_alert("a")])
+
+    assert set(encoded) == {"a", "b", "c"}
+    assert encoded["a"]["ls"] == encoded["b"]["ls"]
+    assert '"instance"' not in interned[encoded["a"]["ls"]]
+    assert encoded["a"]["lx"] == '{"instance":"web-01:9100"}'
+    assert "ax" in encoded["a"] and "ax" not in encoded["c"]
+
+
+def test_stored_alerts_read_back_unchanged(fake_redis, monkeypatch):
+    monkeypatch.setattr(alert_store, "_interned_cache", alert_store._InternedCache(alert_store.INTERNED_CACHE_MAX_ENTRIES))
+    alerts = _alerts()
+
+    async def scenario():
+        assert await alert_store.store_alerts(fake_redis, "incident-1", alerts) == 3
+        return await alert_store.read_alerts(fake_redis, ["a", "b", "c", "missing"])
+
+    read = asyncio.run(scenario())
+    assert [alert["fingerprint"] for alert in read] == ["a", "b", "c"]
+    for original, alert in zip(alerts, read):
+        assert alert["labels"] == original.labels
+        assert alert["annotations"] == original.annotations
+        assert alert["status"] == original.status
+        assert alert["startsAt"] == original.startsAt
+
+
+def test_alert_pages_follow_starts_at(fake_redis):
+    async def scenario():
+        await alert_store.store_alerts(fake_redis, "incident-1", _alerts())
+        return [page async for page in alert_store.iter_alert_pages(fake_redis, "incident-1", page_size=2, fields=("status",))]
+
+    pages = asyncio.run(scenario())
+    assert [[alert["fingerprint"] for alert in page] for page in pages] == [["c", "b"], ["a"]]
+    assert pages[0][0] == {"fingerprint": "c", "status": "resolved"}
+
+
+class RoundTripCounter:
+    """Wraps a client, counting each direct command and each pipeline execute as one round trip."""
+
+    def __init__(self, client):
+        self.client = client
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        pipe = self.client.pipeline(transaction=transaction)
+        execute = pipe.execute
+
+        async def counted_execute(*args, **kwargs):
+            self.round_trips += 1
+            return await execute(*args, **kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        async def counted(*args, **kwargs):
+            self.round_trips += 1
+            return await command(*args, **kwargs)
+
+        return counted
+
+
+def _many(count):
+    return [make_alert(f"fp-{i}", labels={"alertname": "HighCPU", "instance": f"web-{i}"},
+                       starts_at=f"2024-05-01T10:{i // 60:02d}:{i % 60:02d}Z") for i in range(count)]
+
+
+def test_storing_a_large_group_is_one_round_trip(fake_redis):
+    client = RoundTripCounter(fake_redis)
+
+    stored = asyncio.run(alert_store.store_alerts(client, "incident-1", _many(250)))
+
+    assert stored == 250
+    assert client.round_trips == 1
+
+
+def test_each_page_is_read_in_two_round_trips_and_interned_sets_once(fake_redis, monkeypatch):
+    monkeypatch.setattr(alert_store, "_interned_cache", alert_store._InternedCache(alert_store.INTERNED_CACHE_MAX_ENTRIES))
+    client = RoundTripCounter(fake_redis)
+
+    async def read_pages(fields):
+        return [page async for page in alert_store.iter_alert_pages(client, "incident-1", page_size=100, fields=fields)]
+
+    async def store_then_read():
+        await alert_store.store_alerts(fake_redis, "incident-1", _many(250))
+        status_pages = await read_pages(("status",))
+        status_trips = client.round_trips
+        await read_pages(("labels",))
+        label_trips = client.round_trips - status_trips
+        await read_pages(("labels",))
+        return status_pages, status_trips, label_trips, client.round_trips - status_trips - label_trips
+
+    status_pages, status_trips, label_trips, cached_label_trips = asyncio.run(store_then_read())
+
+    assert [len(page) for page in status_pages] == [100, 100, 50]
+    # ZRANGE plus one HMGET pipeline per page; labels add a single MGET for the shared label set.
+    assert status_trips == 6
+    assert label_trips == 7
+    assert cached_label_trips == 6
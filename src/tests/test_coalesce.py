@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+import coalesce
+from factories import make_alert, make_payload
+
+
+@pytest.fixture
+def redis(fake_redis, monkeypatch):
+    monkeypatch.setattr(coalesce, "redis_client", fake_redis)
+    return fake_redis
+
+
+def test_coalesce_key_ignores_order_and_resolved_alerts():
+    a = make_payload([make_alert("a"), make_alert("b"), make_alert("c", status="resolved")])
+    b = make_payload([make_alert("b"), make_alert("a")])
+    assert coalesce.coalesce_key(a) == coalesce.coalesce_key(b)
+
+
+def test_coalesce_key_depends_on_group_and_fingerprints():
+    base = make_payload([make_alert("a")])
+    assert coalesce.coalesce_key(base) != coalesce.coalesce_key(make_payload([make_alert("a"), make_alert("b")]))
+    assert coalesce.coalesce_key(base) != coalesce.coalesce_key(make_payload([make_alert("a")], group_key="other"))
+
+
+def test_merge_payloads_keeps_latest_alert_per_fingerprint():
+    first = make_payload([make_alert("a"), make_alert("b")])
+    second = make_payload([make_alert("a", status="resolved")], status="resolved")
+    merged = coalesce.merge_payloads([first, second])
+
+    assert {alert.fingerprint: alert.status for alert in merged.alerts} == {"a": "resolved", "b": "firing"}
+    assert merged.status == "firing"
+    assert coalesce.merge_payloads([]) is None
+
+
+def test_first_payload_opens_a_new_incident(redis):
+    decision = asyncio.run(coalesce.coalesce_payload(make_payload([make_alert("a")]), owner="job-1"))
+    assert decision.action == coalesce.CoalesceDecision.NEW
+
+
+def test_retry_after_failed_ingest_is_not_a_duplicate(redis):
+    payload = make_payload([make_alert("a")])
+
+    async def scenario():
+        first = await coalesce.coalesce_payload(payload, owner="job-1")
+        # The ingest stage failed before posting the thread or scheduling the flush.
+        retry = await coalesce.coalesce_payload(payload, owner="job-1")
+        return first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert first.action == coalesce.CoalesceDecision.NEW
+    assert retry.action == coalesce.CoalesceDecision.NEW
+    assert retry.incident_id == first.incident_id
+
+
+def test_retry_after_window_expired_still_opens_the_thread(redis):
+    payload = make_payload([make_alert("a")])
+
+    async def scenario():
+        first = await coalesce.coalesce_payload(payload, owner="job-1")
+        await redis.delete(f"coalesce:window:{first.incident_id}")
+        return await coalesce.coalesce_payload(payload, owner="job-1")
+
+    assert asyncio.run(scenario()).action == coalesce.CoalesceDecision.NEW
+
+
+def test_update_window_retry_after_expiry_is_not_a_duplicate(redis):
+    async def scenario():
+        first = await coalesce.coalesce_payload(make_payload([make_alert("a")]), owner="job-1")
+        await coalesce.set_incident_thread(first.incident_id, "1700000000.000100", "C123")
+        await coalesce.mark_flush_scheduled(first.incident_id)
+        await redis.delete(f"coalesce:window:{first.incident_id}")
+        await coalesce.drain_pending(first.incident_id)
+
+        update = make_payload([make_alert("a"), make_alert("b")])
+        opened = await coalesce.coalesce_payload(update, owner="job-2")
+        # job-2 failed before scheduling its flush, and its backoff outlasted the window.
+        await redis.delete(f"coalesce:window:{first.incident_id}")
+        retry = await coalesce.coalesce_payload(update, owner="job-2")
+        return opened, retry, await coalesce.drain_pending(first.incident_id)
+
+    opened, retry, pending = asyncio.run(scenario())
+    assert opened.action == coalesce.CoalesceDecision.UPDATE
+    assert retry.action == coalesce.CoalesceDecision.UPDATE
+    assert sorted(alert.fingerprint for alert in pending.alerts) == ["a", "b"]
+
+
+def test_other_payloads_buffer_while_the_window_is_open(redis):
+    async def scenario():
+        await coalesce.coalesce_payload(make_payload([make_alert("a")]), owner="job-1")
+        return await coalesce.coalesce_payload(make_payload([make_alert("a"), make_alert("b")]), owner="job-2")
+
+    assert asyncio.run(scenario()).action == coalesce.CoalesceDecision.BUFFERED
+
+
+def test_resend_is_duplicate_once_thread_and_flush_exist(redis):
+    payload = make_payload([make_alert("a")])
+
+    async def scenario():
+        first = await coalesce.coalesce_payload(payload, owner="job-1")
+        await coalesce.set_incident_thread(first.incident_id, "1700000000.000100", "C123")
+        await coalesce.mark_flush_scheduled(first.incident_id)
+        return await coalesce.coalesce_payload(payload, owner="job-2")
+
+    decision = asyncio.run(scenario())
+    assert decision.action == coalesce.CoalesceDecision.DUPLICATE
+    assert decision.thread_ts == "1700000000.000100"
+
+
+def test_drain_pending_merges_and_empties_the_buffer(redis):
+    async def scenario():
+        first = await coalesce.coalesce_payload(make_payload([make_alert("a")]), owner="job-1")
+        await coalesce.coalesce_payload(make_payload([make_alert("b")]), owner="job-2")
+        merged = await coalesce.drain_pending(first.incident_id)
+        return merged, await coalesce.drain_pending(first.incident_id)
+
+    merged, empty = asyncio.run(scenario())
+    assert sorted(alert.fingerprint for alert in merged.alerts) == ["a", "b"]
+    assert empty is None
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import time
+
+import concurrency
+
+
+def test_chroma_calls_never_exceed_the_limiter(monkeypatch):
+    monkeypatch.setattr(concurrency, "chroma_limiter", asyncio.Semaphore(2))
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def blocking_query():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return "ok"
+
+    async def burst():
+        return await asyncio.gather(*(concurrency.run_in_chroma(blocking_query) for _ in range(6)))
+
+    assert asyncio.run(burst()) == ["ok"] * 6
+    assert peak[0] == 2
+
+
+def test_related_searches_run_side_by_side(import_offline, monkeypatch):
+    prome = import_offline("prome")
+
+    def search(name):
+        def _search(**kwargs):
+            time.sleep(0.2)
+            return f"{name} for {next(iter(kwargs.values()))}"
+        return _search
+
+    monkeypatch.setattr(prome, "lookup_source_locations", lambda text: "")
+    monkeypatch.setattr(prome, "search_documentation", search("docs"))
+    monkeypatch.setattr(prome, "search_slack_history", search("slack"))
+    monkeypatch.setattr(prome, "search_codebase", search("code"))
+
+    started = time.monotonic()
+    related = asyncio.run(prome.find_related_information("disk full"))
+
+    assert time.monotonic() - started < 0.4
+    assert related == {
+        "documentation": "docs for disk full",
+        "slack_history": "slack for disk full",
+        "source_code": "code for disk full",
+    }
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import coalesce
+import correlation
+from factories import make_alert, make_payload
+
+
+def _payload(labels, group_key, status="firing"):
+    return make_payload([make_alert(group_key, status=status, labels={"alertname": group_key, **labels})], group_key=group_key, status=status)
+
+
+@pytest.fixture
+def redis(fake_redis, monkeypatch):
+    monkeypatch.setattr(coalesce, "redis_client", fake_redis)
+    return fake_redis
+
+
+def test_parse_weights():
+    assert correlation._parse_weights("service:2, instance:2,job") == {"service": 2.0, "instance": 2.0, "job": 1.0}
+
+
+def test_correlation_keys_only_use_firing_alerts():
+    payload = make_payload([
+        make_alert("a", labels={"service": "api", "job": "node"}),
+        make_alert("b", status="resolved", labels={"instance": "web-01"}),
+    ])
+    assert correlation.correlation_keys(payload) == {"correlate:label:service=api": 2.0, "correlate:label:job=node": 1.0}
+
+
+def test_scoring_needs_a_strong_label_and_prefers_recent(fake_redis):
+    async def scenario():
+        await correlation.index_incident(fake_redis, "i1", _payload({"service": "api", "job": "node"}, "g1"), now=1000)
+        await correlation.index_incident(fake_redis, "i2", _payload({"instance": "h1", "job": "node"}, "g2"), now=1100)
+        find = correlation.find_correlated_incident
+        return (
+            await find(fake_redis, _payload({"service": "api"}, "g3"), now=1200),
+            await find(fake_redis, _payload({"job": "node"}, "g3"), now=1200),
+            await find(fake_redis, _payload({"instance": "h1", "service": "api", "job": "node"}, "g3"), now=1200),
+            await find(fake_redis, _payload({"service": "api"}, "g3"), now=1000 + correlation.CORRELATION_WINDOW_SECONDS + 1),
+        )
+
+    assert asyncio.run(scenario()) == ("i1", None, "i2", None)
+
+
+def test_correlated_group_joins_the_open_incident(redis):
+    async def scenario():
+        first = await coalesce.coalesce_payload(_payload({"service": "api"}, "g1"), owner="job-1")
+        second = await coalesce.coalesce_payload(_payload({"service": "api", "instance": "web-02"}, "g2"), owner="job-2")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert second.incident_id == first.incident_id
+    assert second.action == coalesce.CoalesceDecision.BUFFERED
+
+
+def test_incident_closes_only_when_the_last_group_resolves(redis):
+    async def scenario():
+        first = await coalesce.coalesce_payload(_payload({"service": "api"}, "g1"), owner="job-1")
+        await coalesce.coalesce_payload(_payload({"service": "api"}, "g2"), owner="job-2")
+
+        partial = await coalesce.close_incident(_payload({"service": "api"}, "g1", status="resolved"))
+        still_correlates = await correlation.find_correlated_incident(redis, _payload({"service": "api"}, "g3"))
+        final = await coalesce.close_incident(_payload({"service": "api"}, "g2", status="resolved"))
+        after_close = await correlation.find_correlated_incident(redis, _payload({"service": "api"}, "g3"))
+        return first.incident_id, partial, still_correlates, final, after_close
+
+    incident_id, partial, still_correlates, final, after_close = asyncio.run(scenario())
+    assert partial["incident_id"] == incident_id and partial["open_groups"] == 1
+    assert still_correlates == incident_id
+    assert final["open_groups"] == 0
+    assert after_close is None
@@ -0,0 +1,115 @@
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import documentation
+from utils import ArchiveBudget
+
+
+@pytest.fixture
+def chroma(fake_sync_redis, monkeypatch):
+    """Records what would be written to and deleted from the collection."""
+    stored, deleted = {}, []
+    monkeypatch.setattr(documentation, "redis_client", fake_sync_redis)
+    monkeypatch.setattr(documentation, "get_or_create_chroma_db",
+                        lambda documents_to_embed, collection_name, metadata, db_ids: stored.update(zip(db_ids, metadata)))
+    monkeypatch.setattr(documentation, "delete_from_chroma", lambda collection_name, ids: deleted.extend(ids))
+    return stored, deleted
+
+
+def test_document_key_qualifies_the_path_with_its_source():
+    assert documentation.document_key("db/README.md", "runbooks.zip") == "runbooks.zip/db/README.md"
+    assert documentation.document_key("README.md") == "README.md"
+    assert documentation.document_key("../README.md", "team") is None
+
+
+def test_same_basename_from_two_sources_keeps_both_documents(chroma):
+    stored, deleted = chroma
+    first = documentation.document_key("README.md", "payments.zip")
+    second = documentation.document_key("README.md", "search.zip")
+
+    documentation.index_file(first, b"# Payments\n\nRestart the ledger.", "markdown")
+    documentation.index_file(second, b"# Search\n\nReindex the shards.", "markdown")
+
+    assert deleted == []
+    assert {meta["source"] for meta in stored.values()} == {first, second}
+    assert documentation.load_manifest(first)[1] != documentation.load_manifest(second)[1]
+
+
+def test_reupload_replaces_only_its_own_stale_chunks(chroma):
+    stored, deleted = chroma
+    documentation.index_file("a.zip/README.md", b"# A\n\nold text", "markdown")
+    documentation.index_file("b.zip/README.md", b"# B\n\nother text", "markdown")
+    old_ids = set(documentation.load_manifest("a.zip/README.md")[1])
+
+    result = documentation.index_file("a.zip/README.md", b"# A\n\nnew text", "markdown")
+
+    assert set(deleted) == old_ids
+    assert result == {"chunks": 1, "embedded": 1, "deleted": 1}
+    assert documentation.load_manifest("b.zip/README.md")[0] is not None
+
+
+def _start_job(job_dir, uploads):
+    """What /upload_docs does before handing the job to the background task."""
+    job_id = "job-1"
+    documentation.redis_client.hset(documentation._job_key(job_id), mapping={"status": "queued", "total": 0, "done": 0, "failed": 0})
+    documentation.run_upload_job(job_id, str(job_dir), uploads)
+    documentation._ingest_pool.shutdown(wait=True)
+    return documentation.get_job_status(job_id)
+
+
+@pytest.fixture
+def ingest_pool(monkeypatch):
+    monkeypatch.setattr(documentation, "_ingest_pool", ThreadPoolExecutor(max_workers=2))
+
+
+def test_batch_job_counts_done_and_failed_files(chroma, ingest_pool, tmp_path):
+    archive = tmp_path / "upload-0-runbooks.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("db/README.md", "# DB\n\nFailover steps.")
+        zf.writestr("web/README.md", "# Web\n\nRestart nginx.")
+        zf.writestr("notes.txt", "ignored")
+    broken = tmp_path / "upload-1-broken.zip"
+    broken.write_bytes(b"not a zip")
+    single = tmp_path / "upload-2-oncall.md"
+    single.write_bytes(b"# On-call\n\nPage the SRE.")
+
+    job = _start_job(tmp_path, [("runbooks.zip", str(archive), None), ("broken.zip", str(broken), None), ("oncall.md", str(single), "markdown")])
+
+    assert job["status"] == "completed_with_errors"
+    assert (job["total"], job["done"], job["failed"]) == ("4", "3", "1")
+    assert set(job["files"]) == {"runbooks.zip/db/README.md", "runbooks.zip/web/README.md", "broken.zip", "oncall.md"}
+    assert job["files"]["broken.zip"]["status"] == "failed"
+    assert int(job["chunks"]) == 3
+
+
+def test_batch_job_over_the_archive_budget_fails_without_indexing(chroma, ingest_pool, tmp_path, monkeypatch):
+    stored, _ = chroma
+    monkeypatch.setattr(documentation, "ArchiveBudget", lambda: ArchiveBudget(max_bytes=1024))
+    archive = tmp_path / "upload-0-bomb.zip"
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("big.md", "# Big\n\n" + "0" * 4096)
+
+    job = _start_job(tmp_path, [("bomb.zip", str(archive), None)])
+
+    assert job["status"] == "failed"
+    assert "bytes" in job["error"]
+    assert stored == {}
+    assert not tmp_path.exists()
+
+
+def test_pdf_pages_are_extracted_once_on_the_process_pool(monkeypatch):
+    pypdf = pytest.importorskip("pypdf")
+    writer = pypdf.PdfWriter()
+    for _ in range(10):
+        writer.add_blank_page(width=200, height=200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    monkeypatch.setattr(documentation, "PDF_WORKERS", 2)
+    monkeypatch.setattr(documentation, "PDF_PARALLEL_MIN_PAGES", 1)
+
+    pages = list(documentation.iter_pdf_pages(buffer.getvalue(), start_page=2, skip_pages=[5]))
+
+    assert sorted(page for page, _ in pages) == [2, 3, 4, 6, 7, 8, 9, 10]
@@ -0,0 +1,32 @@
+import time
+
+from embedding_cache import SqliteEmbeddingStore
+
+
+def test_store_opens_its_file_on_first_use(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    store = SqliteEmbeddingStore(str(path))
+    assert not path.exists()
+
+    store.set_many({"k": [0.5, 1.0]})
+
+    assert path.exists()
+    assert store.get_many(["k", "other"]) == {"k": [0.5, 1.0]}
+
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    store = SqliteEmbeddingStore(str(tmp_path / "cache.sqlite"), ttl=60)
+    store.set_many({"old": [1.0]})
+
+    later = time.time() + 120
+    monkeypatch.setattr(time, "time", lambda: later)
+
+    assert store.get_many(["old"]) == {}
+
+
+def test_oldest_entries_are_evicted_above_the_bound(tmp_path):
+    store = SqliteEmbeddingStore(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for key in ("a", "b", "c"):
+        store.set_many({key: [1.0]})
+
+    assert set(store.get_many(["a", "b", "c"])) == {"b", "c"}
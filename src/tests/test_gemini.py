@@ -0,0 +1,44 @@
+import asyncio
+from types import SimpleNamespace
+
+import gemini
+from embedding_cache import SqliteEmbeddingStore
+
+
+class FakeModels:
+    """Stands in for the client's models API and records every embed_content call."""
+
+    def __init__(self):
+        self.calls = []
+
+    def _response(self, contents, config):
+        self.calls.append((list(contents), config.task_type))
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=[float(len(text))]) for text in contents])
+
+    def embed_content(self, model, contents, config):
+        return self._response(contents, config)
+
+    async def embed_content_async(self, model, contents, config):
+        return self._response(contents, config)
+
+
+def test_embedding_function_sends_the_task_type_enum_name_once_without_retries(tmp_path, monkeypatch):
+    models = FakeModels()
+    monkeypatch.setattr(gemini.gemini.models, "embed_content", models.embed_content)
+    monkeypatch.setattr(gemini, "EMBED_MAX_RETRIES", 0)
+    embed = gemini.GeminiEmbeddingFunction("retrieval_document", store=SqliteEmbeddingStore(str(tmp_path / "cache.sqlite")))
+
+    assert embed(["abc", "de", "abc"]) == [[3.0], [2.0], [3.0]]
+    assert models.calls == [(["abc", "de"], "RETRIEVAL_DOCUMENT")]
+
+
+def test_async_embeddings_share_the_cache(tmp_path, monkeypatch):
+    models = FakeModels()
+    monkeypatch.setattr(gemini.async_gemini.models, "embed_content", models.embed_content_async)
+    store = SqliteEmbeddingStore(str(tmp_path / "cache.sqlite"))
+
+    first = asyncio.run(gemini.embed_texts_async(["summary"], task_type="semantic_similarity", store=store))
+    again = asyncio.run(gemini.embed_texts_async(["summary", "new"], task_type="semantic_similarity", store=store))
+
+    assert first == [[7.0]] and again == [[7.0], [3.0]]
+    assert models.calls == [(["summary"], "SEMANTIC_SIMILARITY"), (["new"], "SEMANTIC_SIMILARITY")]
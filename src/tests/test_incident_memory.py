@@ -0,0 +1,49 @@
+import asyncio
+from uuid import uuid4
+
+import chromadb
+import pytest
+
+import incident_memory
+from factories import make_alert, make_payload
+
+SUMMARY = "web-01 is out of CPU because the nightly report runs on it"
+EMBEDDING = [1.0, 0.0, 0.0]
+
+
+@pytest.fixture
+def memory(fake_redis, monkeypatch):
+    collection = chromadb.EphemeralClient().get_or_create_collection(f"incidents-{uuid4().hex}", metadata={"hnsw:space": "cosine"})
+    monkeypatch.setattr(incident_memory, "_collection", lambda: collection)
+    monkeypatch.setattr(incident_memory, "redis_client", fake_redis)
+    return collection
+
+
+def _remember(incident_id):
+    return incident_memory.remember_incident(incident_id, SUMMARY, make_payload([make_alert("a1")]), EMBEDDING)
+
+
+def test_resolution_recorded_before_the_incident_is_merged_when_it_is_stored(memory):
+    async def resolve_first():
+        recorded = await incident_memory.record_resolution("i1", "Moved the report to the batch host.")
+        await _remember("i1")
+        return recorded, await incident_memory.find_similar_incident(EMBEDDING)
+
+    recorded, past = asyncio.run(resolve_first())
+
+    assert recorded
+    assert past["incident_id"] == "i1"
+    assert past["resolution"] == "Moved the report to the batch host."
+
+
+def test_remembering_again_keeps_a_recorded_resolution(memory):
+    async def retried_investigation():
+        await _remember("i1")
+        await incident_memory.record_resolution("i1", "Restarted the exporter.")
+        await _remember("i1")
+
+    asyncio.run(retried_investigation())
+
+    [metadata] = memory.get(ids=["i1"])["metadatas"]
+    assert metadata["resolved"] is True
+    assert metadata["resolution"] == "Restarted the exporter."
@@ -0,0 +1,56 @@
+from markdown_sections import parse_sections
+
+DOC = """# Runbook
+
+Intro with **bold** and a [link](http://example.com).
+
+## High CPU
+
+Check `node_cpu_seconds_total` first.
+
+```
+# not a heading
+top -b
+```
+
+#### Deep detail
+
+Still part of High CPU.
+
+Disk
+----
+
+- Clean up /var/log
+"""
+
+
+def test_sections_nest_and_keep_document_order():
+    sections = parse_sections(DOC)
+
+    assert [(s["header_level"], s["header_text"]) for s in sections] == [(1, "Runbook"), (2, "High CPU"), (2, "Disk")]
+    assert [s["heading_path"] for s in sections] == [["Runbook"], ["Runbook", "High CPU"], ["Runbook", "Disk"]]
+
+
+def test_section_content_is_plain_text_and_includes_children():
+    runbook, cpu, disk = parse_sections(DOC)
+
+    assert runbook["content"].startswith("Intro with bold and a link.\nHigh CPU\n")
+    assert runbook["content"].endswith("Disk\nClean up /var/log")
+    assert cpu["content"] == "Check node_cpu_seconds_total first.\n# not a heading\ntop -b\nDeep detail\nStill part of High CPU."
+    assert disk["content"] == "Clean up /var/log"
+
+
+def test_no_headings_means_no_sections():
+    assert parse_sections("just text\n\nmore text") == []
+
+
+def test_indented_code_html_blocks_and_lazy_lines_are_content():
+    sections = parse_sections(
+        "# Runbook\n\n"
+        "    # indented code, not a heading\n    x = 1\n\n"
+        "<div>\n<p>html block</p>\n</div>\n\n"
+        "- item one\nlazy continuation\n- item two\n"
+    )
+
+    assert len(sections) == 1
+    assert sections[0]["content"] == "# indented code, not a heading\nx = 1\nhtml block\nitem one lazy continuation item two"
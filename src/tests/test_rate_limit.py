@@ -0,0 +1,60 @@
+import pytest
+
+import rate_limit
+from rate_limit import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_up_to_capacity_then_wait_for_refill(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+
+    assert [bucket._reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket._reserve() == pytest.approx(0.5)
+
+
+def test_refill_is_capped_at_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket._reserve()
+
+    clock.now += 1
+    assert [bucket._reserve() for _ in range(2)] == [0, 0]
+    assert bucket._reserve() == pytest.approx(0.5)
+
+    clock.now += 60
+    assert [bucket._reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket._reserve() > 0
+
+
+def test_pause_holds_back_callers_with_tokens_left(clock):
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.pause(30)
+
+    assert bucket._reserve() == pytest.approx(30)
+    clock.now += 30
+    assert bucket._reserve() == 0
+
+
+def test_bucket_is_shared_per_method_and_sized_from_its_tier(monkeypatch):
+    monkeypatch.setattr(rate_limit, "_buckets", {})
+    monkeypatch.setattr(rate_limit, "SLACK_RATE_HEADROOM", 1.0)
+
+    history = rate_limit.slack_bucket("conversations.history")
+
+    assert rate_limit.slack_bucket("conversations.history") is history
+    assert history.rate == pytest.approx(50 / 60)
+    assert rate_limit.slack_bucket("users.info").rate == pytest.approx(100 / 60)
@@ -0,0 +1,124 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import retrieval
+from lexical_index import BM25Index, tokenize
+from retrieval import reciprocal_rank_fusion
+
+
+class FakeCollection:
+    """Vector side of hybrid_query: returns a fixed ranking and counts queries."""
+
+    def __init__(self, ids, metadatas):
+        self.ids = ids
+        self.metadatas = metadatas
+        self.queries = 0
+
+    def query(self, query_embeddings, n_results):
+        self.queries += 1
+        return {"ids": [self.ids[:n_results]], "metadatas": [self.metadatas[:n_results]]}
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = BM25Index("runbooks", str(tmp_path))
+    monkeypatch.setattr(retrieval, "get_index", lambda collection_name: index)
+    monkeypatch.setattr(retrieval, "collection_generation", lambda collection_name: 0)
+    monkeypatch.setattr(retrieval, "_results", retrieval.TTLCache(60, 16))
+    return index
+
+
+def test_rrf_ranks_agreement_above_a_single_first_place():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]])
+    assert fused == ["a", "c", "b", "d"]
+
+
+def test_rrf_keeps_a_single_ranking_in_order():
+    assert reciprocal_rank_fusion([["x", "y", "z"]]) == ["x", "y", "z"]
+
+
+def test_identifiers_are_indexed_whole_and_by_part():
+    assert tokenize("ERR_CONN_RESET on api-gateway:9100") == ["err_conn_reset", "on", "api-gateway:9100", "api", "gateway", "9100"]
+
+
+def test_bm25_ranks_the_exact_identifier_first(index):
+    index.upsert(
+        ["cpu", "mem", "disk"],
+        ["node_cpu_seconds_total is high on web-01", "memory pressure on web-01", "disk full on db-01"],
+        [{"title": "cpu"}, {"title": "mem"}, {"title": "disk"}],
+    )
+
+    ranked, confidence = index.search("node_cpu_seconds_total", 3)
+
+    assert [doc_id for doc_id, _ in ranked] == ["cpu"]
+    assert confidence == pytest.approx(1.0, abs=0.2)
+
+
+def test_confident_lexical_hits_skip_the_embedding(index, monkeypatch):
+    index.upsert(["cpu"], ["node_cpu_seconds_total"], [{"title": "cpu"}])
+    monkeypatch.setattr(retrieval, "LEXICAL_CONFIDENCE", 0.5)
+    monkeypatch.setattr(retrieval, "embed_query", lambda text: pytest.fail("embedded a confident lexical query"))
+
+    assert retrieval.hybrid_query("runbooks", "node_cpu_seconds_total", n_results=1) == [{"title": "cpu"}]
+
+
+def test_hybrid_results_fuse_both_rankings(index, monkeypatch):
+    index.upsert(["restart", "rotate"], ["restart the exporter", "rotate the logs on the exporter host"], [{"title": "restart"}, {"title": "rotate"}])
+    collection = FakeCollection(["rotate", "vector-only"], [{"title": "rotate"}, {"title": "vector-only"}])
+    monkeypatch.setattr(retrieval, "get_collection", lambda collection_name: collection)
+    monkeypatch.setattr(retrieval, "embed_query", lambda text: [0.1, 0.2])
+
+    results = retrieval.hybrid_query("runbooks", "exporter stopped", n_results=3)
+
+    assert [result["title"] for result in results] == ["rotate", "restart", "vector-only"]
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(retrieval.time, "monotonic", lambda: now[0])
+    cache = retrieval.TTLCache(ttl=10, maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    now[0] += 11
+    assert cache.get("a") is None
+
+
+def test_concurrent_queries_for_one_text_embed_it_once(monkeypatch):
+    calls = []
+
+    def slow_embedder(texts):
+        calls.append(texts)
+        time.sleep(0.05)
+        return [[1.0, 0.0]]
+
+    monkeypatch.setattr(retrieval, "_query_embedder", slow_embedder)
+    monkeypatch.setattr(retrieval, "_query_vectors", retrieval.TTLCache(60, 16))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        vectors = list(pool.map(retrieval.embed_query, ["disk full"] * 4))
+
+    assert vectors == [[1.0, 0.0]] * 4
+    assert calls == [["disk full"]]
+
+
+def test_cached_results_last_until_the_collection_changes(index, monkeypatch):
+    index.upsert(["restart"], ["restart the exporter"], [{"title": "restart"}])
+    collection = FakeCollection(["restart"], [{"title": "restart"}])
+    generation = [0]
+    monkeypatch.setattr(retrieval, "get_collection", lambda collection_name: collection)
+    monkeypatch.setattr(retrieval, "embed_query", lambda text: [0.1, 0.2])
+    monkeypatch.setattr(retrieval, "collection_generation", lambda collection_name: generation[0])
+
+    for _ in range(3):
+        retrieval.hybrid_query("runbooks", "exporter stopped", n_results=1)
+    assert collection.queries == 1
+
+    generation[0] += 1
+    retrieval.hybrid_query("runbooks", "exporter stopped", n_results=1)
+    assert collection.queries == 2
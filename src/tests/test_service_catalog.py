@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import yaml
+
+import service_catalog
+from service_catalog import ServiceCatalog
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "services.yaml"
+    path.write_text(yaml.dump({"services": {"api": {"runbooks": [{"name": "Restart", "url": "http://wiki/restart"}], "dashboards": []}}}))
+    return str(path)
+
+
+def test_update_is_written_and_read_back_by_a_fresh_catalog(path):
+    catalog = ServiceCatalog(path)
+
+    assert catalog.update_service("db", dashboards=[{"name": "Postgres", "url": "http://grafana/pg"}])
+
+    assert catalog.get("db")["dashboards"] == [{"name": "Postgres", "url": "http://grafana/pg"}]
+    reloaded = ServiceCatalog(path)
+    assert reloaded.services().keys() == {"api", "db"}
+    assert reloaded.get("db") == {"runbooks": [], "dashboards": [{"name": "Postgres", "url": "http://grafana/pg"}]}
+
+
+def test_known_links_are_not_added_twice(path):
+    catalog = ServiceCatalog(path)
+
+    assert not catalog.update_service("api", runbooks=[{"name": "Restart", "url": "http://wiki/restart"}])
+    assert catalog.get("api")["runbooks"] == [{"name": "Restart", "url": "http://wiki/restart"}]
+
+
+def test_edits_from_elsewhere_are_picked_up_and_a_broken_file_is_ignored(path, monkeypatch):
+    monkeypatch.setattr(service_catalog, "SERVICE_CATALOG_CHECK_SECONDS", 0)
+    catalog = ServiceCatalog(path)
+
+    ServiceCatalog(path).update_service("cache", runbooks=[{"name": "Flush", "url": "http://wiki/flush"}])
+    assert catalog.get("cache") is not None
+
+    with open(path, "w") as f:
+        f.write("services: [unclosed\n")
+    assert catalog.get("cache") is not None
+
+
+def test_concurrent_writers_keep_every_link(path):
+    def add(i):
+        ServiceCatalog(path).update_service("api", runbooks=[{"name": f"Step {i}", "url": f"http://wiki/{i}"}])
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(add, range(16)))
+
+    names = {link["name"] for link in ServiceCatalog(path).get("api")["runbooks"]}
+    assert names == {"Restart"} | {f"Step {i}" for i in range(16)}
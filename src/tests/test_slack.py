@@ -0,0 +1,160 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.slack_response import SlackResponse
+
+
+class FakeSlackApi:
+    """Serves conversations.history in pages (newest first, like Slack) and conversations.replies per thread."""
+
+    def __init__(self, messages, threads=None, page_size=2, fail_on_page=None):
+        self.messages = messages
+        self.threads = threads or {}
+        self.page_size = page_size
+        self.fail_on_page = fail_on_page
+        self.history_calls = []
+
+    def __call__(self, method, **kwargs):
+        if method == "conversations.replies":
+            return SimpleNamespace(data={"messages": self.threads[kwargs["ts"]]})
+
+        self.history_calls.append(kwargs.get("oldest"))
+        oldest = float(kwargs.get("oldest") or 0)
+        visible = sorted((m for m in self.messages if float(m["ts"]) > oldest), key=lambda m: -float(m["ts"]))
+        page = int(kwargs.get("cursor") or 0)
+        if page == self.fail_on_page:
+            raise SlackApiError("boom", SlackResponse(client=None, http_verb="POST", api_url="", req_args={},
+                                                      data={"ok": False, "error": "internal_error"}, headers={}, status_code=500))
+        start = page * self.page_size
+        has_more = start + self.page_size < len(visible)
+        return SimpleNamespace(data={
+            "messages": visible[start:start + self.page_size],
+            "has_more": has_more,
+            "response_metadata": {"next_cursor": str(page + 1) if has_more else ""},
+        })
+
+
+@pytest.fixture
+def slack(import_offline, fake_sync_redis, monkeypatch):
+    module = import_offline("slack")
+    monkeypatch.setattr(module, "redis_client", fake_sync_redis)
+    return module
+
+
+@pytest.fixture
+def chroma(slack, monkeypatch):
+    """Documents written to and ids deleted from the collection."""
+    stored, deleted = {}, []
+    monkeypatch.setattr(slack, "get_or_create_chroma_db",
+                        lambda documents, collection_name, metadatas, ids: stored.update(zip(ids, documents)))
+    monkeypatch.setattr(slack, "delete_from_chroma", lambda collection_name, ids: deleted.extend(ids))
+    return stored, deleted
+
+
+def _message(ts, text, **extra):
+    return {"ts": ts, "user": "U1", "text": text, **extra}
+
+
+def test_second_sync_only_fetches_after_the_watermark(slack, chroma, monkeypatch):
+    stored, _ = chroma
+    api = FakeSlackApi([_message("100.0", "first"), _message("200.0", "second")])
+    monkeypatch.setattr(slack, "call_slack", api)
+    monkeypatch.setattr(slack, "SYNC_THREAD_LOOKBACK_SECONDS", 50)
+
+    slack.sync_slack_history_to_chroma("C1")
+    assert slack.redis_client.get("slack:sync:C1:oldest") == "200.0"
+
+    api.messages.append(_message("300.0", "third"))
+    stored.clear()
+    slack.sync_slack_history_to_chroma("C1")
+
+    assert api.history_calls == [None, "150.0"]
+    assert list(stored) == ["300.0"]
+    assert slack.redis_client.get("slack:sync:C1:oldest") == "300.0"
+
+
+def test_failed_pagination_leaves_the_watermark_alone(slack, chroma, monkeypatch):
+    stored, _ = chroma
+    slack.redis_client.set("slack:sync:C1:oldest", "50.0")
+    monkeypatch.setattr(slack, "SLACK_SYNC_BATCH_SIZE", 2)
+    monkeypatch.setattr(slack, "call_slack", FakeSlackApi([_message(f"{ts}.0", f"m{ts}") for ts in range(100, 105)], fail_on_page=1))
+
+    with pytest.raises(SlackApiError):
+        slack.sync_slack_history_to_chroma("C1")
+
+    # The newest page was stored, but older messages were never fetched.
+    assert set(stored) == {"104.0", "103.0"}
+    assert slack.redis_client.get("slack:sync:C1:oldest") == "50.0"
+
+
+def test_thread_is_refetched_only_when_its_latest_reply_moves(slack, monkeypatch):
+    parent = _message("100.0", "disk full", thread_ts="100.0", latest_reply="101.0")
+    threads = {"100.0": [parent, _message("101.0", "cleared /var/log")]}
+    monkeypatch.setattr(slack, "call_slack", FakeSlackApi([parent], threads))
+
+    assert [m["replies"] for m in slack.iter_channel_messages("C1", "150.0", {"100.0": "101.0"})] == []
+
+    parent["latest_reply"] = "102.0"
+    threads["100.0"].append(_message("102.0", "and rotated it"))
+    [thread] = slack.iter_channel_messages("C1", "150.0", {"100.0": "101.0"})
+    assert thread["replies"] == "cleared /var/log\nand rotated it"
+
+
+def test_stale_live_event_does_not_undo_a_newer_one(slack, chroma):
+    stored, deleted = chroma
+    upsert = {"action": "upsert", "channel": "C1", "ts": "100.0", "user": "U1", "text": "edited", "event_ts": "105.0"}
+    delete = {"action": "delete", "channel": "C1", "ts": "100.0", "event_ts": "110.0"}
+
+    slack._apply_live_event(delete, "slack_messages")
+    slack._apply_live_event(upsert, "slack_messages")
+
+    assert deleted == ["100.0"]
+    assert stored == {}
+    assert slack.redis_client.hget("slack:sync:C1:docs", "100.0") is None
+
+
+def test_thread_replies_are_fetched_on_the_reply_pool(slack, monkeypatch):
+    parents = [_message(f"{ts}.0", f"thread {ts}", thread_ts=f"{ts}.0") for ts in range(100, 108)]
+    monkeypatch.setattr(slack, "call_slack", FakeSlackApi(parents, page_size=100))
+    monkeypatch.setattr(slack, "SLACK_REPLY_WORKERS", 8)
+    active, peak = set(), []
+
+    def fetch_thread(channel_id, thread_ts):
+        active.add(thread_ts)
+        peak.append(len(active))
+        time.sleep(0.05)
+        active.discard(thread_ts)
+        return {"ts": thread_ts, "replies": ""}
+
+    monkeypatch.setattr(slack, "fetch_thread", fetch_thread)
+
+    threads = list(slack.iter_channel_messages("C1"))
+
+    assert sorted(thread["ts"] for thread in threads) == [parent["ts"] for parent in parents]
+    assert max(peak) > 1
+
+
+def test_rate_limited_call_pauses_the_method_bucket(slack, monkeypatch):
+    paused, responses = [], iter([429, 200])
+
+    class Bucket:
+        def acquire(self):
+            pass
+
+        def pause(self, seconds):
+            paused.append(seconds)
+
+    def history(**kwargs):
+        status = next(responses)
+        if status == 429:
+            raise SlackApiError("ratelimited", SlackResponse(client=None, http_verb="POST", api_url="", req_args={},
+                                                             data={"ok": False, "error": "ratelimited"}, headers={"Retry-After": "7"}, status_code=429))
+        return "page"
+
+    monkeypatch.setattr(slack, "slack_bucket", lambda method: Bucket())
+    monkeypatch.setattr(slack.slack_client, "conversations_history", history)
+
+    assert slack.call_slack("conversations.history", channel="C1") == "page"
+    assert paused == [7]
@@ -0,0 +1,150 @@
+import asyncio
+import importlib
+import sys
+import time
+import types
+
+import pytest
+
+
+class FakeSlackClient:
+    def __init__(self, channel_id="C123"):
+        self.channel_id = channel_id
+        self.calls = []
+
+    async def chat_postMessage(self, channel, **kwargs):
+        self.calls.append(("post", channel, kwargs))
+        return {"ok": True, "channel": self.channel_id, "ts": f"{len(self.calls)}.000", "message": {"ts": f"{len(self.calls)}.000"}}
+
+    async def chat_update(self, channel, ts, **kwargs):
+        self.calls.append(("update", channel, {"ts": ts, **kwargs}))
+        return {"ok": True, "channel": channel, "ts": ts}
+
+
+@pytest.fixture
+def slack_dispatcher(monkeypatch):
+    # slack.py authenticates against Slack at import time; the dispatcher only needs a client.
+    monkeypatch.setitem(sys.modules, "slack", types.SimpleNamespace(async_slack_client=None))
+    monkeypatch.delitem(sys.modules, "slack_dispatcher", raising=False)
+    module = importlib.import_module("slack_dispatcher")
+    monkeypatch.setattr(module, "SLACK_CHANNEL_POST_INTERVAL", 0.05)
+    return module
+
+
+def test_queued_posts_to_one_thread_are_merged(slack_dispatcher):
+    client = FakeSlackClient()
+    dispatcher = slack_dispatcher.SlackDispatcher(client)
+
+    async def scenario():
+        first = asyncio.ensure_future(dispatcher.post("#on-call", text="root", merge=False))
+        await asyncio.sleep(0)
+        replies = [dispatcher.post("#on-call", text=f"reply {i}", thread_ts="1.000") for i in range(3)]
+        return await first, await asyncio.gather(*replies)
+
+    _, replies = asyncio.run(scenario())
+    assert len(client.calls) == 2
+    _, _, merged = client.calls[1]
+    assert [block["type"] for block in merged["blocks"]] == ["section", "divider", "section", "divider", "section"]
+    assert merged["text"] == "reply 0\n\nreply 1\n\nreply 2"
+    assert replies[0] is replies[1] is replies[2]
+    assert dispatcher.stats["merged"] == 2
+
+
+def test_unmergeable_posts_and_other_threads_stay_separate(slack_dispatcher):
+    client = FakeSlackClient()
+    dispatcher = slack_dispatcher.SlackDispatcher(client)
+
+    async def scenario():
+        await asyncio.gather(
+            dispatcher.post("#on-call", text="a", thread_ts="1.000", merge=False),
+            dispatcher.post("#on-call", text="b", thread_ts="1.000"),
+            dispatcher.post("#on-call", text="c", thread_ts="2.000"),
+        )
+
+    asyncio.run(scenario())
+    assert [kwargs["text"] for _, _, kwargs in client.calls] == ["a", "b", "c"]
+
+
+def test_merging_respects_the_block_limit(slack_dispatcher):
+    client = FakeSlackClient()
+    dispatcher = slack_dispatcher.SlackDispatcher(client)
+    blocks = [slack_dispatcher.section_block("x")] * 30
+
+    async def scenario():
+        await asyncio.gather(*(dispatcher.post("#on-call", text=str(i), blocks=blocks, thread_ts="1.000") for i in range(2)))
+
+    asyncio.run(scenario())
+    assert len(client.calls) == 2
+
+
+def test_pending_edits_collapse_into_the_latest(slack_dispatcher):
+    client = FakeSlackClient()
+    dispatcher = slack_dispatcher.SlackDispatcher(client)
+
+    async def scenario():
+        await asyncio.gather(
+            dispatcher.post("C123", text="blocker"),
+            dispatcher.update("C123", "5.000", text="draft 1"),
+            dispatcher.update("C123", "5.000", text="draft 2"),
+        )
+
+    asyncio.run(scenario())
+    updates = [kwargs["text"] for kind, _, kwargs in client.calls if kind == "update"]
+    assert updates == ["draft 2"]
+
+
+def test_posts_by_name_and_edits_by_id_share_a_queue(slack_dispatcher):
+    client = FakeSlackClient(channel_id="C123")
+    dispatcher = slack_dispatcher.SlackDispatcher(client)
+
+    async def scenario():
+        await dispatcher.post("#on-call", text="first")
+        await dispatcher.post("#on-call", text="second")
+        await dispatcher.update("C123", "1.000", text="edit")
+
+    asyncio.run(scenario())
+    assert dispatcher._channel_key("#on-call") == "C123"
+    assert set(dispatcher._queues) <= {"C123"}
+    assert [channel for _, channel, _ in client.calls] == ["#on-call", "C123", "C123"]
+
+
+def test_pacing_failure_fails_waiting_callers(slack_dispatcher, monkeypatch):
+    client = FakeSlackClient()
+    dispatcher = slack_dispatcher.SlackDispatcher(client)
+
+    class BrokenBucket:
+        async def acquire_async(self):
+            raise RuntimeError("bucket broken")
+
+    monkeypatch.setattr(slack_dispatcher, "slack_bucket", lambda method: BrokenBucket())
+
+    async def scenario():
+        return await asyncio.wait_for(
+            asyncio.gather(dispatcher.update("C123", "1.000", text="a"), dispatcher.update("C123", "2.000", text="b"), return_exceptions=True),
+            timeout=2,
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_processes_sharing_redis_share_the_channel_rate(slack_dispatcher, fake_redis):
+    client = FakeSlackClient()
+    sent_at = []
+
+    async def post(channel, **kwargs):
+        sent_at.append(time.monotonic())
+        return await FakeSlackClient.chat_postMessage(client, channel, **kwargs)
+
+    client.chat_postMessage = post
+    # Two worker processes, each with its own dispatcher and queue.
+    first = slack_dispatcher.SlackDispatcher(client, redis_client=fake_redis)
+    second = slack_dispatcher.SlackDispatcher(client, redis_client=fake_redis)
+
+    async def scenario():
+        await asyncio.gather(*(dispatcher.post("C123", text=str(i), merge=False) for i in range(3) for dispatcher in (first, second)))
+
+    asyncio.run(scenario())
+    gaps = [b - a for a, b in zip(sent_at, sent_at[1:])]
+    assert len(sent_at) == 6
+    assert min(gaps) >= slack_dispatcher.SLACK_CHANNEL_POST_INTERVAL * 0.8
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+
+class FakeDispatcher:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def post(self, channel, text, thread_ts, merge=True):
+        await asyncio.sleep(self.delay)
+        self.calls.append(("post", text))
+        return {"ts": "200.1", "channel": "C1"}
+
+    async def update(self, channel_id, ts, text):
+        await asyncio.sleep(self.delay)
+        self.calls.append(("update", ts, text))
+
+
+@pytest.fixture
+def slack_stream(import_offline, monkeypatch):
+    module = import_offline("slack_stream")
+    monkeypatch.setattr(module, "SLACK_STREAM_UPDATE_SECONDS", 0.05)
+    return module
+
+
+async def _stream(message, pieces, interval):
+    for piece in pieces:
+        message.append(piece)
+        await asyncio.sleep(interval)
+
+
+def test_stream_posts_once_then_edits_at_the_update_rate(slack_stream, monkeypatch):
+    dispatcher = FakeDispatcher(delay=0.01)
+    monkeypatch.setattr(slack_stream, "dispatcher", dispatcher)
+    message = slack_stream.StreamingMessage("#on-call", "100.1", prefix="AI: ")
+
+    async def generate():
+        await _stream(message, [f"w{i} " for i in range(40)], 0.005)
+        await message.finish()
+
+    asyncio.run(generate())
+
+    kinds = [call[0] for call in dispatcher.calls]
+    assert kinds[0] == "post" and set(kinds[1:]) == {"update"}
+    # 40 pieces over ~0.2s at one edit per 0.05s.
+    assert len(dispatcher.calls) <= 8
+    assert all(call[-1].endswith(slack_stream.STREAM_CURSOR) for call in dispatcher.calls[:-1])
+    assert dispatcher.calls[-1] == ("update", "200.1", "AI: " + "".join(f"w{i} " for i in range(40)))
+
+
+def test_retried_stream_edits_the_earlier_message(slack_stream, monkeypatch):
+    dispatcher = FakeDispatcher()
+    monkeypatch.setattr(slack_stream, "dispatcher", dispatcher)
+    message = slack_stream.StreamingMessage("#on-call", "100.1", prefix="AI: ", ts="150.5", channel_id="C1")
+
+    async def retry():
+        message.append("partial")
+        await message.finish("full summary")
+
+    asyncio.run(retry())
+
+    assert [call[0] for call in dispatcher.calls] == ["update"] * len(dispatcher.calls)
+    assert dispatcher.calls[-1] == ("update", "150.5", "AI: full summary")
+
+
+def test_failure_text_replaces_a_partial_summary(slack_stream, monkeypatch):
+    dispatcher = FakeDispatcher(delay=0.02)
+    monkeypatch.setattr(slack_stream, "dispatcher", dispatcher)
+    message = slack_stream.StreamingMessage("#on-call", "100.1", prefix="AI: ")
+
+    async def fail_midway():
+        message.append("the disk on db-01 is")
+        # The first post is still in flight when the summary fails.
+        await asyncio.sleep(0)
+        await message.finish("unable to summarize", prefix="")
+
+    asyncio.run(fail_midway())
+
+    assert dispatcher.calls[0][0] == "post"
+    assert dispatcher.calls[-1] == ("update", "200.1", "unable to summarize")
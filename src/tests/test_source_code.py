@@ -0,0 +1,42 @@
+import pytest
+
+import source_code
+from source_code import is_allowed_git_url
+
+
+@pytest.mark.parametrize("url", [
+    "https://github.com/org/repo.git",
+    "https://gitlab.example.com/group/sub/repo",
+    "ssh://git@github.com/org/repo.git",
+    "git@github.com:org/repo.git",
+])
+def test_remote_git_urls_are_allowed(url):
+    assert is_allowed_git_url(url)
+
+
+@pytest.mark.parametrize("url", [
+    "file:///etc",
+    "/srv/secrets",
+    "../other-repo",
+    "ext::sh -c touch% /tmp/pwned",
+    "http://github.com/org/repo.git",
+    "https://",
+    "--upload-pack=touch /tmp/pwned",
+    "git@github.com:/etc",
+])
+def test_local_and_unsafe_urls_are_rejected(url):
+    assert not is_allowed_git_url(url)
+
+
+def test_changed_files_are_chunked_on_the_process_pool(tmp_path, monkeypatch):
+    (tmp_path / "app.py").write_text("class Orders:\n    def create(self):\n        return 1\n")
+    (tmp_path / "util.go").write_text("package util\n\nfunc Add(a int, b int) int {\n\treturn a + b\n}\n")
+    monkeypatch.setattr(source_code, "CODE_WORKERS", 2)
+    monkeypatch.setattr(source_code, "CODE_FILES_PER_TASK", 1)
+
+    results = {path: (chunks, definitions, error) for path, _, chunks, definitions, error in
+               source_code._iter_chunked_files(str(tmp_path), iter([("app.py", None), ("util.go", None), ("missing.py", None)]))}
+
+    assert results["app.py"][1] == [(1, 3, "Orders"), (2, 3, "Orders.create")]
+    assert results["util.go"][0][0]["metadata"]["symbol"] == "Add"
+    assert results["missing.py"][2] is not None
@@ -0,0 +1,69 @@
+import asyncio
+
+import summary_cache
+from alert_context import AlertContextBuilder
+from summary_cache import canonicalize_context, context_hash
+
+
+def _context(instance="web-01:9100", value="95", starts_at="2024-05-01T10:00:00Z", count=1):
+    alerts = [{
+        "status": "firing",
+        "startsAt": starts_at,
+        "labels": {"alertname": "HighCPU", "severity": "critical", "instance": instance, "job": "node"},
+        "annotations": {"summary": f"CPU on {instance} at {value}%"},
+    }] * count
+    builder = AlertContextBuilder()
+    builder.add(alerts)
+    return builder.render()
+
+
+def _key(context):
+    return context_hash(canonicalize_context(context))
+
+
+def test_recurring_alert_shares_a_key():
+    first = _context(value="95", starts_at="2024-05-01T10:00:00Z", count=2)
+    again = _context(value="97", starts_at="2024-05-02T03:12:45Z", count=3)
+    assert _key(first) == _key(again)
+
+
+def test_different_hosts_do_not_share_a_key():
+    assert _key(_context(instance="web-01:9100")) != _key(_context(instance="web-02:9100"))
+    assert _key(_context(instance="10.0.0.5:9100")) != _key(_context(instance="10.0.0.6:9100"))
+
+
+def test_different_magnitudes_do_not_share_a_key():
+    assert _key(_context(value="95")) != _key(_context(value="5"))
+
+
+def test_group_order_is_ignored():
+    a = "--- A (critical) x1: firing 1 ---\nLabels: job=api\n--- B (warning) x2: firing 2 ---\nLabels: job=db\n"
+    b = "--- B (warning) x5: firing 5 ---\nLabels: job=db\n--- A (critical) x1: firing 1 ---\nLabels: job=api\n"
+    assert canonicalize_context(a) == canonicalize_context(b)
+
+
+def test_label_lines_are_kept_verbatim():
+    canonical = canonicalize_context("--- A (critical) x1: firing 1 ---\nLabels: instance=web-01, pod=api-7f9c-2\n")
+    assert "instance=web-01, pod=api-7f9c-2" in canonical
+
+
+def test_cache_hit_reuses_the_stored_summary_embedding(fake_redis, monkeypatch):
+    monkeypatch.setattr(summary_cache, "redis_client", fake_redis)
+    embedded = []
+
+    async def generate(context):
+        return "CPU is saturated on web-01"
+
+    async def embed(summary):
+        embedded.append(summary)
+        return [0.25, 0.5]
+
+    async def summarize_twice():
+        first = await summary_cache.cached_summary(_context(value="95"), generate, embed=embed)
+        again = await summary_cache.cached_summary(_context(value="97"), generate, embed=embed)
+        return first, again
+
+    first, again = asyncio.run(summarize_twice())
+
+    assert first == again == ("CPU is saturated on web-01", [0.25, 0.5])
+    assert embedded == ["CPU is saturated on web-01"]
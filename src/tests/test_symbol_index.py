@@ -0,0 +1,40 @@
+import pytest
+
+from symbol_index import StackFrame, complete_ranges, parse_stack_frames
+
+
+@pytest.mark.parametrize("text", [
+    "node_exporter on web-01.prod.example.com:9100 is down",
+    "connection refused to db.internal:5432",
+    "scrape of 10.0.0.5:9100 failed",
+    "see http://grafana.example.com:3000/d/abc",
+])
+def test_host_port_is_not_a_frame(text):
+    assert parse_stack_frames(text) == []
+
+
+def test_parses_each_frame_style_in_order():
+    text = "\n".join([
+        'File "/app/orders/api.py", line 42, in create',
+        "at com.shop.api.OrderService.create(OrderService.java:17)",
+        "at createOrder (/app/src/orders.js:9:13)",
+        "app/models/order.rb:5:in `save'",
+        "failed in main.go:3.",
+    ])
+    assert parse_stack_frames(text) == [
+        StackFrame("/app/orders/api.py", 42, "create"),
+        StackFrame("OrderService.java", 17, "com.shop.api.OrderService.create"),
+        StackFrame("/app/src/orders.js", 9, "createOrder"),
+        StackFrame("app/models/order.rb", 5, "save"),
+        StackFrame("main.go", 3, None),
+    ]
+
+
+def test_repeated_frames_are_deduplicated():
+    assert parse_stack_frames("src/main.rs:42:5 then src/main.rs:42:5") == [StackFrame("src/main.rs", 42, None)]
+
+
+def test_complete_ranges_run_to_the_next_definition():
+    assert complete_ranges([(1, None, "a"), (5, 8, "b"), (10, None, "c")], 20) == [
+        (1, 4, "a"), (5, 8, "b"), (10, 20, "c"),
+    ]
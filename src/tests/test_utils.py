@@ -0,0 +1,111 @@
+import threading
+import zipfile
+from contextlib import closing
+
+import pytest
+
+from utils import ArchiveBudget, ArchiveLimitError, batched, extract_archive, prefetch, process_map_unordered, safe_archive_path
+
+
+def test_batched_splits_without_losing_items():
+    assert list(batched(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(batched([], 3)) == []
+
+
+def test_prefetch_yields_everything_in_order():
+    assert list(prefetch(iter(range(100)), maxsize=2)) == list(range(100))
+
+
+def test_prefetch_reraises_producer_errors():
+    def failing():
+        yield 1
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        list(prefetch(failing(), maxsize=2))
+
+
+def test_prefetch_stops_the_producer_when_the_consumer_stops():
+    closed = threading.Event()
+
+    def endless():
+        try:
+            n = 0
+            while True:
+                yield n
+                n += 1
+        finally:
+            closed.set()
+
+    items = prefetch(endless(), maxsize=1)
+    assert next(items) == 0
+    items.close()
+    assert closed.wait(timeout=5)
+
+
+def test_wrapped_source_can_be_closed_once_prefetch_is_closed():
+    closed = threading.Event()
+
+    def messages():
+        try:
+            n = 0
+            while True:
+                yield n
+                n += 1
+        finally:
+            closed.set()
+
+    source = messages()
+    with closing(source), closing(prefetch(batched(source, 2), maxsize=1)) as batches:
+        assert next(batches) == [0, 1]
+    # Closed synchronously: prefetch joined its producer, so `source` was not running in it.
+    assert closed.is_set()
+
+
+def test_safe_archive_path_rejects_escapes():
+    assert safe_archive_path("docs/runbook.md") == "docs/runbook.md"
+    assert safe_archive_path("docs/../runbook.md") == "runbook.md"
+    assert safe_archive_path("../etc/passwd") is None
+    assert safe_archive_path("/etc/passwd") is None
+
+
+def _zip(path, members):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return str(path)
+
+
+def test_extract_archive_writes_wanted_members_inside_the_root(tmp_path):
+    archive = _zip(tmp_path / "docs.zip", {"a/one.md": "# One", "two.pdf": "%PDF", "skip.bin": "x", "../evil.md": "# Evil"})
+    out = tmp_path / "out"
+
+    extracted = extract_archive(archive, lambda name: str(out / name), lambda name, size: name.endswith(".md"))
+
+    assert [name for name, _ in extracted] == ["a/one.md"]
+    assert (out / "a" / "one.md").read_text() == "# One"
+
+
+def test_extract_archive_budget_is_checked_before_writing(tmp_path):
+    # Compresses to a few KB and declares 8 MB uncompressed.
+    archive = _zip(tmp_path / "bomb.zip", {"big.md": "0" * (8 * 1024 * 1024)})
+    out = tmp_path / "out"
+
+    with pytest.raises(ArchiveLimitError):
+        extract_archive(archive, lambda name: str(out / name), lambda name, size: True, ArchiveBudget(max_bytes=1024 * 1024))
+    assert not out.exists()
+
+
+def test_archive_budget_is_cumulative_across_archives(tmp_path):
+    budget = ArchiveBudget(max_members=3)
+    first = _zip(tmp_path / "first.zip", {"a.md": "a", "b.md": "b"})
+    second = _zip(tmp_path / "second.zip", {"c.md": "c", "d.md": "d"})
+
+    extract_archive(first, lambda name: str(tmp_path / "1" / name), lambda name, size: True, budget)
+    with pytest.raises(ArchiveLimitError):
+        extract_archive(second, lambda name: str(tmp_path / "2" / name), lambda name, size: True, budget)
+
+
+def test_process_map_unordered_returns_every_result():
+    tasks = batched(range(50), 7)
+    assert sorted(process_map_unordered(sum, tasks, workers=2)) == sorted(sum(batch) for batch in batched(range(50), 7))
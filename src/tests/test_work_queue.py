@@ -0,0 +1,89 @@
+import asyncio
+
+import work_queue
+
+
+def test_promote_delayed_moves_due_jobs_once(fake_redis):
+    async def scenario():
+        await work_queue.schedule(fake_redis, "flush", {"incident_id": "i1", "thread_ts": "1.2"}, delay=0)
+        await work_queue.schedule(fake_redis, "flush", {"incident_id": "i2", "thread_ts": "3.4"}, delay=3600)
+        first = await work_queue.promote_delayed(fake_redis)
+        second = await work_queue.promote_delayed(fake_redis)
+        entries = await fake_redis.xrange(work_queue.stream_name("flush"))
+        return first, second, entries, await fake_redis.zcard(work_queue.DELAYED_KEY)
+
+    first, second, entries, still_delayed = asyncio.run(scenario())
+    assert (first, second) == (1, 0)
+    assert [fields for _, fields in entries] == [{"incident_id": "i1", "thread_ts": "1.2"}]
+    assert still_delayed == 1
+
+
+def test_failed_job_is_rescheduled_and_acked(fake_redis, monkeypatch):
+    monkeypatch.setattr(work_queue, "RETRY_BASE_SECONDS", 0)
+
+    async def failing(fields):
+        raise RuntimeError("downstream unavailable")
+
+    async def scenario():
+        await work_queue.ensure_groups(fake_redis, ["investigate"])
+        await work_queue.enqueue(fake_redis, "investigate", {"incident_id": "i1"})
+        stream = work_queue.stream_name("investigate")
+        [(_, [(entry_id, fields)])] = await fake_redis.xreadgroup(work_queue.CONSUMER_GROUP, "w1", {stream: ">"})
+        await work_queue._process(fake_redis, "investigate", failing, entry_id, fields, "w1")
+        pending = await fake_redis.xpending(stream, work_queue.CONSUMER_GROUP)
+        await work_queue.promote_delayed(fake_redis)
+        return pending["pending"], await fake_redis.xrange(stream)
+
+    pending, entries = asyncio.run(scenario())
+    assert pending == 0
+    retried = entries[-1][1]
+    assert retried["attempt"] == "1" and retried["incident_id"] == "i1"
+
+
+def test_running_job_heartbeat_keeps_it_from_being_reclaimed(fake_redis, monkeypatch):
+    monkeypatch.setattr(work_queue, "HEARTBEAT_SECONDS", 0.05)
+    stream = work_queue.stream_name("investigate")
+    idle_times = []
+
+    async def slow(fields):
+        await asyncio.sleep(0.3)
+        [entry] = await fake_redis.xpending_range(stream, work_queue.CONSUMER_GROUP, "-", "+", 1)
+        idle_times.append(entry["time_since_delivered"])
+
+    async def scenario():
+        await work_queue.ensure_groups(fake_redis, ["investigate"])
+        await work_queue.enqueue(fake_redis, "investigate", {"incident_id": "i1"})
+        [(_, [(entry_id, fields)])] = await fake_redis.xreadgroup(work_queue.CONSUMER_GROUP, "w1", {stream: ">"})
+        await work_queue._process(fake_redis, "investigate", slow, entry_id, fields, "w1")
+
+    asyncio.run(scenario())
+    assert idle_times[0] < 200
+
+
+def test_reclaimed_jobs_run_concurrently_under_the_worker_limit(fake_redis, monkeypatch):
+    monkeypatch.setattr(work_queue, "CLAIM_IDLE_MS", 50)
+    monkeypatch.setattr(work_queue, "HEARTBEAT_SECONDS", 0.01)
+    monkeypatch.setattr(work_queue, "READ_BLOCK_MS", 10)
+    running, peak, done = set(), [0], []
+
+    async def slow(fields):
+        running.add(fields["incident_id"])
+        peak[0] = max(peak[0], len(running))
+        await asyncio.sleep(0.1)
+        running.discard(fields["incident_id"])
+        done.append(fields["incident_id"])
+
+    async def scenario():
+        await work_queue.ensure_groups(fake_redis, ["investigate"])
+        for i in range(4):
+            await work_queue.enqueue(fake_redis, "investigate", {"incident_id": f"i{i}"})
+        # A dead worker read the jobs and never acked them.
+        await fake_redis.xreadgroup(work_queue.CONSUMER_GROUP, "dead", {work_queue.stream_name("investigate"): ">"})
+        await asyncio.sleep(0.06)
+        worker = asyncio.create_task(work_queue.run_worker(fake_redis, {"investigate": slow}, "w1", concurrency=2))
+        await asyncio.sleep(0.35)
+        worker.cancel()
+
+    asyncio.run(scenario())
+    assert sorted(done) == ["i0", "i1", "i2", "i3"]
+    assert peak[0] == 2
@@ -1,15 +1,192 @@
 from datetime import datetime
+import itertools
+import logging
+import multiprocessing
 import os
+import queue
+import shutil
+import tarfile
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
 import yaml
 from models import EventPayload, EventSeverity, PrometheusAlert, PrometheusWebhookPayload
+from service_catalog import ServiceCatalog, catalog
+
+T = TypeVar("T")
+_DONE = object()
+PREFETCH_POLL_SECONDS = 0.5
+
+UPLOAD_READ_SIZE = 1024 * 1024
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+# Budget for everything one upload job extracts, across all of its archives.
+ARCHIVE_MAX_MEMBERS = int(os.environ.get("ARCHIVE_MAX_MEMBERS", "20000"))
+ARCHIVE_MAX_BYTES = int(os.environ.get("ARCHIVE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Pools start from request threads while the embed and SQLite threads run, and a forked child can
+# inherit a lock one of them held. Workers come from a clean forkserver process (spawn where there is none).
+_POOL_CONTEXT = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Yields lists of at most `size` items without materializing the input."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(items: Iterable[T], maxsize: int) -> Iterator[T]:
+    """
+    Runs the producer on a background thread, at most `maxsize` items ahead of
+    the consumer. A slow consumer blocks the producer instead of growing memory.
+    Close the returned generator (or exhaust it) to stop the producer: if the
+    consumer raises or stops early, the producer sees the stop flag within
+    PREFETCH_POLL_SECONDS and closes its source instead of blocking forever.
+    Closing waits for the producer thread to exit, so once it returns nothing
+    is still running inside the source and the caller may close what it wraps.
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=maxsize)
+    error: List[BaseException] = []
+    stop = threading.Event()
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=PREFETCH_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce():
+        source = iter(items)
+        try:
+            for item in source:
+                if not _put(item):
+                    break
+        except BaseException as e:
+            error.append(e)
+        finally:
+            if stop.is_set() and hasattr(source, "close"):
+                # Releases whatever the source holds, e.g. the Slack reply pool.
+                source.close()
+            _put(_DONE)
+
+    producer = threading.Thread(target=_produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+    if error:
+        raise error[0]
+
+
+def process_map_unordered(func: Callable[[T], Any], tasks: Iterable[T], workers: int, initializer: Optional[Callable] = None, initargs: Sequence = ()) -> Iterator[Any]:
+    """
+    Runs `func` over `tasks` on a process pool and yields results as they finish,
+    not in task order. Only a couple of tasks per worker are queued at a time,
+    so results stream out and never pile up ahead of a slow consumer. Workers
+    import `func`'s module, so it should be a light one.
+    """
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CONTEXT, initializer=initializer, initargs=tuple(initargs)) as pool:
+        pending = {pool.submit(func, task) for _, task in zip(range(workers * 2), tasks)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                for task in itertools.islice(tasks, 1):
+                    pending.add(pool.submit(func, task))
+
+
+def safe_archive_path(name: str) -> Optional[str]:
+    """Normalized archive member path, None for anything that would escape the extraction root."""
+    normalized = os.path.normpath(name).replace("\\", "/")
+    if normalized.startswith(("/", "../")) or normalized in (".", "..") or os.path.isabs(normalized):
+        return None
+    return normalized
+
+
+class ArchiveLimitError(ValueError):
+    """An upload would extract more members or bytes than its ArchiveBudget allows."""
+
+
+class ArchiveBudget:
+    """Cumulative member and uncompressed byte limits shared by every archive of one upload job."""
+
+    def __init__(self, max_members: int = ARCHIVE_MAX_MEMBERS, max_bytes: int = ARCHIVE_MAX_BYTES):
+        self.max_members = max_members
+        self.max_bytes = max_bytes
+        self.members = 0
+        self.bytes = 0
+
+    def charge(self, members: int, size: int) -> None:
+        self.members += members
+        self.bytes += size
+        if self.members > self.max_members:
+            raise ArchiveLimitError(f"Upload has more than {self.max_members} files")
+        if self.bytes > self.max_bytes:
+            raise ArchiveLimitError(f"Upload expands to more than {self.max_bytes} bytes")
+
+
+@contextmanager
+def _archive_members(archive_path: str) -> Iterator[List[Tuple[str, int, Callable]]]:
+    """(safe path, uncompressed size, opener) for every regular file in a zip or tar, valid inside the block."""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            yield [
+                (name, info.file_size, lambda info=info: archive.open(info))
+                for info in archive.infolist() if not info.is_dir() and (name := safe_archive_path(info.filename))
+            ]
+    else:
+        with tarfile.open(archive_path, "r:*") as archive:
+            yield [
+                (name, member.size, lambda member=member: archive.extractfile(member))
+                for member in archive.getmembers() if member.isfile() and (name := safe_archive_path(member.name))
+            ]
 
-def yaml_to_dict():
-    file = None
-    with open("services.yaml") as f:
-        file = f.read()
 
-    yaml_dict = yaml.safe_load(file)
-    return yaml_dict
+def extract_archive(archive_path: str, destination: Callable[[str], str], wanted: Callable[[str, int], bool], budget: Optional[ArchiveBudget] = None) -> List[Tuple[str, str]]:
+    """
+    Writes the archive members `wanted(name, size)` accepts to `destination(name)`
+    and returns (name, path) pairs. Paths that would escape the extraction root
+    are skipped. Declared sizes are charged to `budget` for the whole archive
+    before anything is written, so a zip bomb fails without touching the disk.
+    Raises ArchiveLimitError, zipfile.BadZipFile or tarfile.TarError.
+    """
+    budget = budget or ArchiveBudget()
+    extracted = []
+    with _archive_members(archive_path) as members:
+        members = [(name, size, opener) for name, size, opener in members if wanted(name, size)]
+        budget.charge(len(members), sum(size for _, size, _ in members))
+
+        for name, _, opener in members:
+            source = opener()
+            if source is None:
+                continue
+            path = destination(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with source, open(path, "wb") as out:
+                shutil.copyfileobj(source, out, UPLOAD_READ_SIZE)
+            extracted.append((name, path))
+    return extracted
+
+
+def yaml_to_dict():
+    """The service catalog as the services.yaml structure, served from memory."""
+    return {"services": catalog.services()}
 
 # def webhook_to_event_payload(payload: WebhookPayload):
 
@@ -46,8 +223,7 @@ def build_slack_blocks(event_payload: EventPayload) -> list:
     else: # Info
         header_icon = "ℹ️"
 
-    services = yaml_to_dict()
-    service_context = services.get('services', {}).get(event_payload.source)
+    service_context = catalog.get(event_payload.source)
     ts_unix = int(event_payload.timestamp.timestamp())
     formatted_ts = f"<!date^{ts_unix}^{{date_num}} {{time_secs}}|{event_payload.timestamp.isoformat()}>"
 
@@ -173,80 +349,17 @@ def prome_to_event_payload(alert: PrometheusAlert):
 
 def check_service_yaml(
     service_name: str,
-    file_path: str = "src/services.yaml",
+    file_path: Optional[str] = None,
     new_runbooks: list = None,
     new_dashboards: list = None):
-
-    data = {}
-    file_existed = os.path.exists(file_path)
-
-    if file_existed:
-        try:
-            with open(file_path, 'r') as file:
-                data = yaml.safe_load(file)
-                if data is None: # Handle empty YAML file
-                    data = {}
-        except yaml.YAMLError as e:
-            print(f"Error parsing YAML from '{file_path}': {e}")
-            return False
-        except Exception as e:
-            print(f"An unexpected error occurred while reading '{file_path}': {e}")
-            return False
-
-    if 'services' not in data or not isinstance(data['services'], dict):
-        data['services'] = {}
-
-
-    if service_name not in data['services'] or not isinstance(data['services'][service_name], dict):
-        data['services'][service_name] = {}
-
-    service_config = data['services'][service_name]
-    updated = False 
-
-    if 'runbooks' not in service_config or not isinstance(service_config['runbooks'], list):
-        service_config['runbooks'] = []
-        updated = True
-
-    if new_runbooks:
-        for new_rb in new_runbooks:
-            found = False
-            for existing_rb in service_config['runbooks']:
-                if existing_rb.get('name') == new_rb.get('name') and \
-                   existing_rb.get('url') == new_rb.get('url'):
-                    found = True
-                    break
-            if not found:
-                service_config['runbooks'].append(new_rb)
-                updated = True
-                print(f"Added runbook: {new_rb.get('name')} to service '{service_name}'")
-
-    if 'dashboards' not in service_config or not isinstance(service_config['dashboards'], list):
-        service_config['dashboards'] = []
-        updated = True
-
-    if new_dashboards:
-        for new_db in new_dashboards:
-            found = False
-            for existing_db in service_config['dashboards']:
-                if existing_db.get('name') == new_db.get('name') and \
-                   existing_db.get('url') == new_db.get('url'):
-                    found = True
-                    break
-            if not found:
-                service_config['dashboards'].append(new_db)
-                updated = True
-                print(f"Added dashboard: {new_db.get('name')} to service '{service_name}'")
-
-    # Write back to file only if changes were made
-    if updated or not file_existed: # If file didn't exist, we created structure, so write it
-        try:
-            with open(file_path, 'w') as file:
-                yaml.dump(data, file, default_flow_style=False, sort_keys=False, indent=2)
-            print(f"File '{file_path}' {'updated' if updated else 'created'} successfully.")
-            return True
-        except Exception as e:
-            print(f"Error writing to YAML file '{file_path}': {e}")
-            return False
-    else:
-        print(f"No changes needed for file '{file_path}'.")
-        return True
\ No newline at end of file
+    """Adds runbooks and dashboards to a service through the locked, atomic catalog writer."""
+    service_catalog = catalog if file_path is None else ServiceCatalog(file_path)
+    try:
+        service_catalog.update_service(service_name, runbooks=new_runbooks, dashboards=new_dashboards)
+        return True
+    except yaml.YAMLError as e:
+        logging.error(f"Error parsing YAML from '{service_catalog.path}': {e}")
+        return False
+    except Exception as e:
+        logging.error(f"Error updating service catalog '{service_catalog.path}': {e}")
+        return False
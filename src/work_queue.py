@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+import redis
+import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+
+STREAM_PREFIX = "incidents:stream"
+DEAD_LETTER_STREAM = "incidents:dead"
+DELAYED_KEY = "incidents:delayed"
+CONSUMER_GROUP = "incident-workers"
+
+STREAM_MAXLEN = int(os.environ.get("INCIDENT_STREAM_MAXLEN", "100000"))
+MAX_ATTEMPTS = int(os.environ.get("INCIDENT_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.environ.get("INCIDENT_RETRY_BASE_SECONDS", "2"))
+CLAIM_IDLE_MS = int(os.environ.get("INCIDENT_CLAIM_IDLE_MS", "300000"))
+# A running job re-claims itself this often, so only jobs of dead workers ever reach CLAIM_IDLE_MS.
+HEARTBEAT_SECONDS = CLAIM_IDLE_MS / 1000 / 3
+PROMOTE_BATCH = 100
+READ_BLOCK_MS = 1000
+READ_COUNT = 10
+
+StageHandler = Callable[[Dict[str, str]], Awaitable[None]]
+
+
+def stream_name(stage: str) -> str:
+    return f"{STREAM_PREFIX}:{stage}"
+
+
+async def enqueue(redis_client: aioredis.Redis, stage: str, fields: Dict[str, str]) -> str:
+    """Appends a job for a workflow stage, returns the stream entry id."""
+    return await redis_client.xadd(stream_name(stage), fields, maxlen=STREAM_MAXLEN, approximate=True)
+
+
+def enqueue_sync(redis_client: redis.Redis, stage: str, fields: Dict[str, str]) -> str:
+    """Same as enqueue, for producers that run outside the event loop."""
+    return redis_client.xadd(stream_name(stage), fields, maxlen=STREAM_MAXLEN, approximate=True)
+
+
+async def schedule(redis_client: aioredis.Redis, stage: str, fields: Dict[str, str], delay: float) -> None:
+    """Enqueues a job for a stage once `delay` seconds have passed."""
+    job = json.dumps({"stage": stage, "fields": fields}, sort_keys=True)
+    await redis_client.zadd(DELAYED_KEY, {job: time.time() + delay})
+
+
+# ZREM and XADD run as one script, so a job is never lost between them and only one worker promotes it.
+_PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local promoted = 0
+for _, job in ipairs(due) do
+    if redis.call('ZREM', KEYS[1], job) == 1 then
+        local data = cjson.decode(job)
+        local args = {ARGV[3] .. ':' .. data.stage, 'MAXLEN', '~', ARGV[4], '*'}
+        for field, value in pairs(data.fields) do
+            table.insert(args, field)
+            table.insert(args, value)
+        end
+        redis.call('XADD', unpack(args))
+        promoted = promoted + 1
+    end
+end
+return promoted
+"""
+
+
+async def promote_delayed(redis_client: aioredis.Redis) -> int:
+    """Moves every due delayed job onto its stage stream. Safe to run from every worker."""
+    return await redis_client.eval(_PROMOTE_SCRIPT, 1, DELAYED_KEY, time.time(), PROMOTE_BATCH, STREAM_PREFIX, STREAM_MAXLEN)
+
+
+async def ensure_groups(redis_client: aioredis.Redis, stages) -> None:
+    for stage in stages:
+        try:
+            await redis_client.xgroup_create(stream_name(stage), CONSUMER_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+
+async def _fail(redis_client: aioredis.Redis, stage: str, entry_id: str, fields: Dict[str, str], error: Exception) -> None:
+    """Retries a failed job with exponential backoff, or dead-letters it after MAX_ATTEMPTS."""
+    attempt = int(fields.get("attempt", "0")) + 1
+    retry_fields = {**fields, "attempt": str(attempt), "last_error": str(error)[:500]}
+
+    if attempt >= MAX_ATTEMPTS:
+        logging.error(f"Dead-lettering {stage} job {entry_id} after {attempt} attempts: {error}")
+        await redis_client.xadd(
+            DEAD_LETTER_STREAM,
+            {**retry_fields, "stage": stage, "entry_id": entry_id},
+            maxlen=STREAM_MAXLEN,
+            approximate=True
+        )
+    else:
+        delay = RETRY_BASE_SECONDS * (2 ** (attempt - 1))
+        logging.warning(f"Retrying {stage} job {entry_id} in {delay}s (attempt {attempt}): {error}")
+        await schedule(redis_client, stage, retry_fields, delay)
+
+    await redis_client.xack(stream_name(stage), CONSUMER_GROUP, entry_id)
+
+
+async def _heartbeat(redis_client: aioredis.Redis, stage: str, entry_id: str, consumer: str) -> None:
+    """Resets the entry's idle time while its handler runs, so XAUTOCLAIM leaves a long stage alone."""
+    while True:
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        try:
+            await redis_client.xclaim(stream_name(stage), CONSUMER_GROUP, consumer, min_idle_time=0, message_ids=[entry_id], justid=True)
+        except Exception as e:
+            logging.warning(f"Heartbeat for {stage} job {entry_id} failed: {e}")
+
+
+async def _process(redis_client: aioredis.Redis, stage: str, handler: StageHandler, entry_id: str, fields: Dict[str, str], consumer: str) -> None:
+    heartbeat = asyncio.create_task(_heartbeat(redis_client, stage, entry_id, consumer))
+    try:
+        await handler(fields)
+    except Exception as e:
+        await _fail(redis_client, stage, entry_id, fields, e)
+        return
+    finally:
+        heartbeat.cancel()
+    await redis_client.xack(stream_name(stage), CONSUMER_GROUP, entry_id)
+
+
+async def _reclaim(redis_client: aioredis.Redis, stage: str, consumer: str) -> List[Tuple[str, Dict[str, str]]]:
+    """Takes over jobs left unacked by a worker that died mid-stage and returns them for dispatch."""
+    result = await redis_client.xautoclaim(stream_name(stage), CONSUMER_GROUP, consumer, min_idle_time=CLAIM_IDLE_MS, count=READ_COUNT)
+    return [(entry_id, fields) for entry_id, fields in result[1] if fields is not None]
+
+
+async def run_worker(redis_client: aioredis.Redis, handlers: Dict[str, StageHandler], consumer: str, concurrency: int = 4) -> None:
+    """
+    Consumes every stage stream as `consumer` in the shared consumer group.
+    Start more processes with distinct consumer names to scale out.
+    """
+    await ensure_groups(redis_client, handlers)
+    streams = {stream_name(stage): ">" for stage in handlers}
+    stage_by_stream = {stream_name(stage): stage for stage in handlers}
+    in_flight = asyncio.Semaphore(concurrency)
+    tasks = set()
+    # Entries this worker holds, so XAUTOCLAIM handing back one still queued or running here is skipped.
+    held = set()
+    last_reclaim = 0.0
+
+    async def _run(stage: str, entry_id: str, fields: Dict[str, str]):
+        try:
+            await _process(redis_client, stage, handlers[stage], entry_id, fields, consumer)
+        finally:
+            in_flight.release()
+            held.discard(entry_id)
+
+    async def _dispatch(stage: str, entries: List[Tuple[str, Dict[str, str]]]):
+        # Reclaimed and fresh jobs share the concurrency limit and run as tasks, never inline in the read loop.
+        for entry_id, fields in entries:
+            if entry_id in held:
+                continue
+            held.add(entry_id)
+            await in_flight.acquire()
+            task = asyncio.create_task(_run(stage, entry_id, fields))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    while True:
+        await promote_delayed(redis_client)
+
+        if time.monotonic() - last_reclaim > CLAIM_IDLE_MS / 1000:
+            last_reclaim = time.monotonic()
+            for stage in handlers:
+                await _dispatch(stage, await _reclaim(redis_client, stage, consumer))
+
+        response = await redis_client.xreadgroup(CONSUMER_GROUP, consumer, streams, count=READ_COUNT, block=READ_BLOCK_MS)
+        for stream, entries in response or []:
+            await _dispatch(stage_by_stream[stream], entries)
+
+
+async def dead_letters(redis_client: aioredis.Redis, count: int = 100):
+    """Lists dead-lettered jobs for inspection or manual replay."""
+    return await redis_client.xrange(DEAD_LETTER_STREAM, count=count)
@@ -0,0 +1,30 @@
+import argparse
+import asyncio
+import logging
+import os
+import socket
+from dotenv import load_dotenv
+import work_queue
+from prome import STAGE_HANDLERS, redis_client
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consumes incident workflow stages from the Redis Streams queue.")
+    parser.add_argument("--consumer", default=f"{socket.gethostname()}-{os.getpid()}",
+                        help="Unique consumer name within the worker group.")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("INCIDENT_WORKER_CONCURRENCY", "4")),
+                        help="Jobs this process runs at once.")
+    parser.add_argument("--stages", nargs="+", choices=sorted(STAGE_HANDLERS), default=sorted(STAGE_HANDLERS),
+                        help="Only consume these stages, e.g. to give the LLM stage its own pool.")
+    args = parser.parse_args()
+
+    handlers = {stage: STAGE_HANDLERS[stage] for stage in args.stages}
+    logging.info(f"Worker {args.consumer} consuming {', '.join(handlers)}")
+    asyncio.run(work_queue.run_worker(redis_client, handlers, args.consumer, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()